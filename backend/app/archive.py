@@ -0,0 +1,173 @@
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import and_, delete, func, insert, or_, select, update
+from sqlalchemy.orm import Session
+
+from . import models
+from .config import get_settings
+
+# 取引履歴のアーカイブ
+# 返却済み・却下・取り消し（status が NULL）の取引のうち、完了してから（closed_at）ARCHIVE_AFTER_DAYS 日たったものを、
+# item_transaction から item_transaction_archive へ id の大きい順に ARCHIVE_BATCH_SIZE 件ずつ移す。
+#   - 1 バッチの INSERT ... SELECT と DELETE は同じトランザクションで行う（途中で止まっても重複・欠落しない）
+#   - related_transaction_id で参照されている取引は、参照している取引がすべて移るまで残す
+#     （先に消すと参照が ON DELETE SET NULL で外れてしまう）。参照する側の方が id が大きいので、大きい順に見れば先に決まる
+# 一覧の取得では既定で item_transaction だけを読む。期間の指定か include_archive があり、
+# それがアーカイブした期間にかかるときだけアーカイブも読む（needs_archive）。
+# 使い方: python -m app.archive [status|dry-run|run]
+
+CLOSED_STATUSES = ("returned", "rejected")  # と、取り消し（status が NULL）
+OPEN_STATUSES = ("request", "approved")
+
+hot = models.ItemTransaction.__table__
+cold = models.ItemTransactionArchive.__table__
+COLUMNS = [column.name for column in hot.columns]
+
+
+def cutoff(after_days: Optional[int] = None) -> datetime:
+    days = after_days if after_days is not None else get_settings().archive_after_days
+    return datetime.now() - timedelta(days=days)
+
+
+def closed_condition():
+    return or_(hot.c.status.in_(CLOSED_STATUSES), hot.c.status.is_(None))
+
+
+def archivable(before: datetime):
+    # 借りた日時ではなく完了した日時で決める（長く借りて昨日返したものをすぐに移さない）
+    return and_(closed_condition(), hot.c.closed_at < before)
+
+
+def backfill_closed_at(db: Session, now: Optional[datetime] = None) -> int:
+    # closed_at のない完了済みの取引に、返却の取引（type="return" で参照しているもの）の日時を入れる。
+    # 返却の取引がなければ今の日時にする（完了した日時が分からないので、ARCHIVE_AFTER_DAYS 日たつまで移さない）
+    # MySQL は UPDATE の対象のテーブルを副問い合わせで読めないので、先に読んでから 1 件ずつ書く
+    returned = db.execute(
+        select(hot.c.related_transaction_id, func.max(hot.c.transaction_date))
+        .where(hot.c.type == "return", hot.c.related_transaction_id.is_not(None))
+        .group_by(hot.c.related_transaction_id)
+    ).all()
+    count = 0
+    for parent_id, returned_at in returned:
+        count += db.execute(
+            update(hot).where(hot.c.id == parent_id, closed_condition(), hot.c.closed_at.is_(None)).values(closed_at=returned_at)
+        ).rowcount
+    count += db.execute(update(hot).where(closed_condition(), hot.c.closed_at.is_(None)).values(closed_at=now or datetime.now())).rowcount
+    db.commit()
+    return count
+
+
+def archive_batch(db: Session, before: datetime, batch_size: int, below_id: Optional[int] = None):
+    # 戻り値: (次のバッチで使う below_id, 移した件数)。候補がなくなったら below_id は None
+    stmt = select(hot.c.id).where(archivable(before))
+    if below_id is not None:
+        stmt = stmt.where(hot.c.id < below_id)
+    ids = db.execute(stmt.order_by(hot.c.id.desc()).limit(batch_size)).scalars().all()
+    if not ids:
+        return None, 0
+
+    children = {}
+    for parent_id, child_id in db.execute(
+        select(hot.c.related_transaction_id, hot.c.id).where(hot.c.related_transaction_id.in_(ids))
+    ):
+        children.setdefault(parent_id, []).append(child_id)
+    moving = set()
+    for tx_id in ids:
+        # 参照している取引（id が大きいので判定済み）がすべて移るときだけ移す
+        if all(child_id in moving for child_id in children.get(tx_id, ())):
+            moving.add(tx_id)
+
+    if moving:
+        db.execute(insert(cold).from_select(COLUMNS, select(*[hot.c[name] for name in COLUMNS]).where(hot.c.id.in_(moving))))
+        db.execute(delete(hot).where(hot.c.id.in_(moving)))
+    db.commit()
+    return min(ids), len(moving)
+
+
+def run(db: Session, after_days: Optional[int] = None, batch_size: Optional[int] = None, max_batches: Optional[int] = None, pause: Optional[float] = None, dry_run: bool = False, log=print) -> dict:
+    settings = get_settings()
+    batch_size = batch_size or settings.archive_batch_size
+    max_batches = max_batches or settings.archive_max_batches
+    pause = settings.archive_pause if pause is None else pause
+    before = cutoff(after_days)
+
+    if dry_run:
+        # 参照で残る分も数えるので、実際に移る件数はこれ以下になる
+        count = db.execute(select(func.count()).select_from(hot).where(archivable(before))).scalar()
+        return {"cutoff": before.isoformat(), "dry_run": True, "candidates": count}
+
+    start = time.perf_counter()
+    archived = batches = 0
+    below_id = None
+    while batches < max_batches:
+        below_id, moved = archive_batch(db, before, batch_size, below_id)
+        if below_id is None:
+            break
+        batches += 1
+        archived += moved
+        log(f"アーカイブ: {archived} 件（id < {below_id}）")
+        # ロックを取り合う通常のリクエストに間を譲る
+        if pause:
+            time.sleep(pause)
+    return {
+        "cutoff": before.isoformat(),
+        "dry_run": False,
+        "archived": archived,
+        "batches": batches,
+        # max_batches で打ち切ったときは False（次の実行で続きから移す）
+        "done": below_id is None,
+        "elapsed_s": round(time.perf_counter() - start, 2),
+    }
+
+
+def horizon_statement():
+    # アーカイブにある最も新しい取引の日時（空なら NULL）
+    return select(func.max(cold.c.transaction_date))
+
+
+def wants_archive(status: Optional[str], date_from: Optional[datetime] = None, date_to: Optional[datetime] = None, include_archive: bool = False) -> bool:
+    # アーカイブの範囲（horizon）を調べる必要があるか
+    # 申請中・貸出中の取引は移さないので、そのときはアーカイブを読まない
+    if status in OPEN_STATUSES:
+        return False
+    return include_archive or date_from is not None or date_to is not None
+
+
+def needs_archive(status: Optional[str], date_from: Optional[datetime], horizon: Optional[datetime], date_to: Optional[datetime] = None, include_archive: bool = False) -> bool:
+    if horizon is None or not wants_archive(status, date_from, date_to, include_archive):
+        return False
+    return date_from is None or date_from <= horizon
+
+
+def status(db: Session) -> dict:
+    return {
+        "hot": db.execute(select(func.count()).select_from(hot)).scalar(),
+        "archive": db.execute(select(func.count()).select_from(cold)).scalar(),
+        "horizon": db.execute(horizon_statement()).scalar(),
+    }
+
+
+def main(argv):
+    from .database import SessionLocal
+
+    command = argv[1] if len(argv) > 1 else "status"
+    if command not in ("status", "dry-run", "run"):
+        print("使い方: python -m app.archive [status|dry-run|run]")
+        return 2
+
+    db = SessionLocal()
+    try:
+        if command == "status":
+            print(status(db))
+        else:
+            print(run(db, dry_run=command == "dry-run"))
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,116 @@
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime
+from typing import Optional
+
+from . import archive, crud, hashing, loans, models, overdue, schemas
+from .cache import user_cache
+
+# 非同期エンドポイント用の CRUD ロジック
+# SELECT 文の組み立ては crud と共通にして、実行だけを AsyncSession で行う。
+# 非同期セッションでは遅延ロードができないので、レスポンスに含めるリレーションは
+# crud の文に付いている読み込み方（ITEM_LOAD_OPTIONS など）で先に読み込んでおく。
+
+def _dialect(db: AsyncSession) -> str:
+    return db.bind.dialect.name
+
+async def get_user(db: AsyncSession, user_id: int):
+    result = await db.execute(select(models.User).filter(models.User.id == user_id))
+    return result.scalars().first()
+
+async def get_user_by_email(db: AsyncSession, email: str):
+    result = await db.execute(select(models.User).filter(models.User.email == email))
+    return result.scalars().first()
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate):
+    hashed_pw = await hashing.hash_password_async(user.password)
+    db_user = models.User(
+        name=user.name,
+        email=user.email,
+        grade=user.grade,
+        password=hashed_pw,
+        is_admin=user.is_admin
+    )
+    db.add(db_user)
+    await db.commit()
+    await db.refresh(db_user)
+    return db_user
+
+async def authenticate_user(db: AsyncSession, email: str, password: str):
+    user = await get_user_by_email(db, email)
+    if not user:
+        return None
+    if not await hashing.verify_password_async(password, user.password):
+        return None
+
+    # bcrypt のコスト設定が変わっていれば、平文が手元にあるログイン時にハッシュを作り直す
+    if hashing.needs_rehash(user.password):
+        user.password = await hashing.hash_password_async(password)
+        await db.commit()
+        user_cache.invalidate(user.id)
+    return user
+
+async def update_user(db: AsyncSession, user_id: int, user: schemas.UserUpdate):
+    db_user = await get_user(db, user_id)
+    if db_user is None:
+        return None
+    update_data = user.dict(exclude_unset=True)
+
+    # パスワードが含まれている場合はハッシュ化（プロセスプールの完了を待つ間、イベントループは止めない）
+    if "password" in update_data:
+        update_data["password"] = await hashing.hash_password_async(update_data.pop("password"))
+
+    for key, value in update_data.items():
+        setattr(db_user, key, value)
+    await db.commit()
+    await db.refresh(db_user)
+    user_cache.invalidate(user_id)
+    return db_user
+
+async def set_password(db: AsyncSession, user_id: int, new_password: str):
+    # キャッシュ由来のユーザーはセッション外なので、UPDATE 文で直接書き換える
+    hashed_pw = await hashing.hash_password_async(new_password)
+    await db.execute(update(models.User).where(models.User.id == user_id).values(password=hashed_pw))
+    await db.commit()
+    user_cache.invalidate(user_id)
+
+async def get_categories(db: AsyncSession, skip: int = 0, limit: int = 100):
+    result = await db.execute(crud.categories_statement(skip, limit))
+    return result.scalars().all()
+
+async def get_item(db: AsyncSession, item_id: int):
+    result = await db.execute(crud.item_statement(item_id))
+    return result.scalars().first()
+
+# 今の貸出（item_current_loan を主キー・利用者 id で引く）
+async def get_item_loan(db: AsyncSession, item_id: int):
+    result = await db.execute(loans.item_loan_statement(item_id))
+    return result.first()
+
+async def get_user_loans(db: AsyncSession, user_id: int):
+    result = await db.execute(loans.user_loans_statement(user_id))
+    return [dict(row._mapping) for row in result]
+
+async def get_overdue_loans(db: AsyncSession, skip: int = 0, limit: int = 100):
+    result = await db.execute(overdue.overdue_statement(datetime.now(), skip=skip, limit=limit))
+    return [dict(row._mapping) for row in result]
+
+# projection を指定したときは ORM オブジェクトではなく行（Row）を返す
+async def get_items(db: AsyncSession, skip: int = 0, limit: int = 100, category_id: Optional[int] = None, name: Optional[str] = None, location: Optional[str] = None, is_available: Optional[bool] = None, sort_by: Optional[str] = None, sort_order: Optional[str] = "asc", cursor: Optional[str] = None, projection=None):
+    stmt = crud.items_statement(_dialect(db), skip=skip, limit=limit, category_id=category_id, name=name, location=location, is_available=is_available, sort_by=sort_by, sort_order=sort_order, cursor=cursor, projection=projection)
+    result = await db.execute(stmt)
+    return result.all() if projection else result.scalars().all()
+
+async def get_transactions(db: AsyncSession, skip: int = 0, limit: int = 100, user_id: Optional[int] = None, item_id: Optional[int] = None, status: Optional[str] = None, cursor: Optional[str] = None, projection=None, date_from: Optional[datetime] = None, date_to: Optional[datetime] = None, include_archive: bool = False):
+    horizon = None
+    if archive.wants_archive(status, date_from, date_to, include_archive):
+        horizon = (await db.execute(archive.horizon_statement())).scalar()
+    statements = crud.transaction_history_statements(
+        skip=skip, limit=limit, include_archive=archive.needs_archive(status, date_from, horizon, date_to, include_archive),
+        user_id=user_id, item_id=item_id, status=status, cursor=cursor, projection=projection, date_from=date_from, date_to=date_to,
+    )
+    results = []
+    for stmt in statements:
+        result = await db.execute(stmt)
+        results.append(result.all() if projection else result.scalars().all())
+    return crud.merge_transaction_history(results, skip, limit, cursor)
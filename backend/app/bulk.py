@@ -0,0 +1,158 @@
+import csv
+import io
+import json
+
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+
+from . import models, schemas, stats, versioning
+from .config import get_settings
+
+# 物品の一括登録（CSV / JSON Lines）
+# アップロードされたファイルを 1 行ずつ読み、schemas.ItemCreate で検証してから
+# 一定件数ごとに複数行 INSERT でまとめて登録する。失敗した行は行番号とエラー内容を返す。
+
+def detect_format(filename: str, content_type: str) -> str:
+    name = (filename or "").lower()
+    if name.endswith((".jsonl", ".ndjson")) or "ndjson" in (content_type or ""):
+        return "jsonl"
+    return "csv"
+
+
+def iter_rows(fileobj, fmt: str):
+    # (行番号, 行の dict もしくは読み取りエラーの文字列) を順に返す
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    try:
+        if fmt == "csv":
+            reader = csv.DictReader(text)
+            try:
+                reader.fieldnames
+            except csv.Error as e:
+                yield 1, f"CSV の形式が不正です: {e}"
+                return
+            # 1 行目はヘッダーなのでデータは 2 行目から
+            row_number = 1
+            while True:
+                row_number += 1
+                try:
+                    row = next(reader)
+                except StopIteration:
+                    return
+                except csv.Error as e:
+                    # 大きすぎるセルなど。その行だけエラーにして次の行から読み続ける
+                    yield row_number, f"CSV の形式が不正です: {e}"
+                    continue
+                # 空のセルは省略したものとして扱う（is_available などはスキーマの既定値になる）
+                yield row_number, {key: value for key, value in row.items() if key and value not in ("", None)}
+
+        for row_number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield row_number, f"JSON の形式が不正です: {e.msg}"
+                continue
+            if not isinstance(row, dict):
+                yield row_number, "各行は JSON オブジェクトである必要があります"
+                continue
+            yield row_number, row
+    finally:
+        text.detach()
+
+
+def _validation_errors(e: ValidationError):
+    return [
+        {"field": ".".join(str(loc) for loc in error["loc"]), "message": error["msg"]}
+        for error in e.errors()
+    ]
+
+
+def import_items(db, rows) -> dict:
+    # カテゴリ名 → id の対応は最初に 1 回だけ読み込む
+    categories = dict(db.execute(select(models.Category.name, models.Category.id)).all())
+    category_ids = set(categories.values())
+
+    batch_size = get_settings().import_batch_size
+    seen_names = set()
+    errors = []
+    batch = []
+    inserted = 0
+
+    def flush():
+        nonlocal inserted
+        if not batch:
+            return
+        # 既に登録済みの名前（name は一意）を 1 回の問い合わせで弾く
+        names = [row["name"] for _, row in batch]
+        existing = set(db.execute(select(models.Item.name).where(models.Item.name.in_(names))).scalars())
+        values = []
+        for row_number, row in batch:
+            if row["name"] in existing:
+                errors.append({"row": row_number, "errors": [{"field": "name", "message": "同じ名前の物品が既に登録されています"}]})
+            else:
+                values.append(row)
+        if values:
+            db.execute(insert(models.Item), values)
+            # カテゴリ集計はカテゴリごとにまとめて加算する
+            deltas = {}
+            for row in values:
+                total, available = deltas.get(row["category_id"], (0, 0))
+                deltas[row["category_id"]] = (total + 1, available + (1 if row["is_available"] else 0))
+            for category_id, (total, available) in deltas.items():
+                stats.apply_delta(db, category_id, total=total, available=available)
+            versioning.bump(db, "item")
+            db.commit()
+            inserted += len(values)
+        batch.clear()
+
+    for row_number, raw in rows:
+        if isinstance(raw, str):
+            errors.append({"row": row_number, "errors": [{"field": "", "message": raw}]})
+            continue
+
+        category_name = raw.pop("category", None)
+        if category_name is not None and raw.get("category_id") is None:
+            if category_name not in categories:
+                errors.append({"row": row_number, "errors": [{"field": "category", "message": f"カテゴリ「{category_name}」が見つかりません"}]})
+                continue
+            raw["category_id"] = categories[category_name]
+
+        try:
+            item = schemas.ItemCreate(**raw)
+        except ValidationError as e:
+            errors.append({"row": row_number, "errors": _validation_errors(e)})
+            continue
+
+        if item.category_id is not None and item.category_id not in category_ids:
+            errors.append({"row": row_number, "errors": [{"field": "category_id", "message": "カテゴリが見つかりません"}]})
+            continue
+        if item.name in seen_names:
+            errors.append({"row": row_number, "errors": [{"field": "name", "message": "ファイル内で名前が重複しています"}]})
+            continue
+        seen_names.add(item.name)
+
+        batch.append((row_number, item.model_dump()))
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+
+    return {"inserted": inserted, "failed": len(errors), "errors": errors}
+
+
+def items_export_statement():
+    # 取り込みと同じ形式（カテゴリは名前）で書き出す
+    return (
+        select(
+            models.Item.id,
+            models.Item.name,
+            models.Category.name.label("category"),
+            models.Item.is_available,
+            models.Item.location,
+            models.Item.image_path,
+            models.Item.notes,
+            models.Item.registration_date,
+        )
+        .outerjoin(models.Category, models.Item.category_id == models.Category.id)
+        .order_by(models.Item.id)
+    )
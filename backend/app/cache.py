@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from . import models
+from .config import get_settings
+
+# 認証済みユーザーのキャッシュ（ユーザー id ごと、件数上限つき LRU + TTL）
+# ORM オブジェクトはセッションに紐づくので、カラムの値だけを保持し、取り出すたびに
+# セッションに属さない models.User を作り直して返す。
+# キャッシュはプロセスごとなので、他のワーカーでの変更は TTL が切れるまで反映されない。
+
+_USER_COLUMNS = [column.key for column in models.User.__table__.columns]
+
+
+class UserCache:
+    # maxsize / ttl を省略すると設定値（USER_CACHE_SIZE / USER_CACHE_TTL）を使う
+    def __init__(self, maxsize: Optional[int] = None, ttl: Optional[float] = None):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def maxsize(self) -> int:
+        return self._maxsize if self._maxsize is not None else get_settings().user_cache_size
+
+    @property
+    def ttl(self) -> float:
+        return self._ttl if self._ttl is not None else get_settings().user_cache_ttl
+
+    def get(self, user_id: int) -> Optional[models.User]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            values = entry[1]
+        return models.User(**values)
+
+    def put(self, user: models.User):
+        if self.maxsize <= 0:
+            return
+        values = {key: getattr(user, key) for key in _USER_COLUMNS}
+        with self._lock:
+            self._entries[user.id] = (time.monotonic() + self.ttl, values)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            if self._entries.pop(user_id, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+user_cache = UserCache()
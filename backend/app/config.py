@@ -0,0 +1,132 @@
+import os
+from functools import lru_cache
+
+from dotenv import load_dotenv
+
+# アプリケーションの設定
+# .env の読み込みと環境変数の解釈はここだけで行い、最初に get_settings() が呼ばれたときに 1 度だけ作る。
+
+
+def _int(name: str, default=None):
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def _float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+
+def _bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value in (None, ""):
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+class Settings:
+    def __init__(self):
+        load_dotenv()
+
+        self.frontend_url = os.getenv("FRONTEND_URL")
+        # API の外から見た URL（画像の URL など、レスポンスに絶対 URL を入れるときに使う）
+        self.backend_url = os.getenv("BACKEND_URL", "http://localhost:8000")
+
+        # データベース接続情報
+        self.mysql_user = os.getenv("MYSQL_USER")
+        self.mysql_password = os.getenv("MYSQL_PASSWORD")
+        self.mysql_host = os.getenv("MYSQL_HOST", "database")
+        self.mysql_database = os.getenv("MYSQL_DATABASE", "inventory_management")
+        self.database_url = os.getenv("DATABASE_URL") or self._url("pymysql")
+        # 非同期エンドポイント用（asyncmy ドライバ）
+        self.async_database_url = os.getenv("ASYNC_DATABASE_URL") or self._url("asyncmy")
+
+        # コネクションプール
+        self.db_pool_size = _int("DB_POOL_SIZE", 10)
+        self.db_max_overflow = _int("DB_MAX_OVERFLOW", 20)
+        self.db_pool_timeout = _float("DB_POOL_TIMEOUT", 10)
+        self.db_pool_recycle = _int("DB_POOL_RECYCLE", 1800)  # MySQL の wait_timeout より短くする
+        self.db_pool_pre_ping = _bool("DB_POOL_PRE_PING", True)
+        self.db_connect_retries = _int("DB_CONNECT_RETRIES", 30)
+        self.db_connect_interval = _float("DB_CONNECT_INTERVAL", 2)
+
+        # トークン設定
+        self.secret_key = os.getenv("SECRET_KEY")
+        self.algorithm = os.getenv("ALGORITHM")
+        self.access_token_expire_minutes = _int("ACCESS_TOKEN_EXPIRE_MINUTES")
+
+        # メール設定
+        self.smtp_server = os.getenv("SMTP_SERVER")
+        self.smtp_port = _int("SMTP_PORT")
+        self.smtp_user = os.getenv("SMTP_USER")
+        self.smtp_password = os.getenv("SMTP_PASSWORD")
+        self.smtp_starttls = _bool("SMTP_STARTTLS", True)
+        self.smtp_timeout = _float("SMTP_TIMEOUT", 10)
+
+        # メール送信キュー
+        self.mail_queue_max = _int("MAIL_QUEUE_MAX", 1000)
+        self.mail_batch_size = _int("MAIL_BATCH_SIZE", 20)
+        self.mail_max_retries = _int("MAIL_MAX_RETRIES", 5)
+        self.mail_retry_backoff = _float("MAIL_RETRY_BACKOFF", 2.0)  # 1 回目の再送までの秒数（以降は倍々）
+        self.mail_idle_timeout = _float("MAIL_IDLE_TIMEOUT", 30)     # 送るものがなければこの秒数で切断する
+
+        # パスワードハッシュ
+        self.bcrypt_rounds = _int("BCRYPT_ROUNDS", 12)
+        self.hash_workers = _int("HASH_WORKERS", 2)
+        self.hash_max_queue = _int("HASH_MAX_QUEUE", 64)
+
+        # 認証ユーザーキャッシュ
+        self.user_cache_size = _int("USER_CACHE_SIZE", 1024)
+        self.user_cache_ttl = _float("USER_CACHE_TTL", 60)
+
+        # 検索ログの書き込みバッファ
+        self.search_log_batch_size = _int("SEARCH_LOG_BATCH_SIZE", 500)
+        self.search_log_flush_interval = _float("SEARCH_LOG_FLUSH_INTERVAL", 2.0)
+        self.search_log_max_pending = _int("SEARCH_LOG_MAX_PENDING", 20000)
+
+        # 貸出・返却で 1 行ずつ増減するカウンタ（ETag の更新カウンタ・カテゴリ集計）を物品 id で何行に分けるか
+        self.counter_shards = _int("COUNTER_SHARDS", 64)
+
+        # 一括登録
+        self.import_batch_size = _int("IMPORT_BATCH_SIZE", 500)
+
+        # 年度替わりの学年更新（1 回の UPDATE で扱う id の範囲）
+        self.grade_promotion_chunk_size = _int("GRADE_PROMOTION_CHUNK_SIZE", 1000)
+
+        # 取引のアーカイブ（完了から ARCHIVE_AFTER_DAYS 日たった取引を item_transaction_archive へ移す）
+        self.archive_after_days = _int("ARCHIVE_AFTER_DAYS", 365)
+        self.archive_batch_size = _int("ARCHIVE_BATCH_SIZE", 2000)
+        self.archive_max_batches = _int("ARCHIVE_MAX_BATCHES", 500)
+        self.archive_pause = _float("ARCHIVE_PAUSE", 0.05)
+
+        # 返却期限と延滞の通知（overdue.py）
+        self.default_loan_period_days = _int("DEFAULT_LOAN_PERIOD_DAYS", 14)
+        self.overdue_check_minutes = _int("OVERDUE_CHECK_MINUTES", 15)
+        self.overdue_batch_size = _int("OVERDUE_BATCH_SIZE", 1000)
+
+        # 物品の画像（images.py）
+        self.image_dir = os.getenv("IMAGE_DIR", "data/images")
+        self.image_max_bytes = _int("IMAGE_MAX_BYTES", 10 * 1024 * 1024)
+        self.image_workers = _int("IMAGE_WORKERS", 2)
+        self.image_thumb_size = _int("IMAGE_THUMB_SIZE", 320)
+        self.image_large_size = _int("IMAGE_LARGE_SIZE", 1600)
+        self.image_webp_quality = _int("IMAGE_WEBP_QUALITY", 80)
+
+        # 検索候補（suggest.py）
+        self.suggest_capacity = _int("SUGGEST_CAPACITY", 1000)  # 回数を数えておく検索語の数
+        self.suggest_half_life_hours = _float("SUGGEST_HALF_LIFE_HOURS", 72)
+        self.suggest_refresh_interval = _float("SUGGEST_REFRESH_INTERVAL", 30)
+        self.suggest_batch_size = _int("SUGGEST_BATCH_SIZE", 5000)
+
+        # 計測（Server-Timing ヘッダは開発時の確認用。既定では付けない）
+        self.metrics_server_timing = _bool("METRICS_SERVER_TIMING", False)
+        # /metrics は管理者のログインか、この値の Bearer トークン（Prometheus などから取得するとき）で読める
+        self.metrics_token = os.getenv("METRICS_TOKEN")
+
+    def _url(self, driver: str) -> str:
+        return f"mysql+{driver}://{self.mysql_user}:{self.mysql_password}@{self.mysql_host}/{self.mysql_database}"
+
+
+@lru_cache
+def get_settings() -> Settings:
+    return Settings()
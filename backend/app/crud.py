@@ -1,7 +1,16 @@
+import logging
+from collections import Counter
+from sqlalchemy import and_, func, or_, select, union_all, update
 from sqlalchemy.orm import Session, joinedload
-from . import models, schemas, utils
+from . import archive, loans, models, schemas, utils, pagination, search, stats, versioning
+from .cache import user_cache
+from .config import get_settings
 from typing import List, Optional
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+import time
+from pytz import timezone
+
+logger = logging.getLogger(__name__)
 
 # User CRUDロジック
 def get_user(db: Session, user_id: int):
@@ -13,19 +22,7 @@ def get_user_by_email(db: Session, email: str):
 def get_users(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.User).offset(skip).limit(limit).all()
 
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed_pw = utils.hash_password(user.password)
-    db_user = models.User(
-        name=user.name,
-        email=user.email,
-        grade=user.grade,
-        password=hashed_pw,  
-        is_admin=user.is_admin
-    )
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+# 利用者の登録・更新はパスワードのハッシュを待つので、async_crud（hashing の非同期版）で行う
 
 def authenticate_user(db: Session, email: str, password: str):
     user = get_user_by_email(db, email)
@@ -35,26 +32,13 @@ def authenticate_user(db: Session, email: str, password: str):
         return None
     return user
 
-def update_user(db: Session, user_id: int, user: schemas.UserUpdate):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
-    if db_user:
-        update_data = user.dict(exclude_unset=True)
-
-        # パスワードが含まれている場合はハッシュ化
-        if "password" in update_data:
-            update_data["password"] = utils.hash_password(update_data.pop("password"))
- 
-        for key, value in update_data.items():
-            setattr(db_user, key, value)
-        db.commit()
-        db.refresh(db_user)
-    return db_user
 
 def delete_user(db: Session, user_id: int):
     db_user = db.query(models.User).filter(models.User.id == user_id).first()
     if db_user:
         db.delete(db_user)
         db.commit()
+        user_cache.invalidate(user_id)
         return True
     return False
 
@@ -62,12 +46,16 @@ def delete_user(db: Session, user_id: int):
 def get_category(db: Session, category_id: int):
     return db.query(models.Category).filter(models.Category.id == category_id).first()
 
+def categories_statement(skip: int = 0, limit: int = 100):
+    return select(models.Category).offset(skip).limit(limit)
+
 def get_categories(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.Category).offset(skip).limit(limit).all()
+    return db.execute(categories_statement(skip, limit)).scalars().all()
 
 def create_category(db: Session, category: schemas.CategoryCreate):
-    db_category = models.Category(name=category.name)
+    db_category = models.Category(name=category.name, loan_period_days=category.loan_period_days)
     db.add(db_category)
+    versioning.bump(db, "category")
     db.commit()
     db.refresh(db_category)
     return db_category
@@ -78,6 +66,7 @@ def update_category(db: Session, category_id: int, category: schemas.CategoryUpd
         update_data = category.dict(exclude_unset=True)
         for key, value in update_data.items():
             setattr(db_category, key, value)
+        versioning.bump(db, "category")
         db.commit()
         db.refresh(db_category)
     return db_category
@@ -85,26 +74,67 @@ def update_category(db: Session, category_id: int, category: schemas.CategoryUpd
 def delete_category(db: Session, category_id: int):
     db_category = db.query(models.Category).filter(models.Category.id == category_id).first()
     if db_category:
+        stats.category_deleted(db, category_id)
         db.delete(db_category)
+        # 物品のカテゴリも外れるので item も更新扱い
+        versioning.bump(db, "category", "item")
         db.commit()
         return True
     return False
 
+# レスポンスモデルごとのリレーションの読み込み方
+# シリアライズ時に 1 行ずつ遅延ロード（N+1）が走らないよう、SELECT と一緒に読み込んでおく。
+# どれも多対一なので JOIN で 1 クエリにまとめる。
+# schemas.Item は category を含む
+ITEM_LOAD_OPTIONS = (joinedload(models.Item.category),)
+# schemas.ItemTransactionWithDetails は user と item（とその category）を含む
+TRANSACTION_DETAIL_LOAD_OPTIONS = (
+    joinedload(models.ItemTransaction.user),
+    joinedload(models.ItemTransaction.item).joinedload(models.Item.category),
+)
+# アーカイブした取引も同じレスポンスモデルで返す
+ARCHIVED_TRANSACTION_DETAIL_LOAD_OPTIONS = (
+    joinedload(models.ItemTransactionArchive.user),
+    joinedload(models.ItemTransactionArchive.item).joinedload(models.Item.category),
+)
+
 # Item CRUDロジック
+def item_statement(item_id: int):
+    return select(models.Item).filter(models.Item.id == item_id).options(*ITEM_LOAD_OPTIONS)
+
 def get_item(db: Session, item_id: int):
-    return db.query(models.Item).filter(models.Item.id == item_id).first()
+    return db.execute(item_statement(item_id)).scalars().first()
 
-def get_items(db: Session, skip: int = 0, limit: int = 100, category_id: Optional[int] = None, name: Optional[str] = None, location: Optional[str] = None, is_available: Optional[bool] = None, sort_by: Optional[str] = None, sort_order: Optional[str] = "asc"):
-    query = db.query(models.Item)
+# 並び替えに使えるカラム（リレーションなどを除いた実カラムのみ）
+ITEM_SORT_COLUMNS = {column.name for column in models.Item.__table__.columns}
+
+def item_sort_key(sort_by: Optional[str], sort_order: Optional[str]):
+    # カーソルモードで使う (並び替えキー, 昇順/降順) を正規化する
+    sort_key = sort_by if sort_by in ITEM_SORT_COLUMNS else "id"
+    return sort_key, "desc" if sort_order == "desc" else "asc"
+
+# 一覧取得の SELECT 文は同期・非同期（async_crud）の両方から使うので、文の組み立てを分けておく
+def items_statement(dialect: str, skip: int = 0, limit: int = 100, category_id: Optional[int] = None, name: Optional[str] = None, location: Optional[str] = None, is_available: Optional[bool] = None, sort_by: Optional[str] = None, sort_order: Optional[str] = "asc", cursor: Optional[str] = None, projection=None):
+    # projection（app.projection）を渡すと、指定カラムだけを SELECT する
+    stmt = projection.select() if projection else select(models.Item).options(*ITEM_LOAD_OPTIONS)
     if category_id:
-        query = query.filter(models.Item.category_id == category_id)
+        stmt = stmt.filter(models.Item.category_id == category_id)
     if location is not None:
-        query = query.filter(models.Item.location == location)
+        stmt = stmt.filter(models.Item.location == location)
     if is_available is not None:
-        query = query.filter(models.Item.is_available == is_available)
+        stmt = stmt.filter(models.Item.is_available == is_available)
     
-    if name:
-        query = query.filter(models.Item.name.ilike(f"%{name}%"))
+    term = name.strip() if name else ""
+    if term:
+        stmt = stmt.filter(search.name_filter(dialect, term))
+
+    # カーソルモード: 並び替えキー + id のキーセットでページングする（skip は使わない）
+    if cursor is not None:
+        sort_key, order = item_sort_key(sort_by, sort_order)
+        stmt = pagination.apply_keyset(
+            stmt, getattr(models.Item, sort_key), models.Item.id, cursor, sort_key, order
+        )
+        return stmt.limit(limit)
     
     if sort_by:
         sort_column = getattr(models.Item, sort_by, None)
@@ -113,9 +143,16 @@ def get_items(db: Session, skip: int = 0, limit: int = 100, category_id: Optiona
                 sort_column = sort_column.desc()
             else:
                 sort_column = sort_column.asc()
-            query = query.order_by(sort_column)
+            stmt = stmt.order_by(sort_column)
+    elif term and search.uses_fulltext(dialect, term):
+        # 並び替え指定がなければ関連度の高い順
+        stmt = stmt.order_by(search.relevance(term).desc(), models.Item.id)
 
-    return query.offset(skip).limit(limit).all()
+    return stmt.offset(skip).limit(limit)
+
+def get_items(db: Session, skip: int = 0, limit: int = 100, category_id: Optional[int] = None, name: Optional[str] = None, location: Optional[str] = None, is_available: Optional[bool] = None, sort_by: Optional[str] = None, sort_order: Optional[str] = "asc", cursor: Optional[str] = None):
+    stmt = items_statement(db.get_bind().dialect.name, skip=skip, limit=limit, category_id=category_id, name=name, location=location, is_available=is_available, sort_by=sort_by, sort_order=sort_order, cursor=cursor)
+    return db.execute(stmt).scalars().all()
 
 def create_item(db: Session, item: schemas.ItemCreate):
     db_item = models.Item(
@@ -127,73 +164,344 @@ def create_item(db: Session, item: schemas.ItemCreate):
         notes=item.notes
     )
     db.add(db_item)
+    stats.item_added(db, item.category_id, item.is_available)
+    versioning.bump(db, "item")
     db.commit()
-    db.refresh(db_item)
-    return db_item
+    # refresh の後に category を遅延ロードするより、カテゴリごと 1 回で読み直す
+    return get_item(db, db_item.id)
 
 def update_item(db: Session, item_id: int, item: schemas.ItemUpdate):
     db_item = db.query(models.Item).filter(models.Item.id == item_id).first()
     if db_item:
+        old_category_id, old_available = db_item.category_id, db_item.is_available
         update_data = item.dict(exclude_unset=True)
+        # 貸出状態は setattr ではなく set_item_available（条件付き UPDATE）で変える
+        is_available = update_data.pop("is_available", None)
         for key, value in update_data.items():
             setattr(db_item, key, value)
+        stats.item_changed(db, old_category_id, old_available, db_item.category_id, old_available)
+        db.flush()
+        if is_available is not None and is_available != old_available:
+            if not set_item_available(db, item_id, is_available):
+                # 読んでから書くまでに、貸出・返却で状態が変わった
+                db.rollback()
+                if not is_available:
+                    raise ItemUnavailableError("この物品は貸出中です")
+                raise TransactionConflict("この物品は既に貸出可能です")
+            if is_available:
+                # 管理者が手で貸出可能に戻したときは、今の貸出の記録も消す
+                loans.item_returned(db, item_id)
+        versioning.bump(db, "item")
         db.commit()
-        db.refresh(db_item)
+        return get_item(db, item_id)
     return db_item
 
 def delete_item(db: Session, item_id: int):
     db_item = db.query(models.Item).filter(models.Item.id == item_id).first()
     if db_item:
+        stats.item_removed(db, db_item.category_id, db_item.is_available)
         db.delete(db_item)
+        versioning.bump(db, "item")
         db.commit()
         return True
     return False
 
+# 貸出状態の競合（他の人が先に借りた、既に返却済みなど）。API では 409 を返す
+class TransactionConflict(Exception):
+    pass
+
+class ItemUnavailableError(TransactionConflict):
+    pass
+
+# 貸出状態の変更は必ずここを通し、カテゴリ集計と item の更新カウンタ（物品 id で分けた行）も合わせて更新する
+# 「今と逆の状態のときだけ書き換える」条件付き UPDATE なので、同時に借りようとしても 1 件しか成功しない。
+# 状態が変わったら True を返す（既にその状態、または物品が無ければ False）
+def set_item_available(db: Session, item_id: int, is_available: bool) -> bool:
+    result = db.execute(
+        update(models.Item)
+        .where(models.Item.id == item_id, models.Item.is_available == (not is_available))
+        .values(is_available=is_available)
+    )
+    if result.rowcount == 0:
+        return False
+    stats.item_availability_changed(db, item_id, is_available)
+    versioning.bump_rows(db, "item", [item_id])
+    return True
+
+# set_item_available の複数件版。状態が変わる物品を行ロックしてカテゴリごとに数え、まとめて 1 文で UPDATE する。
+# 変わった件数を返す
+def set_items_available(db: Session, item_ids, is_available: bool) -> int:
+    item_ids = list(set(item_ids))
+    if not item_ids:
+        return 0
+    condition = (models.Item.id.in_(item_ids), models.Item.is_available == (not is_available))
+    rows = db.execute(select(models.Item.id, models.Item.category_id).where(*condition).with_for_update()).all()
+    if not rows:
+        return 0
+    db.execute(
+        update(models.Item)
+        .where(models.Item.id.in_([row.id for row in rows]))
+        .values(is_available=is_available)
+        .execution_options(synchronize_session=False)
+    )
+    # 行ロックの順序をそろえるため、(カテゴリ, shard) の順に増減させる
+    deltas = Counter((row.category_id or stats.UNCATEGORIZED, stats.shard_of(row.id)) for row in rows)
+    for (category_id, shard), count in sorted(deltas.items()):
+        stats.apply_delta(db, category_id, available=count if is_available else -count, shard=shard)
+    versioning.bump_rows(db, "item", [row.id for row in rows])
+    return len(rows)
+
 # ItemTransaction CRUDロジック
 def get_transaction(db: Session, transaction_id: int):
     return db.query(models.ItemTransaction).filter(models.ItemTransaction.id == transaction_id).first()
 
-def get_transactions(db: Session, skip: int = 0, limit: int = 100, user_id: Optional[int] = None, item_id: Optional[int] = None, status: Optional[str] = None):
-    query = db.query(models.ItemTransaction).options(
-        joinedload(models.ItemTransaction.user),
-        joinedload(models.ItemTransaction.item).joinedload(models.Item.category)
-    )
+def transactions_statement(skip: int = 0, limit: int = 100, user_id: Optional[int] = None, item_id: Optional[int] = None, status: Optional[str] = None, cursor: Optional[str] = None, projection=None, date_from: Optional[datetime] = None, date_to: Optional[datetime] = None, source=models.ItemTransaction, ordered: bool = False):
+    # source は models.ItemTransaction か models.ItemTransactionArchive
+    if projection:
+        stmt = projection.select(source)
+    elif source is models.ItemTransactionArchive:
+        stmt = select(source).options(*ARCHIVED_TRANSACTION_DETAIL_LOAD_OPTIONS)
+    else:
+        stmt = select(source).options(*TRANSACTION_DETAIL_LOAD_OPTIONS)
     if user_id:
-        query = query.filter(models.ItemTransaction.user_id == user_id)
+        stmt = stmt.filter(source.user_id == user_id)
     if item_id:
-        query = query.filter(models.ItemTransaction.item_id == item_id)
+        stmt = stmt.filter(source.item_id == item_id)
     if status:
-        query = query.filter(models.ItemTransaction.status == status)
+        stmt = stmt.filter(source.status == status)
+    if date_from:
+        stmt = stmt.filter(source.transaction_date >= date_from)
+    if date_to:
+        stmt = stmt.filter(source.transaction_date < date_to)
+
+    # カーソルモード: id 順のキーセットでページングする
+    if cursor is not None:
+        stmt = pagination.apply_keyset(stmt, source.id, source.id, cursor, "id", "asc")
+        return stmt.limit(limit)
 
-    return query.offset(skip).limit(limit).all()
+    if ordered:
+        stmt = stmt.order_by(source.id)
+    return stmt.offset(skip).limit(limit)
+
+def transaction_history_statements(skip: int = 0, limit: int = 100, include_archive: bool = False, **filters):
+    # アーカイブを読まないときは 1 文（これまでどおり）
+    if not include_archive:
+        return [transactions_statement(skip=skip, limit=limit, **filters)]
+    # 読むときは取引・アーカイブの両方から id 順に先頭の skip + limit 件ずつ取り、merge_transaction_history でまとめる
+    window = limit if filters.get("cursor") is not None else skip + limit
+    return [
+        transactions_statement(limit=window, source=source, ordered=True, **filters)
+        for source in (models.ItemTransaction, models.ItemTransactionArchive)
+    ]
+
+def merge_transaction_history(results: list, skip: int, limit: int, cursor: Optional[str]):
+    if len(results) == 1:
+        return results[0]
+    rows = sorted((row for rows in results for row in rows), key=lambda row: row.id)
+    return rows[:limit] if cursor is not None else rows[skip:skip + limit]
+
+def get_transactions(db: Session, skip: int = 0, limit: int = 100, user_id: Optional[int] = None, item_id: Optional[int] = None, status: Optional[str] = None, cursor: Optional[str] = None, date_from: Optional[datetime] = None, date_to: Optional[datetime] = None, include_archive: bool = False):
+    horizon = db.execute(archive.horizon_statement()).scalar() if archive.wants_archive(status, date_from, date_to, include_archive) else None
+    statements = transaction_history_statements(
+        skip=skip, limit=limit, include_archive=archive.needs_archive(status, date_from, horizon, date_to, include_archive),
+        user_id=user_id, item_id=item_id, status=status, cursor=cursor, date_from=date_from, date_to=date_to,
+    )
+    return merge_transaction_history([db.execute(stmt).scalars().all() for stmt in statements], skip, limit, cursor)
+
+# 取引履歴の書き出し用。ORM オブジェクトを作らないよう、必要なカラムだけを射影する
+# include_archive のときはアーカイブ分も UNION ALL でつなげる
+def transactions_export_statement(user_id: Optional[int] = None, type: Optional[str] = None, status: Optional[str] = None, date_from: Optional[datetime] = None, date_to: Optional[datetime] = None, include_archive: bool = False):
+    sources = (models.ItemTransaction, models.ItemTransactionArchive) if include_archive else (models.ItemTransaction,)
+    statements = []
+    for source in sources:
+        stmt = (
+            select(
+                source.id,
+                source.item_id,
+                models.Item.name.label("item_name"),
+                source.user_id,
+                models.User.name.label("user_name"),
+                source.type,
+                source.status,
+                source.related_transaction_id,
+                source.transaction_date,
+                source.reason,
+                source.item_condition,
+                source.notes,
+            )
+            .outerjoin(models.Item, source.item_id == models.Item.id)
+            .outerjoin(models.User, source.user_id == models.User.id)
+        )
+        if user_id:
+            stmt = stmt.filter(source.user_id == user_id)
+        if type:
+            stmt = stmt.filter(source.type == type)
+        if status:
+            stmt = stmt.filter(source.status == status)
+        if date_from:
+            stmt = stmt.filter(source.transaction_date >= date_from)
+        if date_to:
+            stmt = stmt.filter(source.transaction_date < date_to)
+        statements.append(stmt)
+    if len(statements) == 1:
+        return statements[0].order_by(models.ItemTransaction.id)
+    history = union_all(*statements).subquery()
+    return select(history).order_by(history.c.id)
+
+# 返却期限は承認したときに決める（承認した日時 + 物品のカテゴリの貸出期間、未設定・未分類なら DEFAULT_LOAN_PERIOD_DAYS）
+# 申請時に返却期限が指定されていればそのまま使う。貸出期間ごとに 1 文で UPDATE する
+def assign_due_dates(db: Session, transaction_ids, start: Optional[datetime] = None):
+    rows = db.execute(
+        select(models.ItemTransaction.id, models.Category.loan_period_days)
+        .join(models.Item, models.Item.id == models.ItemTransaction.item_id)
+        .outerjoin(models.Category, models.Category.id == models.Item.category_id)
+        .where(models.ItemTransaction.id.in_(list(transaction_ids)), models.ItemTransaction.due_date.is_(None))
+    ).all()
+    # DATETIME の精度（秒）にそろえる
+    start = (start or datetime.now()).replace(microsecond=0)
+    by_days = {}
+    for row in rows:
+        by_days.setdefault(row.loan_period_days or get_settings().default_loan_period_days, []).append(row.id)
+    for days, ids in by_days.items():
+        db.execute(
+            update(models.ItemTransaction)
+            .where(models.ItemTransaction.id.in_(ids))
+            .values(due_date=start + timedelta(days=days))
+            .execution_options(synchronize_session=False)
+        )
 
 def create_transaction(db: Session, transaction: schemas.ItemTransactionCreate):
-    # 貸出トランザクションの場合、アイテムのステータスを更新
+    # 貸出トランザクションの場合、貸出可能なときだけ物品を確保する
     if transaction.type == "borrow":
-        db_item = db.query(models.Item).filter(models.Item.id == transaction.item_id).first()
-        if db_item:
-            db_item.is_available = False
+        if not set_item_available(db, transaction.item_id, False):
+            db.rollback()
+            raise ItemUnavailableError("この物品は貸出中です")
     
     # 返却トランザクションの場合、アイテムのステータスを更新
     elif transaction.type == "return":
-        db_item = db.query(models.Item).filter(models.Item.id == transaction.item_id).first()
-        if db_item:
-            db_item.is_available = True
+        set_item_available(db, transaction.item_id, True)
     
+    # 物品の更新と同じトランザクションで記録する
     db_transaction = models.ItemTransaction(
         item_id=transaction.item_id,
         user_id=transaction.user_id,
         type=transaction.type,
         related_transaction_id=transaction.related_transaction_id,
+        due_date=transaction.due_date,
         reason=transaction.reason,
         item_condition=transaction.item_condition,
         notes=transaction.notes
     )
     db.add(db_transaction)
+    db.flush()
+    if transaction.type == "borrow":
+        loans.borrowed(db, db_transaction.id, transaction.item_id)
+    elif transaction.type == "return":
+        loans.item_returned(db, transaction.item_id)
     db.commit()
     db.refresh(db_transaction)
     return db_transaction
 
+def _set_transaction_status(db: Session, transaction_id: int, status: Optional[str], allowed_from=None) -> bool:
+    # 今の状態が allowed_from のいずれかのときだけ書き換える（二重の承認・返却などを防ぐ）
+    stmt = update(models.ItemTransaction).where(models.ItemTransaction.id == transaction_id)
+    if allowed_from is not None:
+        stmt = stmt.where(models.ItemTransaction.status.in_(allowed_from))
+    values = {"status": status}
+    if status is None or status in archive.CLOSED_STATUSES:
+        # 完了した日時（アーカイブはこの日時から数える）
+        values["closed_at"] = datetime.now()
+    return db.execute(stmt.values(**values)).rowcount > 0
+
+def update_transaction_status(db: Session, transaction_id: int, status: str):
+    # 返却は return_transaction、取消は cancel_transaction を使う（物品・今の貸出も合わせて更新するため）
+    if status not in ("approved", "rejected"):
+        raise ValueError("変更できる状態は approved / rejected だけです")
+    tx = get_transaction(db, transaction_id)
+    if tx is None:
+        return None
+
+    if not _set_transaction_status(db, transaction_id, status, allowed_from=("request",)):
+        db.rollback()
+        raise TransactionConflict("申請中の取引ではありません")
+    if status == "approved":
+        # 申請時に確保済みなので通常は何もしない（空いていれば確保し直す）
+        set_item_available(db, tx.item_id, False)
+        assign_due_dates(db, [transaction_id])
+        loans.approved(db, [transaction_id])
+    else:
+        # 却下時は在庫を元に戻す
+        set_item_available(db, tx.item_id, True)
+        loans.closed(db, [transaction_id])
+
+    db.commit()
+    db.refresh(tx)
+    return tx
+
+def batch_update_transaction_status(db: Session, transaction_ids, status: str):
+    # 申請（status="request"）をまとめて承認・却下する。
+    # 取引の読み込み・状態の更新・物品の更新をそれぞれ 1 文で行い、1 つのトランザクションでコミットする
+    transaction_ids = list(dict.fromkeys(transaction_ids))
+    rows = db.execute(
+        select(models.ItemTransaction.id, models.ItemTransaction.item_id, models.ItemTransaction.status)
+        .where(models.ItemTransaction.id.in_(transaction_ids))
+        .with_for_update()
+    ).all() if transaction_ids else []
+    found = {row.id: row for row in rows}
+    pending = [row for row in rows if row.status == "request"]
+
+    if pending:
+        db.execute(
+            update(models.ItemTransaction)
+            .where(models.ItemTransaction.id.in_([row.id for row in pending]), models.ItemTransaction.status == "request")
+            .values(status=status, closed_at=datetime.now() if status in archive.CLOSED_STATUSES else None)
+            .execution_options(synchronize_session=False)
+        )
+        # 承認は申請時に確保済みの物品をそのまま貸出中に、却下は貸出可能に戻す
+        set_items_available(db, [row.item_id for row in pending], status == "rejected")
+        if status == "approved":
+            assign_due_dates(db, [row.id for row in pending])
+            loans.approved(db, [row.id for row in pending])
+        else:
+            loans.closed(db, [row.id for row in pending])
+    db.commit()
+
+    pending_ids = {row.id for row in pending}
+    results = []
+    for transaction_id in transaction_ids:
+        if transaction_id not in found:
+            outcome = "not_found"
+        elif transaction_id in pending_ids:
+            outcome = "updated"
+        else:
+            outcome = "not_pending"
+        results.append({"id": transaction_id, "outcome": outcome})
+    return {"updated": len(pending_ids), "results": results}
+
+def cancel_transaction(db: Session, transaction_id: int) -> bool:
+    # 申請中のものだけ取り消し、確保していた物品を戻す
+    tx = get_transaction(db, transaction_id)
+    if tx is None or not _set_transaction_status(db, transaction_id, None, allowed_from=("request",)):
+        db.rollback()
+        return False
+    set_item_available(db, tx.item_id, True)
+    loans.closed(db, [transaction_id])
+    db.commit()
+    return True
+
+def return_transaction(db: Session, transaction_id: int):
+    tx = get_transaction(db, transaction_id)
+    if tx is None:
+        return None
+    if not _set_transaction_status(db, transaction_id, "returned", allowed_from=("request", "approved")):
+        db.rollback()
+        raise TransactionConflict("返却できる取引ではありません（返却済み・取消済みなど）")
+    set_item_available(db, tx.item_id, True)
+    loans.closed(db, [transaction_id])
+    db.commit()
+    db.refresh(tx)
+    return tx
+
 # SearchLog CRUDロジック
 def create_search_log(db: Session, search_log: schemas.SearchLogCreate):
     db_search_log = models.SearchLog(
@@ -205,23 +513,96 @@ def create_search_log(db: Session, search_log: schemas.SearchLogCreate):
     db.refresh(db_search_log)
     return db_search_log
 
-def promote_all_users_grades(db: Session):
-    users = db.query(models.User).all()
-    for user in users:
-        if user.grade == models.GradeEnum.U4:
-            user.grade = models.GradeEnum.M1
-        elif user.grade == models.GradeEnum.M1:
-            user.grade = models.GradeEnum.M2
-        elif user.grade == models.GradeEnum.M2:
-            user.grade = models.GradeEnum.OB_OG
-    db.commit()
+# 年度替わりの学年昇格（U4 → M1 → M2 → OB_OG）と、OB_OG になった利用者の無効化
+# 全件を読み込まず、主キーの範囲ごとに元の学年ごとの UPDATE を実行してコミットする。
+# 更新した利用者には年度（promoted_year）を記録し、同じ年度にはもう対象にしないので、
+# 途中で失敗したときや誤って 2 回実行したときも、最初からやり直してよい（2 学年上がることはない）
+GRADE_PROMOTION = {
+    models.GradeEnum.U4: models.GradeEnum.M1,
+    models.GradeEnum.M1: models.GradeEnum.M2,
+    models.GradeEnum.M2: models.GradeEnum.OB_OG,
+}
+DEACTIVATED_GRADES = (models.GradeEnum.M2, models.GradeEnum.OB_OG)  # 更新後に OB_OG になる学年
+
+def school_year(today: Optional[date] = None) -> int:
+    # 4 月始まりの年度。日付を省略したときはサーバーの時刻帯によらず日本時間の今日で決める
+    today = today or datetime.now(timezone('Asia/Tokyo')).date()
+    return today.year if today.month >= 4 else today.year - 1
+
+def _promotion_targets(first_id: int, last_id: int, year: int, grade=None):
+    # 実際に変わる人（学年が上がる人と、OB_OG でまだ有効な人）のうち、この年度にまだ更新していない人
+    conditions = [
+        models.User.id.between(first_id, last_id),
+        or_(models.User.promoted_year.is_(None), models.User.promoted_year < year),
+    ]
+    if grade is None:
+        conditions.append(or_(
+            models.User.grade.in_(list(GRADE_PROMOTION)),
+            and_(models.User.grade == models.GradeEnum.OB_OG, models.User.is_active == True),
+        ))
+    else:
+        conditions.append(models.User.grade == grade)
+        if grade not in GRADE_PROMOTION:
+            conditions.append(models.User.is_active == True)
+    return conditions
+
+def promote_all_users_grades(db: Session, chunk_size: Optional[int] = None, dry_run: bool = False, start_id: int = 0, year: Optional[int] = None):
+    chunk_size = chunk_size or get_settings().grade_promotion_chunk_size
+    year = year or school_year()
+    # 実行中に登録された利用者は対象にしない
+    max_id = db.execute(select(func.max(models.User.id))).scalar() or 0
+    summary = {"dry_run": dry_run, "year": year, "start_id": start_id, "last_id": None, "chunks": 0, "updated": 0, "by_grade": {}}
+    started = time.perf_counter()
+
+    first_id = start_id
+    while first_id <= max_id:
+        last_id = first_id + chunk_size - 1
+        chunk_started = time.perf_counter()
+        if dry_run:
+            counts = db.execute(
+                select(models.User.grade, func.count())
+                .where(*_promotion_targets(first_id, last_id, year))
+                .group_by(models.User.grade)
+            ).all()
+        else:
+            # 元の学年ごとに 1 文（件数を学年ごとに数えられる）。更新した行は promoted_year で対象から外れるので、
+            # 順番によって 2 学年上がることはない
+            counts = []
+            for grade in (models.GradeEnum.OB_OG, *GRADE_PROMOTION):
+                values = {models.User.promoted_year: year}
+                if grade in GRADE_PROMOTION:
+                    values[models.User.grade] = GRADE_PROMOTION[grade]
+                if grade in DEACTIVATED_GRADES:
+                    values[models.User.is_active] = False
+                stmt = (
+                    update(models.User)
+                    .where(*_promotion_targets(first_id, last_id, year, grade))
+                    .values(values)
+                    .execution_options(synchronize_session=False)
+                )
+                counts.append((grade, db.execute(stmt).rowcount))
+            db.commit()
+
+        updated = 0
+        for grade, count in counts:
+            if not count:
+                continue
+            key = grade.value if isinstance(grade, models.GradeEnum) else grade
+            summary["by_grade"][key] = summary["by_grade"].get(key, 0) + count
+            updated += count
+        summary["chunks"] += 1
+        summary["updated"] += updated
+        summary["last_id"] = min(last_id, max_id)
+        logger.info(
+            "学年更新%s: %d 年度 id %d-%d %d 件 (%.1fms)",
+            "（dry-run）" if dry_run else "", year, first_id, summary["last_id"], updated,
+            (time.perf_counter() - chunk_started) * 1000,
+        )
+        first_id = last_id + 1
 
-def deactivate_old_users(db: Session):
-    # OB_OGなら非アクティブに
-    db.query(models.User).filter(
-        models.User.grade.in_([models.GradeEnum.OB_OG]),  
-        models.User.is_active == True  
-    ).update(
-        {models.User.is_active: False}, synchronize_session=False
+    summary["elapsed_seconds"] = round(time.perf_counter() - started, 3)
+    logger.info(
+        "学年更新%s: 完了 %d 件 / %d チャンク (%ss) %s",
+        "（dry-run）" if dry_run else "", summary["updated"], summary["chunks"], summary["elapsed_seconds"], summary["by_grade"],
     )
-    db.commit()
\ No newline at end of file
+    return summary
@@ -1,43 +1,64 @@
-import os
-from sqlalchemy import create_engine
+import asyncio
+from functools import lru_cache
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from dotenv import load_dotenv
 
-import time
+from .config import get_settings
+from .db_pool import PoolStats, instrumented_pool_class, pool_status
+from .metrics import instrument_engine
 
-# 環境変数を読み込む
-load_dotenv()
+Base = declarative_base()
 
-# データベース接続情報
-MYSQL_USER = os.getenv("MYSQL_USER")
-MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD")
-MYSQL_HOST = os.getenv("MYSQL_HOST", "database")
-MYSQL_DATABASE = os.getenv("MYSQL_DATABASE", "inventory_management")
+# コネクションプールの計測値
+pool_stats = PoolStats()
+async_pool_stats = PoolStats()
 
-DATABASE_URL = f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}/{MYSQL_DATABASE}"
+def _pool_options(settings, base, stats):
+    options = {"pool_pre_ping": settings.db_pool_pre_ping, "pool_recycle": settings.db_pool_recycle}
+    # SQLite（ベンチマーク用）など QueuePool を使わないデータベースではプール設定を渡さない
+    if not settings.database_url.startswith("sqlite"):
+        options.update(
+            poolclass=instrumented_pool_class(base, stats),
+            pool_size=settings.db_pool_size,
+            max_overflow=settings.db_max_overflow,
+            pool_timeout=settings.db_pool_timeout,
+        )
+    return options
 
-# データベースに接続するまで少し待つ
-retries = 5
-while retries > 0:
-    try:
-        # エンジン作成を試みる
-        engine = create_engine(DATABASE_URL)
-        engine.connect()
-        break
-    except Exception as e:
-        retries -= 1
-        print(f"データベース接続を試行中... 残り{retries}回")
-        if retries == 0:
-            print(f"データベース接続エラー: {e}")
-            # エラーが継続する場合でもアプリケーションを起動させる
-            engine = create_engine(DATABASE_URL)
-        time.sleep(5)  # 5秒待つ
-
-# エンジンとセッションの設定
-# engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
+# エンジンは最初に使われたときに作る（作成しただけでは接続しない）
+@lru_cache
+def get_engine():
+    settings = get_settings()
+    engine = create_engine(settings.database_url, **_pool_options(settings, QueuePool, pool_stats))
+    instrument_engine(engine)
+    return engine
+
+@lru_cache
+def get_async_engine():
+    settings = get_settings()
+    engine = create_async_engine(
+        settings.async_database_url, **_pool_options(settings, AsyncAdaptedQueuePool, async_pool_stats)
+    )
+    # イベントは同期側のエンジンに登録する
+    instrument_engine(engine.sync_engine)
+    return engine
+
+@lru_cache
+def _session_factory():
+    return sessionmaker(autocommit=False, autoflush=False, bind=get_engine())
+
+@lru_cache
+def _async_session_factory():
+    return async_sessionmaker(get_async_engine(), class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+def SessionLocal():
+    return _session_factory()()
+
+def AsyncSessionLocal():
+    return _async_session_factory()()
 
 # 依存性注入用関数
 def get_db():
@@ -45,4 +66,44 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# 非同期エンドポイント用の依存性注入関数
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# データベースの状態（/health で返す）
+db_state = {"ready": False, "last_error": None}
+
+async def check_database(timeout: float = 2.0) -> bool:
+    try:
+        async with asyncio.timeout(timeout):
+            async with get_async_engine().connect() as conn:
+                await conn.execute(text("SELECT 1"))
+    except Exception as e:
+        db_state["ready"] = False
+        db_state["last_error"] = str(e) or e.__class__.__name__
+        return False
+    db_state["ready"] = True
+    db_state["last_error"] = None
+    return True
+
+async def wait_until_ready(retries: int = None, interval: float = None) -> bool:
+    # 起動をブロックせずに、接続できるまで再試行する
+    settings = get_settings()
+    retries = retries or settings.db_connect_retries
+    interval = interval or settings.db_connect_interval
+    for attempt in range(1, retries + 1):
+        if await check_database():
+            return True
+        print(f"データベース接続を試行中... ({attempt}/{retries}) {db_state['last_error']}")
+        await asyncio.sleep(interval)
+    print(f"データベース接続エラー: {db_state['last_error']}")
+    return False
+
+def pool_statistics() -> dict:
+    return {
+        "sync": pool_status(get_engine().pool, pool_stats),
+        "async": pool_status(get_async_engine().sync_engine.pool, async_pool_stats),
+    }
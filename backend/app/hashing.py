@@ -0,0 +1,101 @@
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import bcrypt
+
+from .config import get_settings
+
+# パスワードハッシュ専用のプロセスプール
+# bcrypt は 1 回あたり数百ミリ秒の CPU を使うので、リクエストを処理するプロセスの外で実行し、
+# 同時実行数（ワーカー数）と待ち行列の長さに上限を設ける。
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = 0
+_pending_lock = threading.Lock()
+
+
+class HashingBusy(Exception):
+    # 待ち行列があふれたときに送出する（503 として返す）
+    pass
+
+
+def _hashpw(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+def _checkpw(password: str, hashed: str) -> bool:
+    return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=get_settings().hash_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True, cancel_futures=True)
+            _executor = None
+
+
+def _submit(fn, *args):
+    global _pending
+    settings = get_settings()
+    with _pending_lock:
+        if _pending >= settings.hash_workers + settings.hash_max_queue:
+            raise HashingBusy()
+        _pending += 1
+
+    try:
+        future = get_executor().submit(fn, *args)
+    except Exception:
+        _release()
+        raise
+    future.add_done_callback(lambda _: _release())
+    return future
+
+
+def _release():
+    global _pending
+    with _pending_lock:
+        _pending -= 1
+
+
+def pending() -> int:
+    return _pending
+
+
+def needs_rehash(hashed: str) -> bool:
+    # ハッシュ文字列 "$2b$12$..." のコストが設定値と違えば作り直す
+    try:
+        return int(hashed.split("$")[2]) != get_settings().bcrypt_rounds
+    except (IndexError, ValueError):
+        return True
+
+
+# 同期版（スレッドプールで動くエンドポイント・crud 用）
+def hash_password(password: str) -> str:
+    return _submit(_hashpw, password, get_settings().bcrypt_rounds).result()
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return _submit(_checkpw, plain_password, hashed_password).result()
+
+
+# 非同期版（イベントループを止めずに結果を待つ）
+async def hash_password_async(password: str) -> str:
+    return await asyncio.wrap_future(_submit(_hashpw, password, get_settings().bcrypt_rounds))
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await asyncio.wrap_future(_submit(_checkpw, plain_password, hashed_password))
@@ -0,0 +1,212 @@
+import hashlib
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from .config import get_settings
+
+# 物品の画像
+# アップロードされたファイルは内容の SHA-256 を名前にして保存する（同じ画像は 1 つだけ持つ）:
+#   IMAGE_DIR/ab/<sha256>/original    アップロードされたまま
+#   IMAGE_DIR/ab/<sha256>/thumb.webp  一覧用の縮小版
+#   IMAGE_DIR/ab/<sha256>/large.webp  詳細表示用（長辺を IMAGE_LARGE_SIZE まで縮める）
+# 縮小版は専用のプロセスプールで作り、リクエストはその完了を待たない。
+# 名前が内容で決まるので、配信するファイルは変わらない（ブラウザ・CDN にずっとキャッシュさせてよい）。
+# Item.image_path には sha256 を入れる（それ以外の値は以前の自由入力として扱い、縮小版は作らない）。
+
+CHUNK_SIZE = 1024 * 1024
+DIGEST = re.compile(r"[0-9a-f]{64}")
+
+# 配信名 -> (ファイル名, 設定から長辺の最大ピクセル数を取り出す関数)
+VARIANTS = {
+    "thumb": ("thumb.webp", lambda settings: settings.image_thumb_size),
+    "large": ("large.webp", lambda settings: settings.image_large_size),
+}
+
+# 先頭のバイト列 -> Content-Type（受け付ける形式）
+SIGNATURES = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+_in_flight = set()
+_failed = set()  # 縮小版を作れなかった画像（同じ内容なので何度やっても失敗する。プロセスの再起動まで作り直さない）
+_in_flight_lock = threading.Lock()
+_stats = {"uploaded": 0, "deduplicated": 0, "rendered": 0, "failed": 0}
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+class UnsupportedImage(ValueError):
+    pass
+
+
+def sniff(head: bytes) -> Optional[str]:
+    for signature, media_type in SIGNATURES:
+        if head.startswith(signature):
+            return media_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def is_digest(value: Optional[str]) -> bool:
+    return bool(value) and DIGEST.fullmatch(value) is not None
+
+
+def directory(digest: str, root: Optional[str] = None) -> str:
+    return os.path.join(root or get_settings().image_dir, digest[:2], digest)
+
+
+def variant_path(digest: str, variant: str) -> str:
+    name = "original" if variant == "original" else VARIANTS[variant][0]
+    return os.path.join(directory(digest), name)
+
+
+def url(image_path: Optional[str], variant: str = "thumb") -> Optional[str]:
+    # フロントエンドとは別のオリジンから配信するので、BACKEND_URL からの絶対 URL にする
+    if not is_digest(image_path):
+        return None
+    return f"{get_settings().backend_url.rstrip('/')}/images/{image_path}/{variant}"
+
+
+def store(stream, max_bytes: Optional[int] = None) -> str:
+    # stream（UploadFile.file など）を少しずつ一時ファイルに書きながらハッシュを計算し、sha256 の名前に移す
+    max_bytes = max_bytes or get_settings().image_max_bytes
+    root = get_settings().image_dir
+    os.makedirs(root, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    fd, tmp = tempfile.mkstemp(dir=root, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if size == 0 and sniff(chunk[:16]) is None:
+                    raise UnsupportedImage("JPEG・PNG・GIF・WebP の画像をアップロードしてください")
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ImageTooLarge(f"画像は {max_bytes // (1024 * 1024)}MB 以下にしてください")
+                digest.update(chunk)
+                out.write(chunk)
+        if size == 0:
+            raise UnsupportedImage("ファイルが空です")
+
+        name = digest.hexdigest()
+        target = directory(name, root)
+        os.makedirs(target, exist_ok=True)
+        original = os.path.join(target, "original")
+        if os.path.exists(original):
+            _stats["deduplicated"] += 1
+        else:
+            os.replace(tmp, original)
+            tmp = None
+            _stats["uploaded"] += 1
+        return name
+    finally:
+        if tmp is not None:
+            os.unlink(tmp)
+
+
+def _render(target: str, variants: list, quality: int) -> list:
+    # プロセスプールで動く。variants: [(ファイル名, 長辺の最大ピクセル数)]
+    from PIL import Image, ImageOps
+
+    written = []
+    with Image.open(os.path.join(target, "original")) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info or image.mode in ("LA", "P") else "RGB")
+        for name, size in variants:
+            resized = image.copy()
+            resized.thumbnail((size, size), Image.Resampling.LANCZOS)
+            # 書きかけのファイルを配信しないように、別名で書いてから置き換える
+            tmp = os.path.join(target, f".{name}.tmp")
+            resized.save(tmp, "WEBP", quality=quality, method=4)
+            os.replace(tmp, os.path.join(target, name))
+            written.append(name)
+    return written
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=get_settings().image_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True, cancel_futures=True)
+            _executor = None
+
+
+def render_variants(digest: str):
+    # まだない縮小版を作るようにプロセスプールへ渡す（作成中・作れなかったものは重ねて渡さない）。完了は待たない
+    # 縮小版のない画像へのリクエストが続いても、ファイルを調べる前に作成中かどうかで弾く
+    with _in_flight_lock:
+        if digest in _in_flight or digest in _failed:
+            return None
+        _in_flight.add(digest)
+    settings = get_settings()
+    target = directory(digest)
+    missing = [
+        (name, size(settings))
+        for name, size in VARIANTS.values()
+        if not os.path.exists(os.path.join(target, name))
+    ]
+    if not missing:
+        _done(digest, None)
+        return None
+    try:
+        future = get_executor().submit(_render, target, missing, settings.image_webp_quality)
+    except Exception:
+        _done(digest, None)
+        raise
+    future.add_done_callback(lambda f: _done(digest, f))
+    return future
+
+
+def _done(digest: str, future):
+    with _in_flight_lock:
+        _in_flight.discard(digest)
+    if future is None or future.cancelled():
+        return
+    if future.exception() is not None:
+        with _in_flight_lock:
+            _failed.add(digest)
+        _stats["failed"] += 1
+        print(f"画像の縮小版を作れませんでした: {digest} {future.exception()!r}")
+    else:
+        _stats["rendered"] += 1
+
+
+def media_type(path: str) -> str:
+    if path.endswith(".webp"):
+        return "image/webp"
+    with open(path, "rb") as f:
+        return sniff(f.read(16)) or "application/octet-stream"
+
+
+def stats() -> dict:
+    with _in_flight_lock:
+        pending = len(_in_flight)
+        unrenderable = len(_failed)
+    return {**_stats, "pending": pending, "unrenderable": unrenderable}
@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from . import models
+
+# 定期ジョブの実行権（リース）
+# スケジューラーは uvicorn のワーカーごとに動くので、同じジョブを 1 つのワーカーだけが実行するよう、
+# job_watermark の "lease:<ジョブ名>" の行に期限を書く。
+#   - 期限の書き換えは「読んだ値のときだけ書き換える」条件付き UPDATE なので、同時に取りに来ても 1 つしか取れない
+#   - 実行中に止まったワーカーのリースも、期限が過ぎれば他のワーカーが取り直せる
+
+table = models.JobWatermark.__table__
+
+
+def _name(job: str) -> str:
+    return f"lease:{job}"
+
+
+def acquire(db, job: str, seconds: float, now: Optional[datetime] = None) -> Optional[datetime]:
+    # 取れたら期限を返す（他のワーカーが持っていれば None）。取れたらコミットまで行う
+    now = now or datetime.now()
+    # MySQL の DATETIME は秒までなので、release で読み直した値と比べられるようそろえておく
+    expires = (now + timedelta(seconds=seconds)).replace(microsecond=0)
+    name = _name(job)
+    current = db.execute(select(table.c.value).where(table.c.name == name)).scalar()
+    if current is not None and current > now:
+        db.rollback()
+        return None
+    try:
+        if current is None:
+            db.execute(insert(table).values(name=name, value=expires))
+        elif db.execute(update(table).where(table.c.name == name, table.c.value == current).values(value=expires)).rowcount != 1:
+            db.rollback()
+            return None
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return None
+    return expires
+
+
+def release(db, job: str, expires: datetime):
+    # 自分のリースのときだけ期限を今にする（期限が過ぎて他のワーカーが取り直していたら何もしない）
+    # ジョブが途中で失敗していても書けるよう、先に巻き戻す
+    db.rollback()
+    db.execute(update(table).where(table.c.name == _name(job), table.c.value == expires).values(value=datetime.now()))
+    db.commit()
@@ -0,0 +1,157 @@
+import sys
+
+from sqlalchemy import and_, delete, exists, func, insert, select, update
+
+from . import models
+
+# 物品ごとの今の貸出（item_current_loan）
+# 貸出の申請・承認・却下・取り消し・返却の各処理が、物品の貸出状態を変えるのと同じトランザクションでここを呼ぶ。
+# 「誰がいつから借りているか」を item_transaction を遡らずに、物品 id（主キー）や利用者 id で引ける。
+# 履歴と食い違ったときは `python -m app.loans verify` で確認し、`rebuild` で作り直す。
+
+OPEN_STATUSES = ("request", "approved")
+
+loan = models.ItemCurrentLoan.__table__
+tx = models.ItemTransaction.__table__
+
+
+def _insert_from_transactions(db, condition):
+    db.execute(
+        insert(loan).from_select(
+            ["item_id", "transaction_id", "user_id", "status", "borrowed_at", "due_date"],
+            select(tx.c.item_id, tx.c.id, tx.c.user_id, tx.c.status, tx.c.transaction_date, tx.c.due_date).where(condition),
+        )
+    )
+
+
+def borrowed(db, transaction_id: int, item_id: int):
+    # 貸出の申請（物品を確保した直後、取引を flush してから呼ぶ）
+    db.execute(delete(loan).where(loan.c.item_id == item_id))
+    _insert_from_transactions(db, tx.c.id == transaction_id)
+
+
+def approved(db, transaction_ids):
+    # 返却期限は承認時に取引へ入れたもの（crud.assign_due_dates）を写す
+    db.execute(
+        update(loan)
+        .where(loan.c.transaction_id.in_(transaction_ids))
+        .values(status="approved", due_date=select(tx.c.due_date).where(tx.c.id == loan.c.transaction_id).scalar_subquery())
+    )
+    # 申請時に確保できず承認時に確保し直した場合など、記録がなければ作る（他の取引が借りている物品には作らない）
+    _insert_from_transactions(db, and_(
+        tx.c.id.in_(transaction_ids),
+        ~exists().where(loan.c.item_id == tx.c.item_id),
+    ))
+
+
+def closed(db, transaction_ids):
+    # 却下・取り消し・返却
+    db.execute(delete(loan).where(loan.c.transaction_id.in_(transaction_ids)))
+
+
+def item_returned(db, item_id: int):
+    # どの貸出の返却か分からない返却（type="return" の取引）
+    db.execute(delete(loan).where(loan.c.item_id == item_id))
+
+
+CURRENT_LOAN_COLUMNS = (
+    loan.c.item_id,
+    models.Item.name.label("item_name"),
+    loan.c.transaction_id,
+    loan.c.user_id,
+    models.User.name.label("user_name"),
+    loan.c.status,
+    loan.c.borrowed_at,
+    loan.c.due_date,
+)
+
+
+def item_loan_statement(item_id: int):
+    # 物品が無ければ行なし、貸出中でなければ loan 側のカラムが NULL の 1 行
+    return (
+        select(models.Item.id.label("id"), *CURRENT_LOAN_COLUMNS)
+        .select_from(models.Item)
+        .outerjoin(loan, loan.c.item_id == models.Item.id)
+        .outerjoin(models.User, models.User.id == loan.c.user_id)
+        .where(models.Item.id == item_id)
+    )
+
+
+def user_loans_statement(user_id: int):
+    return (
+        select(*CURRENT_LOAN_COLUMNS)
+        .select_from(loan)
+        .join(models.Item, models.Item.id == loan.c.item_id)
+        .join(models.User, models.User.id == loan.c.user_id)
+        .where(loan.c.user_id == user_id)
+        .order_by(loan.c.borrowed_at, loan.c.item_id)
+    )
+
+
+def _open_borrow_condition():
+    # 履歴から求めた今の貸出: 物品ごとに、申請中・貸出中で返却の取引（type="return"）から参照されていない
+    # 最後の貸出の取引。物品が貸出可能になっているもの（相手の分からない返却で戻ったもの）は除く
+    child = tx.alias("child")
+    latest = (
+        select(func.max(tx.c.id))
+        .select_from(tx.join(models.Item.__table__, models.Item.id == tx.c.item_id))
+        .where(
+            tx.c.type == "borrow",
+            tx.c.status.in_(OPEN_STATUSES),
+            models.Item.is_available == False,  # noqa: E712
+            ~exists().where(child.c.related_transaction_id == tx.c.id, child.c.type == "return"),
+        )
+        .group_by(tx.c.item_id)
+    )
+    return tx.c.id.in_(latest)
+
+
+def verify(db) -> list:
+    # 履歴から求め直した今の貸出と、item_current_loan の差分を返す
+    expected = {
+        row.item_id: (row.id, row.user_id, row.status)
+        for row in db.execute(select(tx.c.item_id, tx.c.id, tx.c.user_id, tx.c.status).where(_open_borrow_condition()))
+    }
+    stored = {
+        row.item_id: (row.transaction_id, row.user_id, row.status)
+        for row in db.execute(select(loan.c.item_id, loan.c.transaction_id, loan.c.user_id, loan.c.status))
+    }
+    drift = []
+    for item_id in sorted(set(expected) | set(stored)):
+        if expected.get(item_id) != stored.get(item_id):
+            drift.append({"item_id": item_id, "expected": expected.get(item_id), "stored": stored.get(item_id)})
+    return drift
+
+
+def rebuild(db):
+    db.execute(delete(loan))
+    _insert_from_transactions(db, _open_borrow_condition())
+    db.commit()
+
+
+def main(argv):
+    from .database import SessionLocal
+
+    command = argv[1] if len(argv) > 1 else "verify"
+    if command not in ("verify", "rebuild"):
+        print("使い方: python -m app.loans [verify|rebuild]")
+        return 2
+
+    db = SessionLocal()
+    try:
+        if command == "rebuild":
+            rebuild(db)
+            print("今の貸出を履歴から作り直しました")
+            return 0
+        drift = verify(db)
+        for row in drift:
+            # (取引 id, 利用者 id, 状態)
+            print(f"item_id={row['item_id']} 履歴={row['expected']} 記録={row['stored']}")
+        print("ずれはありません" if not drift else f"{len(drift)} 件の物品で記録がずれています")
+        return 1 if drift else 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,229 @@
+import heapq
+import itertools
+import smtplib
+import threading
+import time
+from typing import Optional
+
+from .config import get_settings
+
+# メール送信キュー
+# リクエストの処理中には送らず、キューに積むだけで返す。送信はバックグラウンドのスレッドが行い、
+#   - SMTP の接続（STARTTLS・ログイン済み）を使い回し、しばらく送るものがなければ切断する
+#   - 溜まっている分は 1 回の接続でまとめて送る
+#   - 失敗したメールは間隔を倍々に空けて再送し、上限回数を超えたら諦める
+# 終了時は lifespan から残りを 1 回ずつ送ってから止める。
+
+
+class Mailer:
+    # 引数を省略すると設定値（MAIL_*）を使う
+    def __init__(self, max_queue: Optional[int] = None, batch_size: Optional[int] = None, max_retries: Optional[int] = None, retry_backoff: Optional[float] = None, idle_timeout: Optional[float] = None):
+        self._max_queue = max_queue
+        self._batch_size = batch_size
+        self._max_retries = max_retries
+        self._retry_backoff = retry_backoff
+        self._idle_timeout = idle_timeout
+        # (送信してよい時刻, 連番, 試行回数, メッセージ, 積んだ時刻) のヒープ
+        self._queue = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = None
+        self._conn = None
+        self._last_used = 0.0
+
+        self.enqueued = 0
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.retries = 0
+        self.connections = 0
+        self.last_send_ms = 0.0
+        self.max_send_ms = 0.0
+        self.total_send_ms = 0.0
+        self.total_queue_ms = 0.0
+
+    @property
+    def max_queue(self) -> int:
+        return self._max_queue or get_settings().mail_queue_max
+
+    @property
+    def batch_size(self) -> int:
+        return self._batch_size or get_settings().mail_batch_size
+
+    @property
+    def max_retries(self) -> int:
+        return self._max_retries if self._max_retries is not None else get_settings().mail_max_retries
+
+    @property
+    def retry_backoff(self) -> float:
+        return self._retry_backoff or get_settings().mail_retry_backoff
+
+    @property
+    def idle_timeout(self) -> float:
+        return self._idle_timeout or get_settings().mail_idle_timeout
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="mailer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        # 送信スレッドを止めてから、残っている分を再送なしで 1 回ずつ送る
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._cond:
+            batch = [(attempts, message, queued_at) for _, _, attempts, message, queued_at in sorted(self._queue)]
+            self._queue.clear()
+        if batch:
+            self._send_batch(batch, retry=False)
+        self._close()
+
+    def send(self, message) -> bool:
+        # message は email.message.Message（From / To ヘッダから送信元・宛先を決める）
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                self.dropped += 1
+                return False
+            now = time.monotonic()
+            heapq.heappush(self._queue, (now, next(self._seq), 0, message, now))
+            self.enqueued += 1
+            self._cond.notify()
+        return True
+
+    def _run(self):
+        while True:
+            idle = False
+            with self._cond:
+                batch = self._take_ready()
+                if not batch and not self._stopping:
+                    # 次の再送時刻まで、何もなければ idle_timeout まで待つ
+                    timeout = self._queue[0][0] - time.monotonic() if self._queue else self.idle_timeout
+                    self._cond.wait(max(timeout, 0.0))
+                    batch = self._take_ready()
+                    idle = not batch and not self._queue
+                if self._stopping:
+                    # 取り出した分はキューに戻し、stop() でまとめて送る
+                    for attempts, message, queued_at in batch:
+                        heapq.heappush(self._queue, (0, next(self._seq), attempts, message, queued_at))
+                    return
+            # 接続・送信はロックの外で行う（send() を待たせない）
+            if batch:
+                self._send_batch(batch)
+            elif idle:
+                self._close_if_idle()
+
+    def _take_ready(self):
+        # 送信時刻を過ぎたものを batch_size 件まで取り出す（呼び出し側で _cond を持っていること）
+        batch = []
+        now = time.monotonic()
+        while self._queue and self._queue[0][0] <= now and len(batch) < self.batch_size:
+            _, _, attempts, message, queued_at = heapq.heappop(self._queue)
+            batch.append((attempts, message, queued_at))
+        return batch
+
+    def _send_batch(self, batch, retry: bool = True):
+        for index, (attempts, message, queued_at) in enumerate(batch):
+            start = time.perf_counter()
+            try:
+                self._deliver(message)
+            except Exception as e:
+                # サーバーが応答を返したエラー（4xx/5xx）なら接続はそのまま使える
+                responded = isinstance(e, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused))
+                if not responded:
+                    self._close()
+                if retry and attempts < self.max_retries:
+                    delay = self.retry_backoff * (2 ** attempts)
+                    with self._cond:
+                        heapq.heappush(self._queue, (time.monotonic() + delay, next(self._seq), attempts + 1, message, queued_at))
+                        self.retries += 1
+                    print(f"メール送信エラー（{delay:.1f} 秒後に再送）: {e}")
+                    continue
+                if not retry and not responded:
+                    # 終了時にサーバーへつながらなければ、残りも送れないので諦める
+                    self.failed += len(batch) - index
+                    print(f"メール送信エラー（残り {len(batch) - index} 通の送信を中止）: {e}")
+                    return
+                self.failed += 1
+                print(f"メール送信エラー（送信を中止）: {e}")
+                continue
+
+            elapsed = (time.perf_counter() - start) * 1000
+            self.sent += 1
+            self.last_send_ms = elapsed
+            self.max_send_ms = max(self.max_send_ms, elapsed)
+            self.total_send_ms += elapsed
+            self.total_queue_ms += (time.monotonic() - queued_at) * 1000
+
+    def _deliver(self, message):
+        conn = self._connection()
+        try:
+            conn.send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            # 使い回していた接続がサーバー側で切られていたら、つなぎ直して 1 度だけやり直す
+            self._close()
+            self._connection().send_message(message)
+        self._last_used = time.monotonic()
+
+    def _connection(self):
+        if self._conn is not None:
+            return self._conn
+        settings = get_settings()
+        conn = smtplib.SMTP(settings.smtp_server, settings.smtp_port, timeout=settings.smtp_timeout)
+        try:
+            conn.ehlo()
+            if settings.smtp_starttls and conn.has_extn("starttls"):
+                conn.starttls()
+                conn.ehlo()                      # TLSのあと再度挨拶
+            # 認証をサポートしないサーバー（ローカルの検証用サーバーなど）ではログインしない
+            if settings.smtp_user and settings.smtp_password and conn.has_extn("auth"):
+                conn.login(settings.smtp_user, settings.smtp_password)
+        except Exception:
+            conn.close()
+            raise
+        self._conn = conn
+        self._last_used = time.monotonic()
+        self.connections += 1
+        return conn
+
+    def _close_if_idle(self):
+        if self._conn is not None and time.monotonic() - self._last_used >= self.idle_timeout:
+            self._close()
+
+    def _close(self):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        try:
+            conn.quit()
+        except Exception:
+            conn.close()
+
+    def depth(self) -> int:
+        with self._cond:
+            return len(self._queue)
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth(),
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "retries": self.retries,
+            "connections": self.connections,
+            "connected": self._conn is not None,
+            "last_send_ms": round(self.last_send_ms, 3),
+            "max_send_ms": round(self.max_send_ms, 3),
+            "avg_send_ms": round(self.total_send_ms / self.sent, 3) if self.sent else 0.0,
+            "avg_queue_ms": round(self.total_queue_ms / self.sent, 3) if self.sent else 0.0,
+        }
+
+
+mailer = Mailer()
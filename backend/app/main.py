@@ -1,48 +1,138 @@
+import asyncio
 import os
-from fastapi import Depends, FastAPI, HTTPException, Query, Response, status
+from fastapi import Depends, FastAPI, File, HTTPException, Query, Request, Response, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError 
 from typing import List, Optional
 from datetime import timedelta
 from contextlib import asynccontextmanager
 
-from . import crud, models, schemas, scheduler
-from .database import engine, get_db
-from .utils import verify_password, get_current_user, create_access_token, get_current_admin_user, send_reset_email, hash_password, verify_reset_token
+from . import archive, database, migrations, crud, async_crud, models, schemas, scheduler, pagination, hashing, images, bulk, streaming, stats, suggest, versioning, metrics, projection
+from .cache import user_cache
+from .search_log_buffer import search_log_buffer
+from .mailer import mailer
+from .config import get_settings
+from .database import get_db, get_async_db
+from .utils import get_current_user, get_current_user_async, create_access_token, get_current_admin_user, require_metrics_access, send_reset_email, verify_reset_token
 
 from datetime import datetime
 import pytz
-from dotenv import load_dotenv
-load_dotenv()
 
-# データベーステーブルの作成
-models.Base.metadata.create_all(bind=engine)
+# テーブルの作成・変更は起動時ではなく `python -m app.migrations upgrade` で行う
+async def prepare_database():
+    # 接続できるまで待ち、未適用のマイグレーションがあれば知らせる（起動自体は待たせない）
+    if await database.wait_until_ready():
+        try:
+            pending = await run_in_threadpool(migrations.pending_migrations, database.get_engine())
+        except Exception as e:
+            print(f"スキーマのバージョン確認エラー: {e}")
+            return
+        for version, description in pending:
+            print(f"未適用のマイグレーションがあります: {version} {description}")
 
 # スケジューラを起動
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # 起動時
     scheduler.start_scheduler()
+    hashing.get_executor()
+    search_log_buffer.start()
+    mailer.start()
+    suggest.get_suggester().start()
+    startup_task = asyncio.create_task(prepare_database())
     yield
-    # 終了時（必要なら shutdown 処理をここに）
+    # 終了時
+    startup_task.cancel()
+    await run_in_threadpool(search_log_buffer.stop)
+    await run_in_threadpool(mailer.stop)
+    await run_in_threadpool(suggest.get_suggester().stop)
+    await run_in_threadpool(hashing.shutdown)
+    await run_in_threadpool(images.shutdown)
 
 app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=[os.getenv("FRONTEND_URL")],
+    allow_origins=[get_settings().frontend_url],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Server-Timing"],
 )
 
+# ルートごとのレイテンシと SQL の回数を計測する（CORS より外側に置き、すべてのリクエストを数える）
+app.add_middleware(metrics.MetricsMiddleware, server_timing=get_settings().metrics_server_timing)
+
+# パスワードハッシュの待ち行列があふれたら、少し待って再試行してもらう
+@app.exception_handler(hashing.HashingBusy)
+async def hashing_busy_handler(request, exc):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "混み合っています。しばらくしてから再度お試しください。"},
+        headers={"Retry-After": "1"},
+    )
+
+# 貸出の競合（他の人が先に借りた、返却済みの取引を返却しようとしたなど）
+@app.exception_handler(crud.TransactionConflict)
+async def transaction_conflict_handler(request, exc):
+    return JSONResponse(status_code=409, content={"detail": str(exc)})
+
+def set_next_cursor(response: Response, cursor: Optional[str]):
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+
+# fields / expand を指定した一覧は response_model を通さず、項目を絞ったモデルで返す
+# （ETag や X-Next-Cursor など、response に付けたヘッダは引き継ぐ）
+def projected_response(response: Response, fields: projection.Projection, rows) -> JSONResponse:
+    return JSONResponse(fields.serialize(rows), headers=dict(response.headers))
+
+# テーブルの更新カウンタから ETag を作り、クライアントの持っている版と同じなら 304 を返す
+# （一覧のクエリやシリアライズより前に呼ぶ）
+async def not_modified_response(request: Request, response: Response, db: AsyncSession, tables) -> Optional[Response]:
+    etag = await versioning.etag_for(db, request, tables)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if versioning.is_not_modified(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    response.headers.update(headers)
+    return None
+
 #httpメソッド：get（ルートエンドポイント）
 @app.get("/")
 async def read_root():
     return {"Hello": "World"}
 
+# ヘルスチェック。データベースに繋がらなくても待たずに degraded を返す
+@app.get("/health")
+async def health():
+    if await database.check_database():
+        return {"status": "ok", "database": "ok"}
+    return JSONResponse(
+        status_code=503,
+        content={"status": "degraded", "database": "unavailable", "error": database.db_state["last_error"]},
+    )
+
+@app.get("/stats/db-pool")
+def read_db_pool_stats(current_admin: models.User = Depends(get_current_admin_user)):
+    return database.pool_statistics()
+
+# Prometheus 形式の計測値（管理者か METRICS_TOKEN の Bearer トークンのみ）
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics(_: None = Depends(require_metrics_access)):
+    gauges = {}
+    for engine, values in database.pool_statistics().items():
+        metrics.add_gauges(gauges, "db_pool", values, engine=engine)
+    metrics.add_gauges(gauges, "user_cache", user_cache.stats())
+    metrics.add_gauges(gauges, "search_log_buffer", search_log_buffer.stats())
+    metrics.add_gauges(gauges, "mailer", mailer.stats())
+    metrics.add_gauges(gauges, "suggest", suggest.get_suggester().stats())
+    metrics.add_gauges(gauges, "images", images.stats())
+    metrics.add_gauges(gauges, "password_hash", {"pending": hashing.pending()})
+    return PlainTextResponse(metrics.render(gauges), media_type="text/plain; version=0.0.4")
+
 # データベース接続テスト
 @app.get("/test-db")
 def test_db(db: Session = Depends(get_db)):
@@ -55,8 +145,8 @@ def test_db(db: Session = Depends(get_db)):
 
 # ログイン，ログアウトのエンドポイント
 @app.post("/login")
-def login(user: schemas.UserLogin, db: Session = Depends(get_db)):
-    db_user = crud.authenticate_user(db, user.email, user.password)
+async def login(user: schemas.UserLogin, db: AsyncSession = Depends(get_async_db)):
+    db_user = await async_crud.authenticate_user(db, user.email, user.password)
     if not db_user:
         raise HTTPException(status_code=400, detail="Invalid credentials")
     
@@ -92,11 +182,11 @@ def logout(current_user: models.User = Depends(get_current_user)):
 
 # ユーザー関連のエンドポイント
 @app.post("/users/", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_email(db, email=user.email)
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user = await async_crud.get_user_by_email(db, email=user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    return crud.create_user(db=db, user=user)
+    return await async_crud.create_user(db=db, user=user)
 
 @app.get("/users/", response_model=List[schemas.User])
 def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
@@ -111,14 +201,14 @@ def read_user(user_id: int, db: Session = Depends(get_db), current_user: models.
     return db_user
 
 @app.put("/users/{user_id}", response_model=schemas.User)
-def update_user(user_id: int, user: schemas.UserUpdate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+async def update_user(user_id: int, user: schemas.UserUpdate, db: AsyncSession = Depends(get_async_db), current_user: models.User = Depends(get_current_user_async)):
     # 自分自身 or 管理者かチェック
     if current_user.id != user_id and not current_user.is_admin:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Permission denied: only self or admin can update user info"
         )
-    db_user = crud.update_user(db, user_id=user_id, user=user)
+    db_user = await async_crud.update_user(db, user_id=user_id, user=user)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return db_user
@@ -191,10 +281,13 @@ def update_category(category_id: int, category: schemas.CategoryUpdate, db: Sess
         raise HTTPException(status_code=500, detail=f"予期しないエラーが発生しました: {str(e)}")
 
 @app.get("/categories/", response_model=List[schemas.Category])
-def read_categories(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), 
-                    current_user: models.User = Depends(get_current_user)
+async def read_categories(request: Request, response: Response, skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_async_db), 
+                    current_user: models.User = Depends(get_current_user_async)
                     ):
-    categories = crud.get_categories(db, skip=skip, limit=limit)
+    not_modified = await not_modified_response(request, response, db, ("category",))
+    if not_modified:
+        return not_modified
+    categories = await async_crud.get_categories(db, skip=skip, limit=limit)
     return categories
 
 @app.get("/categories/{category_id}", response_model=schemas.Category)
@@ -213,6 +306,30 @@ def create_item(item: schemas.ItemCreate, db: Session = Depends(get_db),
                 ):
     return crud.create_item(db=db, item=item)
 
+# 物品の一括登録（CSV / JSON Lines）。正しい行だけを登録し、失敗した行は行番号つきで返す
+@app.post("/items/import")
+def import_items(file: UploadFile = File(...), db: Session = Depends(get_db),
+                 current_admin: models.User = Depends(get_current_admin_user)
+                 ):
+    fmt = bulk.detect_format(file.filename, file.content_type)
+    try:
+        return bulk.import_items(db, bulk.iter_rows(file.file, fmt))
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="ファイルは UTF-8 で保存してください")
+
+# 物品の一括書き出し。件数に関係なく一定のメモリで返す
+@app.get("/items/export")
+def export_items(format: str = "csv", current_admin: models.User = Depends(get_current_admin_user)):
+    try:
+        fmt = streaming.normalize_format(format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(
+        streaming.stream_rows(bulk.items_export_statement(), fmt),
+        media_type=streaming.MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="items.{fmt}"'},
+    )
+
 @app.put("/items/{item_id}", response_model=schemas.Item)
 def update_item(item_id: int, item: schemas.ItemUpdate, db: Session = Depends(get_db)):
     db_item = crud.update_item(db, item_id=item_id, item=item)
@@ -220,8 +337,50 @@ def update_item(item_id: int, item: schemas.ItemUpdate, db: Session = Depends(ge
         raise HTTPException(status_code=404, detail="Item not found")
     return db_item
 
+# 物品の画像をアップロードする。同じ内容の画像は保存済みのものを使い、縮小版はバックグラウンドで作る
+@app.post("/items/{item_id}/image", response_model=schemas.Item)
+def upload_item_image(item_id: int, file: UploadFile = File(...), db: Session = Depends(get_db),
+                      current_admin: models.User = Depends(get_current_admin_user)
+                      ):
+    if crud.get_item(db, item_id) is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+    try:
+        digest = images.store(file.file)
+    except images.ImageTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except images.UnsupportedImage as e:
+        raise HTTPException(status_code=415, detail=str(e))
+    images.render_variants(digest)
+    return crud.update_item(db, item_id=item_id, item=schemas.ItemUpdate(image_path=digest))
+
+# 画像の配信（variant: original / thumb / large）。URL は内容のハッシュなので、ずっとキャッシュしてよい
+# Range・If-Range は FileResponse が扱い、対応するサーバーでは sendfile でそのまま送る
+# ファイルの有無を調べる（ブロックする）ので、スレッドプールで動く同期関数にしている
+@app.get("/images/{digest}/{variant}")
+def read_image(digest: str, variant: str, request: Request):
+    if not images.is_digest(digest) or (variant != "original" and variant not in images.VARIANTS):
+        raise HTTPException(status_code=404, detail="Image not found")
+    path = images.variant_path(digest, variant)
+    cache_control = "public, max-age=31536000, immutable"
+    if not os.path.exists(path):
+        # 縮小版がまだなら元の画像を返す（できあがったら同じ URL で縮小版を返すので、キャッシュさせない）
+        path = images.variant_path(digest, "original")
+        if not os.path.exists(path):
+            raise HTTPException(status_code=404, detail="Image not found")
+        images.render_variants(digest)
+        variant, cache_control = "original", "no-cache"
+    etag = f'"{digest}-{variant}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if versioning.is_not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=images.media_type(path), headers=headers)
+
+# cursor を指定するとカーソルモードになる（1ページ目は cursor= の空文字）
+# 次ページのカーソルは X-Next-Cursor ヘッダーで返す（最終ページでは付かない）
 @app.get("/items/", response_model=List[schemas.Item])
-def read_items(
+async def read_items(
+    request: Request,
+    response: Response,
     skip: int = 0, 
     limit: int = 100, 
     category_id: Optional[int] = None,
@@ -230,20 +389,72 @@ def read_items(
     is_available: Optional[bool] = None,
     sort_by: Optional[str] = None,
     sort_order: Optional[str] = "asc",
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    expand: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
 ):
-    items = crud.get_items(db, skip=skip, limit=limit, category_id=category_id, name=name, location=location, is_available=is_available, sort_by=sort_by, sort_order=sort_order,)
+    sort_key, order = crud.item_sort_key(sort_by, sort_order)
+    try:
+        # カーソルモードでは次のカーソルを作るのに並び替えキーも必要
+        item_fields = projection.item_projection(fields, expand, ("id", sort_key) if cursor is not None else ("id",))
+    except projection.InvalidFields as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    not_modified = await not_modified_response(request, response, db, ("item", "category"))
+    if not_modified:
+        return not_modified
+    try:
+        items = await async_crud.get_items(db, skip=skip, limit=limit, category_id=category_id, name=name, location=location, is_available=is_available, sort_by=sort_by, sort_order=sort_order, cursor=cursor, projection=item_fields)
+    except pagination.InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if cursor is not None:
+        set_next_cursor(response, pagination.next_cursor(items, sort_key, order, limit))
+    if item_fields:
+        return projected_response(response, item_fields, items)
     return items
 
 @app.get("/items/{item_id}", response_model=schemas.Item)
-def read_item(item_id: int, db: Session = Depends(get_db),
-              current_user: models.User = Depends(get_current_user)
+async def read_item(item_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_async_db),
+              current_user: models.User = Depends(get_current_user_async)
               ):
-    db_item = crud.get_item(db, item_id=item_id)
+    not_modified = await not_modified_response(request, response, db, ("item", "category"))
+    if not_modified:
+        return not_modified
+    db_item = await async_crud.get_item(db, item_id=item_id)
     if db_item is None:
         raise HTTPException(status_code=404, detail="Item not found")
     return db_item
 
+# 物品を今借りている人（申請中を含む）。貸出中でなければ null
+@app.get("/items/{item_id}/current-loan", response_model=Optional[schemas.CurrentLoan])
+async def read_item_current_loan(item_id: int, db: AsyncSession = Depends(get_async_db),
+                                 current_user: models.User = Depends(get_current_user_async)
+                                 ):
+    row = await async_crud.get_item_loan(db, item_id)
+    if row is None:
+        raise HTTPException(status_code=404, detail="Item not found")
+    if row.transaction_id is None:
+        return None
+    return {key: value for key, value in row._mapping.items() if key != "id"}
+
+# 利用者が今借りている物品（申請中を含む）
+@app.get("/users/{user_id}/loans", response_model=List[schemas.CurrentLoan])
+async def read_user_loans(user_id: int, db: AsyncSession = Depends(get_async_db),
+                          current_user: models.User = Depends(get_current_user_async)
+                          ):
+    return await async_crud.get_user_loans(db, user_id)
+
+# 返却期限を過ぎている今の貸出（返却期限の古い順、管理者のみ）
+@app.get("/overdue", response_model=List[schemas.CurrentLoan])
+async def read_overdue_loans(skip: int = 0, limit: int = Query(100, le=1000), db: AsyncSession = Depends(get_async_db),
+                             current_user: models.User = Depends(get_current_user_async)
+                             ):
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin privileges required")
+    return await async_crud.get_overdue_loans(db, skip=skip, limit=limit)
+
 # トランザクション関連のエンドポイント
 @app.post("/transactions/", response_model=schemas.ItemTransaction)
 def create_transaction(transaction: schemas.ItemTransactionCreate, db: Session = Depends(get_db), 
@@ -252,118 +463,139 @@ def create_transaction(transaction: schemas.ItemTransactionCreate, db: Session =
     return crud.create_transaction(db=db, transaction=transaction)
 
 @app.get("/transactions/", response_model=List[schemas.ItemTransactionWithDetails])
-def read_transactions(
+async def read_transactions(
+    response: Response,
     skip: int = 0, 
     limit: int = 100, 
     user_id: Optional[int] = None,
     item_id: Optional[int] = None,
     status: Optional[str] = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    expand: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    include_archive: bool = False,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(get_current_user_async)
+):
+    # 既定では item_transaction だけを読む。期間の指定か include_archive=true があり、
+    # それがアーカイブした期間にかかるときだけアーカイブも読む
+    try:
+        transaction_fields = projection.transaction_projection(fields, expand)
+        transactions = await async_crud.get_transactions(db, skip=skip, limit=limit, user_id=user_id, item_id=item_id, status=status, cursor=cursor, projection=transaction_fields, date_from=date_from, date_to=date_to, include_archive=include_archive)
+    except (pagination.InvalidCursor, projection.InvalidFields) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if cursor is not None:
+        set_next_cursor(response, pagination.next_cursor(transactions, "id", "asc", limit))
+    if transaction_fields:
+        return projected_response(response, transaction_fields, transactions)
+    return transactions
+
+# 取引履歴の書き出し（NDJSON / CSV）。サーバーサイドカーソルで少しずつ読みながら返す
+@app.get("/transactions/export")
+def export_transactions(
+    format: str = "ndjson",
+    user_id: Optional[int] = None,
+    type: Optional[str] = None,
+    status: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    include_archive: bool = False,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    current_admin: models.User = Depends(get_current_admin_user)
 ):
-    query = db.query(models.ItemTransaction)\
-        .options(
-            joinedload(models.ItemTransaction.item).joinedload(models.Item.category),
-            joinedload(models.ItemTransaction.user)
-        )
-
-    if user_id:
-        query = query.filter(models.ItemTransaction.user_id == user_id)
-    if item_id:
-        query = query.filter(models.ItemTransaction.item_id == item_id)
-    if status:
-        query = query.filter(models.ItemTransaction.status == status)
-
-    return query.offset(skip).limit(limit).all()
-
-@app.get("/transactions/", response_model=List[schemas.ItemTransactionWithDetails])
-def get_transactions(user_id: Optional[int] = None, type: Optional[str] = None, db: Session = Depends(get_db)):
-    query = db.query(models.ItemTransaction)
-
-    if user_id:
-        query = query.filter(models.ItemTransaction.user_id == user_id)
-
-    if type:
-        query = query.filter(models.ItemTransaction.type == type)
+    try:
+        fmt = streaming.normalize_format(format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    horizon = db.execute(archive.horizon_statement()).scalar() if archive.wants_archive(status, date_from, date_to, include_archive) else None
+    stmt = crud.transactions_export_statement(
+        user_id=user_id, type=type, status=status, date_from=date_from, date_to=date_to,
+        include_archive=archive.needs_archive(status, date_from, horizon, date_to, include_archive),
+    )
+    extension = "ndjson" if fmt == "jsonl" else fmt
+    return StreamingResponse(
+        streaming.stream_rows(stmt, fmt),
+        media_type=streaming.MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="transactions.{extension}"'},
+    )
 
-    return query.order_by(models.ItemTransaction.transaction_date.desc()).all()
+# 申請の一括承認・却下（/transactions/{transaction_id} より前に定義する）
+@app.patch("/transactions/batch", response_model=schemas.TransactionBatchResult)
+def batch_update_transaction_status(batch: schemas.TransactionBatchUpdate, db: Session = Depends(get_db),
+                                    current_admin: models.User = Depends(get_current_admin_user)
+                                    ):
+    return crud.batch_update_transaction_status(db, batch.ids, batch.status.value)
 
 @app.patch("/transactions/{transaction_id}", response_model=schemas.ItemTransaction)
 def update_transaction_status(transaction_id: int, status: str, db: Session = Depends(get_db)):
-    tx = crud.get_transaction(db, transaction_id)
+    try:
+        tx = crud.update_transaction_status(db, transaction_id, status)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if not tx:
         raise HTTPException(status_code=404, detail="Transaction not found")
-
-    tx.status = status
-
-    # 貸出リクエストの承認時
-    if status == "approved":
-        item = db.query(models.Item).filter(models.Item.id == tx.item_id).first()
-        if item:
-            item.is_available = False
-
-    # 却下時は在庫を元に戻す
-    elif status == "rejected":
-        item = db.query(models.Item).filter(models.Item.id == tx.item_id).first()
-        if item:
-            item.is_available = True
-
-    db.commit()
-    db.refresh(tx)
-    
     return tx
 
 @app.post("/cancel/{transaction_id}")
 def cancel_transaction(transaction_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    transaction = db.query(models.ItemTransaction).filter(models.ItemTransaction.id == transaction_id).first()
-    if not transaction or transaction.status != "request":
+    if not crud.cancel_transaction(db, transaction_id):
         raise HTTPException(status_code=404, detail="キャンセルできる申請が見つかりません")
-    
-    transaction.status = None
-
-    # キャンセル時に item の is_available を True に戻す
-    item = db.query(models.Item).filter(models.Item.id == transaction.item_id).first()
-    if item:
-        item.is_available = True
-
-    db.commit()
     return {"message": "申請をキャンセルしました"}
 
 @app.post("/return/{transaction_id}")
 def return_item(transaction_id: int, db: Session = Depends(get_db)):
-    tx = crud.get_transaction(db, transaction_id)
+    tx = crud.return_transaction(db, transaction_id)
     if not tx:
         raise HTTPException(status_code=404, detail="Transaction not found")
-
-    tx.status = "returned"
-    tx.returned_date = datetime.now()
-        # jst = pytz.timezone("Asia/Tokyo")
-    # tx.returned_date = datetime.now(jst)
-
-    item = db.query(models.Item).filter(models.Item.id == tx.item_id).first()
-    if item:
-        item.is_available = True
-
-    db.commit()
-    db.refresh(tx)
     return {"message": "返却完了", "transaction_id": tx.id}
 
 # 検索ログ作成エンドポイント
-@app.post("/search-logs/", response_model=schemas.SearchLog)
-def create_search_log(search_log: schemas.SearchLogCreate, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    return crud.create_search_log(db=db, search_log=search_log)
+# バッファに積むだけで返し、書き込みはまとめて後から行う
+# 202 {"message": "accepted"} を返す（以前は 200 で保存した行を返していたが、id は書き込むまで決まらない）
+@app.post("/search-logs/", status_code=status.HTTP_202_ACCEPTED, response_model=schemas.SearchLogAccepted)
+async def create_search_log(search_log: schemas.SearchLogCreate, current_user: models.User = Depends(get_current_user_async)):
+    if not search_log_buffer.add(search_log):
+        raise HTTPException(status_code=503, detail="検索ログの受付が混み合っています")
+    return {"message": "accepted"}
+
+# カテゴリごとの物品数（集計テーブルから返すので item テーブルは走査しない）
+@app.get("/stats/categories", response_model=List[schemas.CategoryStats])
+async def read_category_stats(db: AsyncSession = Depends(get_async_db),
+                              current_user: models.User = Depends(get_current_user_async)
+                              ):
+    result = await db.execute(stats.category_stats_statement())
+    return stats.to_response(result.all())
+
+@app.get("/stats/search-log-buffer")
+def read_search_log_buffer_stats(current_admin: models.User = Depends(get_current_admin_user)):
+    return search_log_buffer.stats()
+
+# 検索候補（入力途中の補完と、q を空にしたときは最近よく検索されている語）
+# メモリ上の索引だけで答える（索引は suggest.py がバックグラウンドで search_log・物品から作り直す）
+@app.get("/suggest", response_model=schemas.Suggestions)
+async def read_suggestions(q: str = "", limit: int = Query(10, ge=1, le=suggest.MAX_LIMIT),
+                           current_user: models.User = Depends(get_current_user_async)):
+    return suggest.get_suggester().suggest(q, limit)
+
+@app.get("/stats/suggest")
+def read_suggest_stats(current_admin: models.User = Depends(get_current_admin_user)):
+    return suggest.get_suggester().stats()
 
 @app.post("/change-password")
-def change_password(
+async def change_password(
     req: schemas.ChangePasswordRequest,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(get_current_user_async)
 ):
-    if not verify_password(req.current_password, current_user.password):
+    # キャッシュのパスワードは古い可能性があるので、照合はデータベースの値で行う
+    user = await async_crud.get_user(db, current_user.id)
+    if user is None or not await hashing.verify_password_async(req.current_password, user.password):
         raise HTTPException(status_code=400, detail="現在のパスワードが正しくありません")
 
-    current_user.password = hash_password(req.new_password)
-    db.commit()
+    await async_crud.set_password(db, user.id, req.new_password)
     return {"message": "パスワードを変更しました"}
 
 @app.post("/forgot-password")
@@ -372,24 +604,48 @@ def forgot_password(email: str, db: Session = Depends(get_db)):
     if not user:
         raise HTTPException(status_code=404, detail="登録されたメールアドレスが見つかりません")
 
-    send_reset_email(user.email)
+    # 送信はキューに積むだけで返す
+    if not send_reset_email(user.email):
+        raise HTTPException(status_code=503, detail="メールの送信が混み合っています。しばらくしてから再度お試しください。")
     return {"message": "リセットリンクを送信しました。"}
 
 @app.post("/reset-password")
-def reset_password(req: schemas.ResetPasswordRequest, db: Session = Depends(get_db)):
+async def reset_password(req: schemas.ResetPasswordRequest, db: AsyncSession = Depends(get_async_db)):
     try:
         email = verify_reset_token(req.token)
     except Exception:
         raise HTTPException(status_code=400, detail="トークンが無効または期限切れです")
 
-    user = crud.get_user_by_email(db, email=email)
+    user = await async_crud.get_user_by_email(db, email=email)
     if not user:
         raise HTTPException(status_code=404, detail="ユーザーが見つかりません")
 
-    user.password = hash_password(req.new_password)
-    db.commit()
+    await async_crud.set_password(db, user.id, req.new_password)
     return {"message": "パスワードを変更しました"}
 
 @app.get("/me", response_model=schemas.User)
-def read_me(current_user: models.User = Depends(get_current_user)):
+async def read_me(current_user: models.User = Depends(get_current_user_async)):
     return current_user
+
+# メール送信キューの統計
+@app.get("/stats/mailer")
+def read_mailer_stats(current_admin: models.User = Depends(get_current_admin_user)):
+    return mailer.stats()
+
+# 認証ユーザーキャッシュの統計（ヒット率の確認用）
+@app.get("/stats/user-cache")
+def read_user_cache_stats(current_admin: models.User = Depends(get_current_admin_user)):
+    return user_cache.stats()
+
+# 年度替わりの学年更新を手動で実行する（通常は 4 月 1 日にスケジューラが実行）
+# dry_run=true で実際に変わる人の数（元の学年ごと）だけを返す。同じ年度にもう更新した人は対象にしないので、
+# 途中で失敗したときはそのまま再実行してよい（返ってきた last_id の次を start_id に指定すれば残りだけを見る）
+@app.post("/admin/promote-grades")
+def promote_grades(dry_run: bool = True, start_id: int = 0, chunk_size: Optional[int] = Query(None, ge=1, le=100000),
+                   year: Optional[int] = None,
+                   db: Session = Depends(get_db), current_admin: models.User = Depends(get_current_admin_user)):
+    try:
+        return crud.promote_all_users_grades(db, chunk_size=chunk_size, dry_run=dry_run, start_id=start_id, year=year)
+    finally:
+        if not dry_run:
+            user_cache.clear()
@@ -0,0 +1,218 @@
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+
+# リクエストごとの計測（ルート別のレイテンシと SQL の実行回数・時間）
+# ASGI ミドルウェアがリクエストごとに RequestStats を用意し、SQLAlchemy のカーソルイベントが
+# 同じコンテキストの RequestStats に SQL の回数と時間を足していく。結果は /metrics で
+# Prometheus のテキスト形式として返す。常時有効にしておけるよう、1 リクエストあたりの処理は
+# 二分探索と加算だけにしている。
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Server-Timing ヘッダ（MetricsMiddleware が付ける db;...;desc="N queries"）の SQL 実行回数
+QUERY_COUNT = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+def query_count_from_header(value: str) -> Optional[int]:
+    match = QUERY_COUNT.search(value or "")
+    return int(match.group(1)) if match else None
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_time")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def current_stats() -> Optional[RequestStats]:
+    return _current.get()
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latency = {}
+        self.queries = {}
+        self.db_time = {}
+        self.requests = {}
+        self.sql_statements = 0
+        self.sql_seconds = 0.0
+
+    def observe_request(self, method: str, route: str, status: int, elapsed: float, stats: RequestStats):
+        key = (method, route)
+        with self._lock:
+            latency = self.latency.get(key)
+            if latency is None:
+                latency = self.latency[key] = Histogram(LATENCY_BUCKETS)
+                self.queries[key] = Histogram(QUERY_COUNT_BUCKETS)
+                self.db_time[key] = 0.0
+            latency.observe(elapsed)
+            self.queries[key].observe(stats.queries)
+            self.db_time[key] += stats.db_time
+            status_key = (method, route, status)
+            self.requests[status_key] = self.requests.get(status_key, 0) + 1
+
+    def observe_sql(self, elapsed: float):
+        with self._lock:
+            self.sql_statements += 1
+            self.sql_seconds += elapsed
+
+
+registry = Registry()
+
+
+# SQLAlchemy のイベント
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    registry.observe_sql(elapsed)
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_time += elapsed
+
+
+def _handle_error(context):
+    # SQL が失敗すると after_cursor_execute は呼ばれないので、開始時刻をここで捨てる
+    # （残すと接続ごとのリストが伸び続け、次の SQL の時間を取り違える）
+    # 同じ接続の SQL は重ならないので、残っているのは失敗した SQL の開始時刻
+    conn = context.connection
+    if conn is None:
+        return
+    starts = conn.info.get("query_start")
+    if starts:
+        starts.pop()
+
+
+def instrument_engine(engine):
+    # 非同期エンジンの場合は engine.sync_engine を渡す
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+class MetricsMiddleware:
+    def __init__(self, app, server_timing: bool = False):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_metrics(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if self.server_timing:
+                    elapsed = (time.perf_counter() - start) * 1000
+                    value = (
+                        f'app;dur={elapsed:.1f}, '
+                        f'db;dur={stats.db_time * 1000:.1f};desc="{stats.queries} queries"'
+                    )
+                    message["headers"] = list(message.get("headers", [])) + [(b"server-timing", value.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            # ルートのパステンプレート（/items/{item_id} など）で集計し、未一致はまとめる
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            registry.observe_request(scope["method"], path, status, time.perf_counter() - start, stats)
+            _current.reset(token)
+
+
+def add_gauges(gauges: dict, prefix: str, values: dict, **labels):
+    # stats() が返す辞書のうち数値の項目だけをゲージにする
+    for key, value in values.items():
+        if isinstance(value, (int, float)):
+            gauges.setdefault(f"{prefix}_{key}", []).append((labels, float(value)))
+    return gauges
+
+
+# Prometheus のテキスト形式
+def _labels(**labels) -> str:
+    parts = []
+    for key, value in labels.items():
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{key}="{escaped}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _histogram_lines(name: str, histogram: Histogram, **labels):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}")
+    lines.append(f'{name}_bucket{_labels(**labels, le="+Inf")} {histogram.count}')
+    lines.append(f"{name}_sum{_labels(**labels)} {histogram.sum}")
+    lines.append(f"{name}_count{_labels(**labels)} {histogram.count}")
+    return lines
+
+
+def render(gauges: dict = None) -> str:
+    lines = []
+    with registry._lock:
+        lines.append("# TYPE http_request_duration_seconds histogram")
+        for (method, route), histogram in sorted(registry.latency.items()):
+            lines += _histogram_lines("http_request_duration_seconds", histogram, method=method, route=route)
+
+        lines.append("# TYPE http_request_sql_statements histogram")
+        for (method, route), histogram in sorted(registry.queries.items()):
+            lines += _histogram_lines("http_request_sql_statements", histogram, method=method, route=route)
+
+        lines.append("# TYPE http_request_db_seconds_total counter")
+        for (method, route), value in sorted(registry.db_time.items()):
+            lines.append(f"http_request_db_seconds_total{_labels(method=method, route=route)} {value}")
+
+        lines.append("# TYPE http_requests_total counter")
+        for (method, route, status), value in sorted(registry.requests.items()):
+            lines.append(f"http_requests_total{_labels(method=method, route=route, status=status)} {value}")
+
+        lines.append("# TYPE sql_statements_total counter")
+        lines.append(f"sql_statements_total {registry.sql_statements}")
+        lines.append("# TYPE sql_seconds_total counter")
+        lines.append(f"sql_seconds_total {registry.sql_seconds}")
+
+    # 他のコンポーネントの状態（プール・キャッシュ・バッファなど）
+    for name, samples in (gauges or {}).items():
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in samples:
+            lines.append(f"{name}{_labels(**labels) if labels else ''} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,193 @@
+import sys
+import time
+
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, func, insert, inspect, select
+from sqlalchemy.orm import Session
+
+from . import archive, loans, models, overdue, search, stats
+
+# スキーマのマイグレーション
+# テーブルの作成・変更はアプリの起動時ではなく、デプロイごとに 1 回この処理で行う:
+#   python -m app.migrations upgrade   未適用のマイグレーションを順に適用する
+#   python -m app.migrations status    適用済みのバージョンと未適用の一覧を表示する
+#
+# 新しいデータベースではバージョン 1 が現在のモデルからすべてのテーブルを作るので、
+# 2 以降のマイグレーションは「既にあれば何もしない」ように書くこと。
+
+schema_migration = Table(
+    "schema_migration",
+    MetaData(),
+    Column("version", Integer, primary_key=True, autoincrement=False),
+    Column("description", String(255), nullable=False),
+    Column("applied_at", DateTime, server_default=func.now()),
+)
+
+MIGRATIONS = []
+
+
+def migration(version: int, description: str):
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        return fn
+    return register
+
+
+def create_index_if_missing(conn, index):
+    existing = {i["name"] for i in inspect(conn).get_indexes(index.table.name)}
+    if index.name not in existing:
+        index.create(bind=conn)
+
+
+def add_column_if_missing(conn, table, column):
+    existing = {c["name"] for c in inspect(conn).get_columns(table.name)}
+    if column.name in existing:
+        return
+    column_type = column.type.compile(dialect=conn.dialect)
+    nullable = "" if column.nullable else " NOT NULL"
+    conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{nullable}")
+
+
+@migration(1, "初期スキーマ")
+def _initial_schema(conn):
+    models.Base.metadata.create_all(bind=conn, checkfirst=True)
+
+
+@migration(2, "物品名の全文インデックス（ngram）")
+def _item_name_fulltext(conn):
+    search.ensure_fulltext_index(conn)
+
+
+@migration(3, "一覧・検索でよく使う条件のインデックス")
+def _hot_query_indexes(conn):
+    for table in (models.ItemTransaction.__table__, models.SearchLog.__table__):
+        for index in table.indexes:
+            create_index_if_missing(conn, index)
+
+
+@migration(4, "カテゴリ集計を物品テーブルから作成")
+def _category_stat(conn):
+    stats.rebuild(Session(bind=conn))
+
+
+@migration(5, "取引のアーカイブ用テーブル")
+def _item_transaction_archive(conn):
+    models.ItemTransactionArchive.__table__.create(bind=conn, checkfirst=True)
+
+
+@migration(6, "物品ごとの今の貸出を履歴から作成")
+def _item_current_loan(conn):
+    models.ItemCurrentLoan.__table__.create(bind=conn, checkfirst=True)
+    # loans.rebuild は取引の返却期限（バージョン 7 で追加）も写すので、先に列だけ作っておく
+    add_column_if_missing(conn, models.ItemTransaction.__table__, models.ItemTransaction.__table__.c.due_date)
+    loans.rebuild(Session(bind=conn))
+
+
+@migration(7, "取引の返却期限・カテゴリの貸出期間・延滞検出の処理位置")
+def _due_date(conn):
+    add_column_if_missing(conn, models.ItemTransaction.__table__, models.ItemTransaction.__table__.c.due_date)
+    add_column_if_missing(conn, models.ItemTransactionArchive.__table__, models.ItemTransactionArchive.__table__.c.due_date)
+    add_column_if_missing(conn, models.Category.__table__, models.Category.__table__.c.loan_period_days)
+    for index in models.ItemCurrentLoan.__table__.indexes:
+        create_index_if_missing(conn, index)
+    models.JobWatermark.__table__.create(bind=conn, checkfirst=True)
+    # 今の貸出だけ、借りた日時とカテゴリの貸出期間から返却期限を入れる（返却済みの履歴には入れない）
+    overdue.backfill_due_dates(Session(bind=conn))
+
+
+@migration(8, "延滞の通知の再送待ち")
+def _overdue_notification_retry(conn):
+    models.OverdueNotificationRetry.__table__.create(bind=conn, checkfirst=True)
+
+
+@migration(9, "カテゴリ集計を物品 id で分けた行に")
+def _category_stat_shard(conn):
+    # 主キーが変わるので、作り直してから物品テーブルから数え直す
+    table = models.CategoryStat.__table__
+    if "shard" in {c["name"] for c in inspect(conn).get_columns(table.name)}:
+        return
+    table.drop(bind=conn)
+    table.create(bind=conn)
+    stats.rebuild(Session(bind=conn))
+
+
+@migration(10, "利用者の学年を更新した年度")
+def _user_promoted_year(conn):
+    add_column_if_missing(conn, models.User.__table__, models.User.__table__.c.promoted_year)
+
+
+@migration(11, "取引の完了日時（アーカイブの基準）")
+def _transaction_closed_at(conn):
+    add_column_if_missing(conn, models.ItemTransaction.__table__, models.ItemTransaction.__table__.c.closed_at)
+    add_column_if_missing(conn, models.ItemTransactionArchive.__table__, models.ItemTransactionArchive.__table__.c.closed_at)
+    for index in models.ItemTransaction.__table__.indexes:
+        create_index_if_missing(conn, index)
+    archive.backfill_closed_at(Session(bind=conn))
+
+
+def current_version(conn) -> int:
+    if not inspect(conn).has_table(schema_migration.name):
+        return 0
+    return conn.execute(select(func.max(schema_migration.c.version))).scalar() or 0
+
+
+def pending_migrations(engine):
+    with engine.connect() as conn:
+        version = current_version(conn)
+    return [(v, description) for v, description, _ in sorted(MIGRATIONS) if v > version]
+
+
+def upgrade(engine):
+    with engine.begin() as conn:
+        schema_migration.create(bind=conn, checkfirst=True)
+        version = current_version(conn)
+
+    for v, description, fn in sorted(MIGRATIONS):
+        if v <= version:
+            continue
+        start = time.perf_counter()
+        # 1 件ずつトランザクションを分け、適用できた分だけバージョンを記録する
+        with engine.begin() as conn:
+            fn(conn)
+            conn.execute(insert(schema_migration).values(version=v, description=description))
+        print(f"適用しました: {v} {description} ({time.perf_counter() - start:.2f}s)")
+
+
+def _wait_for_database(engine, retries: int, interval: float):
+    for attempt in range(1, retries + 1):
+        try:
+            with engine.connect():
+                return
+        except Exception as e:
+            print(f"データベース接続を試行中... ({attempt}/{retries}) {e}")
+            time.sleep(interval)
+    raise SystemExit("データベースに接続できませんでした")
+
+
+def main(argv):
+    from .config import get_settings
+    from .database import get_engine
+
+    command = argv[1] if len(argv) > 1 else "upgrade"
+    if command not in ("upgrade", "status"):
+        print("使い方: python -m app.migrations [upgrade|status]")
+        return 2
+
+    settings = get_settings()
+    engine = get_engine()
+    _wait_for_database(engine, settings.db_connect_retries, settings.db_connect_interval)
+
+    if command == "status":
+        pending = pending_migrations(engine)
+        with engine.connect() as conn:
+            print(f"現在のバージョン: {current_version(conn)}")
+        for v, description in pending:
+            print(f"未適用: {v} {description}")
+        return 0
+
+    upgrade(engine)
+    print("スキーマは最新です")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Text, DateTime, Enum
+from sqlalchemy import BigInteger, Boolean, Column, ForeignKey, Integer, String, Text, DateTime, Enum, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 import enum
@@ -21,6 +21,7 @@ class User(Base):
     password = Column(String(255), nullable=False)
     is_admin = Column(Boolean, default=False)
     is_active = Column(Boolean, default=True)
+    promoted_year = Column(Integer, nullable=True)  # 最後に学年を更新した年度（crud.promote_all_users_grades。同じ年度に 2 回上げない）
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
 
@@ -33,6 +34,7 @@ class Category(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String(100), unique=True, nullable=False)
+    loan_period_days = Column(Integer)  # 貸出期間の既定値（NULL なら DEFAULT_LOAN_PERIOD_DAYS）
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
 
@@ -57,6 +59,28 @@ class Item(Base):
     category = relationship("Category", back_populates="items")
     transactions = relationship("ItemTransaction", back_populates="item")
 
+    # 名前検索用の全文インデックス（ngram パーサー）
+    __table_args__ = (
+        Index("ft_item_name", "name", mysql_prefix="FULLTEXT", mysql_with_parser="ngram"),
+    )
+
+class CategoryStat(Base):
+    # カテゴリごとの物品数の集計（stats.py が物品・取引の更新と同じトランザクションで増減させる）
+    # 貸出・返却の増減は物品 id で分けた行（shard）に書くので、カテゴリの値は shard の合計
+    __tablename__ = "category_stat"
+
+    category_id = Column(Integer, primary_key=True, autoincrement=False)  # 0 は未分類
+    shard = Column(Integer, primary_key=True, autoincrement=False, default=0)
+    total = Column(Integer, nullable=False, default=0)
+    available = Column(Integer, nullable=False, default=0)
+
+class TableVersion(Base):
+    # テーブルごとの更新カウンタ（versioning.py。一覧 API の ETag に使う）
+    __tablename__ = "table_version"
+
+    name = Column(String(64), primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+
 class ItemTransaction(Base):
     __tablename__ = "item_transaction"
 
@@ -66,11 +90,13 @@ class ItemTransaction(Base):
     type = Column(Enum("borrow", "return"), nullable=False)
     related_transaction_id = Column(Integer, ForeignKey("item_transaction.id", ondelete="SET NULL"))
     transaction_date = Column(DateTime, server_default=func.now())
+    due_date = Column(DateTime)  # 返却期限（貸出のとき）
     reason = Column(String(255))
     item_condition = Column(String(255))
     notes = Column(Text)
     status = Column(String(20), default="request")
     created_at = Column(DateTime, server_default=func.now())
+    closed_at = Column(DateTime)  # 返却・却下・取り消しの日時（archive.py はこの日時から古さを決める）
 
     # リレーションシップ
     item = relationship("Item", back_populates="transactions")
@@ -78,6 +104,77 @@ class ItemTransaction(Base):
     related_transaction = relationship("ItemTransaction", remote_side=[id], uselist=False)
     child_transactions = relationship("ItemTransaction", remote_side=[related_transaction_id])
 
+    # 履歴・申請一覧の絞り込み用
+    __table_args__ = (
+        Index("ix_item_transaction_user_status", "user_id", "status"),
+        Index("ix_item_transaction_item_status", "item_id", "status"),
+        Index("ix_item_transaction_status_date", "status", "transaction_date"),
+        # アーカイブの候補を探す用
+        Index("ix_item_transaction_status_closed", "status", "closed_at"),
+    )
+
+class ItemCurrentLoan(Base):
+    # 物品ごとの今の貸出（申請中・貸出中の取引）。loans.py が貸出・承認・取り消し・返却と同じトランザクションで書き換える
+    # due_date は承認したときに決まる（申請中は NULL）
+    __tablename__ = "item_current_loan"
+
+    item_id = Column(Integer, ForeignKey("item.id", ondelete="CASCADE"), primary_key=True, autoincrement=False)
+    transaction_id = Column(Integer, ForeignKey("item_transaction.id", ondelete="CASCADE"), nullable=False, unique=True)
+    user_id = Column(Integer, ForeignKey("user.id", ondelete="CASCADE"), nullable=False)
+    status = Column(String(20), nullable=False)
+    borrowed_at = Column(DateTime)
+    due_date = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_item_current_loan_user", "user_id"),
+        # 延滞の一覧・検出用（返却期限の範囲で引く）
+        Index("ix_item_current_loan_due_date", "due_date"),
+    )
+
+class JobWatermark(Base):
+    # 定期ジョブがどこまで処理したか（overdue.py が返却期限の時刻を記録する）と、ジョブのリースの期限（lease.py）
+    __tablename__ = "job_watermark"
+
+    name = Column(String(64), primary_key=True)
+    value = Column(DateTime, nullable=False)
+
+class OverdueNotificationRetry(Base):
+    # 延滞の通知をキューに積めなかった貸出（overdue.py が次の実行で送り直す）
+    __tablename__ = "overdue_notification_retry"
+
+    transaction_id = Column(Integer, ForeignKey("item_transaction.id", ondelete="CASCADE"), primary_key=True, autoincrement=False)
+    created_at = Column(DateTime, server_default=func.now())
+
+class ItemTransactionArchive(Base):
+    # 完了から時間のたった取引の移し先（archive.py がまとめて移す）
+    # id は元の取引の id をそのまま使う。物品・利用者が消えても履歴は残すので外部キーは付けない
+    __tablename__ = "item_transaction_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    item_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False)
+    type = Column(Enum("borrow", "return"), nullable=False)
+    related_transaction_id = Column(Integer)
+    transaction_date = Column(DateTime)
+    due_date = Column(DateTime)
+    reason = Column(String(255))
+    item_condition = Column(String(255))
+    notes = Column(Text)
+    status = Column(String(20))
+    created_at = Column(DateTime)
+    closed_at = Column(DateTime)
+    archived_at = Column(DateTime, server_default=func.now())
+
+    # リレーションシップ（読み取り専用。schemas.ItemTransactionWithDetails で返せるようにする）
+    item = relationship("Item", primaryjoin="foreign(ItemTransactionArchive.item_id) == Item.id", viewonly=True)
+    user = relationship("User", primaryjoin="foreign(ItemTransactionArchive.user_id) == User.id", viewonly=True)
+
+    __table_args__ = (
+        Index("ix_item_transaction_archive_user_date", "user_id", "transaction_date"),
+        Index("ix_item_transaction_archive_item_date", "item_id", "transaction_date"),
+        Index("ix_item_transaction_archive_date", "transaction_date"),
+    )
+
 class SearchLog(Base):
     __tablename__ = "search_log"
     
@@ -87,4 +184,8 @@ class SearchLog(Base):
     searched_at = Column(DateTime, server_default=func.now())
     
     # リレーションシップ
-    user = relationship("User", back_populates="search_logs")
\ No newline at end of file
+    user = relationship("User", back_populates="search_logs")
+
+    __table_args__ = (
+        Index("ix_search_log_searched_at", "searched_at"),
+    )
\ No newline at end of file
@@ -0,0 +1,213 @@
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import and_, delete, func, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from . import loans, models
+from .config import get_settings
+
+# 延滞の検出と通知
+# 今の貸出の返却期限は item_current_loan.due_date（インデックスつき）にある。返却期限は承認したときに決まり、
+# 延滞として扱うのは承認済み（status="approved"）の貸出だけ（申請中のものは返却期限が NULL）。
+# ジョブは前回どの時刻まで見たか（job_watermark）を覚えておき、「前回の時刻 < 返却期限 <= 今」の範囲だけを
+# インデックスで読んで、新しく延滞になった貸出を見つける（取引の履歴は読まない）。
+#   - 同じ利用者の延滞は 1 通のメールにまとめ、mailer のキューに積む（SMTP への送信は mailer がまとめて行う）
+#   - 時刻の更新は「前回の値のときだけ書き換える」条件付き UPDATE なので、複数のワーカーで動いても通知は 1 回
+#   - キューがあふれて積めなかった通知は overdue_notification_retry に記録し、次の実行で送り直す
+# 使い方: python -m app.overdue [status|run]
+
+WATERMARK = "overdue"
+
+loan = models.ItemCurrentLoan.__table__
+watermark = models.JobWatermark.__table__
+retry = models.OverdueNotificationRetry.__table__
+
+
+def _claim(db, now: datetime):
+    # (この範囲を処理してよいか, 前回の時刻)。初回は前回の時刻が None（既に延滞しているものもすべて通知する）
+    previous = db.execute(select(watermark.c.value).where(watermark.c.name == WATERMARK)).scalar()
+    if previous is None:
+        try:
+            db.execute(insert(watermark).values(name=WATERMARK, value=now))
+        except IntegrityError:
+            db.rollback()
+            return False, None
+        return True, None
+    if previous >= now:
+        return False, previous
+    result = db.execute(
+        update(watermark)
+        .where(watermark.c.name == WATERMARK, watermark.c.value == previous)
+        .values(value=now)
+    )
+    return result.rowcount == 1, previous
+
+
+def _notification_statement():
+    return (
+        select(*loans.CURRENT_LOAN_COLUMNS, models.User.email.label("user_email"))
+        .select_from(loan)
+        .join(models.Item, models.Item.id == loan.c.item_id)
+        .join(models.User, models.User.id == loan.c.user_id)
+        .where(loan.c.status == "approved")
+    )
+
+
+def newly_overdue_statement(after: Optional[datetime], until: datetime, limit: int, cursor=None):
+    stmt = _notification_statement().where(loan.c.due_date <= until)
+    if after is not None:
+        stmt = stmt.where(loan.c.due_date > after)
+    if cursor is not None:
+        due_date, item_id = cursor
+        stmt = stmt.where(or_(loan.c.due_date > due_date, and_(loan.c.due_date == due_date, loan.c.item_id > item_id)))
+    return stmt.order_by(loan.c.due_date, loan.c.item_id).limit(limit)
+
+
+def _take_retries(db, until: datetime) -> list:
+    # 前回までに積めなかった通知。記録は消してから送り直す（消せたものだけ送るので、同時に動いても 1 回）
+    # 返却済み・返却期限を延ばしたなどで、もう延滞していない貸出の記録は送らずに消す
+    ids = db.execute(select(retry.c.transaction_id)).scalars().all()
+    if not ids:
+        return []
+    rows = db.execute(_notification_statement().where(loan.c.transaction_id.in_(ids), loan.c.due_date <= until)).all()
+    taken = []
+    for row in rows:
+        if db.execute(delete(retry).where(retry.c.transaction_id == row.transaction_id)).rowcount == 1:
+            taken.append(row)
+    db.execute(delete(retry).where(retry.c.transaction_id.in_(ids)))
+    return taken
+
+
+def notify_by_email(rows) -> bool:
+    from .utils import send_overdue_email
+
+    return send_overdue_email(rows[0].user_email, rows[0].user_name, rows)
+
+
+def run(db, now: Optional[datetime] = None, batch_size: Optional[int] = None, notify=notify_by_email, log=print) -> dict:
+    # notify(同じ利用者の行のリスト) -> bool（キューに積めたか）
+    batch_size = batch_size or get_settings().overdue_batch_size
+    # DATETIME の精度にそろえる（秒未満が丸められると範囲の境目がずれる）
+    now = (now or datetime.now()).replace(microsecond=0)
+    start = time.perf_counter()
+
+    claimed, previous = _claim(db, now)
+    if not claimed:
+        db.rollback()
+        return {"claimed": False, "since": previous.isoformat() if previous else None, "until": now.isoformat()}
+
+    by_user = defaultdict(list)
+    found = 0
+    cursor = None
+    while True:
+        rows = db.execute(newly_overdue_statement(previous, now, batch_size, cursor)).all()
+        for row in rows:
+            by_user[row.user_id].append(row)
+        found += len(rows)
+        if len(rows) < batch_size:
+            break
+        cursor = (rows[-1].due_date, rows[-1].item_id)
+    retried = _take_retries(db, now)
+    for row in retried:
+        by_user[row.user_id].append(row)
+    # 時刻を確定してから通知を積む（通知のあとで失敗して、次の実行で二重に送ることがないように）
+    db.commit()
+
+    queued = dropped = 0
+    failed = []
+    for rows in by_user.values():
+        if notify(rows):
+            queued += 1
+        else:
+            dropped += 1
+            failed += [row.transaction_id for row in rows]
+    if failed:
+        db.execute(insert(retry), [{"transaction_id": transaction_id} for transaction_id in failed])
+        db.commit()
+        log(f"延滞の通知 {dropped} 件をキューに積めませんでした（次の実行で送り直します）")
+    return {
+        "claimed": True,
+        "since": previous.isoformat() if previous else None,
+        "until": now.isoformat(),
+        "overdue": found,
+        "retried": len(retried),
+        "users": len(by_user),
+        "queued": queued,
+        "dropped": dropped,
+        "elapsed_ms": round((time.perf_counter() - start) * 1000, 2),
+    }
+
+
+def overdue_statement(now: datetime, skip: int = 0, limit: int = 100):
+    # 今延滞している貸出（返却期限の古い順）
+    return (
+        select(*loans.CURRENT_LOAN_COLUMNS)
+        .select_from(loan)
+        .join(models.Item, models.Item.id == loan.c.item_id)
+        .join(models.User, models.User.id == loan.c.user_id)
+        .where(loan.c.status == "approved", loan.c.due_date < now)
+        .order_by(loan.c.due_date, loan.c.item_id)
+        .offset(skip)
+        .limit(limit)
+    )
+
+
+def backfill_due_dates(db, default_days: Optional[int] = None):
+    # 返却期限のない承認済みの貸出に、借りた日時 + 物品のカテゴリの貸出期間を入れる（取引の方にも同じ値を入れる）
+    default_days = default_days or get_settings().default_loan_period_days
+    rows = db.execute(
+        select(loan.c.item_id, loan.c.transaction_id, loan.c.borrowed_at, models.Category.loan_period_days)
+        .select_from(loan)
+        .join(models.Item, models.Item.id == loan.c.item_id)
+        .outerjoin(models.Category, models.Category.id == models.Item.category_id)
+        .where(loan.c.status == "approved", loan.c.due_date.is_(None), loan.c.borrowed_at.is_not(None))
+    ).all()
+    tx = models.ItemTransaction.__table__
+    for row in rows:
+        due_date = row.borrowed_at + timedelta(days=row.loan_period_days or default_days)
+        db.execute(update(loan).where(loan.c.item_id == row.item_id).values(due_date=due_date))
+        db.execute(update(tx).where(tx.c.id == row.transaction_id).values(due_date=due_date))
+    db.commit()
+    return len(rows)
+
+
+def status(db) -> dict:
+    return {
+        "watermark": db.execute(select(watermark.c.value).where(watermark.c.name == WATERMARK)).scalar(),
+        "overdue": db.execute(
+            select(func.count()).select_from(loan).where(loan.c.status == "approved", loan.c.due_date < datetime.now())
+        ).scalar(),
+        "retry": db.execute(select(func.count()).select_from(retry)).scalar(),
+    }
+
+
+def main(argv):
+    from .database import SessionLocal
+    from .mailer import mailer
+
+    command = argv[1] if len(argv) > 1 else "status"
+    if command not in ("status", "run"):
+        print("使い方: python -m app.overdue [status|run]")
+        return 2
+
+    db = SessionLocal()
+    try:
+        if command == "status":
+            print(status(db))
+            return 0
+        mailer.start()
+        try:
+            print(run(db))
+        finally:
+            mailer.stop()
+        return 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
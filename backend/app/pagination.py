@@ -0,0 +1,88 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, Optional, Tuple
+
+from sqlalchemy import and_, or_
+
+# カーソル（キーセット）ページング
+# カーソルは「並び替えキーの値 + id」を不透明な文字列にしたもの。
+# OFFSET と違い、読み飛ばす行がないのでどのページでも同じ速さで取得できる。
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def _dump_value(value: Any):
+    if isinstance(value, datetime):
+        return {"dt": value.isoformat()}
+    return value
+
+
+def _load_value(value: Any):
+    if isinstance(value, dict) and "dt" in value:
+        return datetime.fromisoformat(value["dt"])
+    return value
+
+
+def encode_cursor(sort_key: str, sort_order: str, value: Any, last_id: int) -> str:
+    payload = {"k": sort_key, "o": sort_order, "v": _dump_value(value), "id": last_id}
+    raw = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, sort_key: str, sort_order: str) -> Tuple[Any, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        value = _load_value(payload["v"])
+        last_id = int(payload["id"])
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise InvalidCursor("カーソルの形式が不正です")
+
+    # 並び順が変わるとカーソルの位置が意味を持たなくなる
+    if payload.get("k") != sort_key or payload.get("o") != sort_order:
+        raise InvalidCursor("カーソルと並び替え条件が一致しません")
+    return value, last_id
+
+
+def keyset_filter(column, id_column, value: Any, last_id: int, descending: bool):
+    # MySQL は昇順で NULL を先頭、降順で末尾に並べるので、それに合わせて条件を組み立てる
+    if column is id_column:
+        return id_column < last_id if descending else id_column > last_id
+
+    if descending:
+        if value is None:
+            return and_(column.is_(None), id_column < last_id)
+        return or_(
+            column < value,
+            and_(column == value, id_column < last_id),
+            column.is_(None),
+        )
+
+    if value is None:
+        return or_(and_(column.is_(None), id_column > last_id), column.isnot(None))
+    return or_(column > value, and_(column == value, id_column > last_id))
+
+
+def apply_keyset(query, column, id_column, cursor: Optional[str], sort_key: str, sort_order: str):
+    descending = sort_order == "desc"
+    if cursor:
+        value, last_id = decode_cursor(cursor, sort_key, sort_order)
+        query = query.filter(keyset_filter(column, id_column, value, last_id, descending))
+
+    if column is id_column:
+        return query.order_by(id_column.desc() if descending else id_column.asc())
+    if descending:
+        return query.order_by(column.desc(), id_column.desc())
+    return query.order_by(column.asc(), id_column.asc())
+
+
+def next_cursor(rows, sort_key: str, sort_order: str, limit: int) -> Optional[str]:
+    # 取得件数が limit に満たなければ最終ページ
+    if not rows or len(rows) < limit:
+        return None
+    last = rows[-1]
+    return encode_cursor(sort_key, sort_order, getattr(last, sort_key), last.id)
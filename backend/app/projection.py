@@ -0,0 +1,108 @@
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+from pydantic import ConfigDict, create_model
+from sqlalchemy import select
+
+from . import models, schemas
+
+# 一覧の部分取得（?fields=id,name&expand=category）
+# 指定されたカラムだけを SELECT し、同じ項目だけを持つレスポンスモデルで返す。
+# 関連（category など）は expand で指定したときだけ JOIN して、決まった少数の項目を入れ子で返す。
+
+
+class InvalidFields(ValueError):
+    pass
+
+
+class Expansion(NamedTuple):
+    model: type
+    schema: type
+    fields: tuple
+    onclause: object  # 読み出し元のモデル（取引ならアーカイブのこともある）を受け取って JOIN 条件を返す
+
+
+ITEM_EXPANSIONS = {
+    "category": Expansion(models.Category, schemas.Category, ("id", "name"), lambda source: source.category_id == models.Category.id),
+}
+
+TRANSACTION_EXPANSIONS = {
+    "item": Expansion(models.Item, schemas.Item, ("id", "name", "is_available", "location"), lambda source: source.item_id == models.Item.id),
+    "user": Expansion(models.User, schemas.User, ("id", "name", "grade"), lambda source: source.user_id == models.User.id),
+}
+
+
+def split(value: Optional[str]) -> tuple:
+    # "a, b,,a" -> ("a", "b")（順番は指定どおり、重複は除く）
+    if not value:
+        return ()
+    return tuple(dict.fromkeys(part.strip() for part in value.split(",") if part.strip()))
+
+
+@lru_cache(maxsize=256)
+def trimmed_model(schema: type, fields: tuple, nested: tuple = ()) -> type:
+    # schema から fields の項目だけを持つモデルを作る（同じ組み合わせは使い回す）
+    definitions = {name: (schema.model_fields[name].annotation, schema.model_fields[name]) for name in fields}
+    for name, model in nested:
+        definitions[name] = (Optional[model], None)
+    return create_model(
+        f"{schema.__name__}Fields",
+        __config__=ConfigDict(from_attributes=True),
+        **definitions,
+    )
+
+
+class Projection:
+    def __init__(self, model, schema, fields: tuple, expand: tuple, expansions: dict, required: tuple = ("id",)):
+        columns = {column.key for column in model.__table__.columns}
+        allowed = [name for name in schema.model_fields if name in columns]
+        unknown = [name for name in fields if name not in allowed]
+        if unknown:
+            raise InvalidFields(f"指定できない項目です: {', '.join(unknown)}（指定できる項目: {', '.join(allowed)}）")
+        unknown = [name for name in expand if name not in expansions]
+        if unknown:
+            raise InvalidFields(f"展開できない項目です: {', '.join(unknown)}（指定できる項目: {', '.join(expansions)}）")
+
+        self.model = model
+        # fields を省略して expand だけ指定したときは全項目
+        self.fields = tuple(dict.fromkeys(required + (fields or tuple(allowed))))
+        self.expansions = [(name, expansions[name]) for name in expand]
+        self.response_model = trimmed_model(
+            schema,
+            self.fields,
+            tuple((name, trimmed_model(exp.schema, exp.fields)) for name, exp in self.expansions),
+        )
+
+    def select(self, source=None):
+        # source: 同じカラムを持つ別のテーブルから読むとき（アーカイブした取引など）
+        source = source or self.model
+        columns = [getattr(source, name) for name in self.fields]
+        for name, exp in self.expansions:
+            columns += [getattr(exp.model, field).label(f"{name}__{field}") for field in exp.fields]
+        stmt = select(*columns).select_from(source)
+        for name, exp in self.expansions:
+            stmt = stmt.outerjoin(exp.model, exp.onclause(source))
+        return stmt
+
+    def serialize(self, rows) -> list:
+        result = []
+        for row in rows:
+            values = row._mapping
+            data = {name: values[name] for name in self.fields}
+            for name, exp in self.expansions:
+                nested = {field: values[f"{name}__{field}"] for field in exp.fields}
+                data[name] = nested if nested["id"] is not None else None
+            result.append(self.response_model(**data).model_dump(mode="json"))
+        return result
+
+
+def item_projection(fields: Optional[str], expand: Optional[str], required: tuple = ("id",)) -> Optional[Projection]:
+    if fields is None and expand is None:
+        return None
+    return Projection(models.Item, schemas.Item, split(fields), split(expand), ITEM_EXPANSIONS, required)
+
+
+def transaction_projection(fields: Optional[str], expand: Optional[str]) -> Optional[Projection]:
+    if fields is None and expand is None:
+        return None
+    return Projection(models.ItemTransaction, schemas.ItemTransaction, split(fields), split(expand), TRANSACTION_EXPANSIONS)
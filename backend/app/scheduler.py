@@ -1,22 +1,72 @@
 from apscheduler.schedulers.background import BackgroundScheduler
 from datetime import datetime
-from . import crud, database 
+from . import archive, crud, database, lease, overdue
+from .cache import user_cache
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from .config import get_settings
 from pytz import timezone
 
 scheduler = BackgroundScheduler()
 
+# リースの期限（秒）。ジョブが終われば期限を待たずに手放す
+ARCHIVE_LEASE_SECONDS = 3600
+
 def annual_user_update_job():
     db = database.SessionLocal()
     try:
-        crud.promote_all_users_grades(db)  # 学年昇格
-        crud.deactivate_old_users(db)      # OB_OGを無効化
+        # 学年昇格と OB_OG の無効化（年度は crud.school_year が日本時間で決める）
+        print(f"学年更新: {crud.promote_all_users_grades(db)}")
     finally:
         db.close()
+        # 学年・有効フラグが一斉に変わるので、キャッシュを全て捨てる
+        user_cache.clear()
         
+def archive_transactions_job():
+    db = database.SessionLocal()
+    try:
+        # どのワーカーでも同じ時刻に動くので、リースを取れた 1 つだけが移す
+        expires = lease.acquire(db, "archive", ARCHIVE_LEASE_SECONDS)
+        if expires is None:
+            return
+        try:
+            # 1 回の上限（ARCHIVE_MAX_BATCHES）で打ち切った分は翌日に続きから移す
+            print(f"取引のアーカイブ: {archive.run(db, log=lambda message: None)}")
+        finally:
+            lease.release(db, "archive", expires)
+    finally:
+        db.close()
+
+def overdue_job():
+    db = database.SessionLocal()
+    try:
+        # 通知は watermark の条件付き UPDATE で 1 回になるが、同じ範囲を読む処理も 1 つのワーカーだけにする
+        expires = lease.acquire(db, "overdue", get_settings().overdue_check_minutes * 60)
+        if expires is None:
+            return
+        try:
+            # 前回の実行から今までに返却期限を過ぎた貸出だけを通知する（止まっていた間の分も次の実行で拾う）
+            result = overdue.run(db)
+            if result.get("overdue"):
+                print(f"延滞の検出: {result}")
+        finally:
+            lease.release(db, "overdue", expires)
+    finally:
+        db.close()
+
 def start_scheduler():
     scheduler.add_job(
         annual_user_update_job,
         CronTrigger(month=4, day=1, hour=0, minute=0, timezone=timezone('Asia/Tokyo'))  # 毎年4月1日 0時
     )
+    scheduler.add_job(
+        archive_transactions_job,
+        CronTrigger(hour=3, minute=30, timezone=timezone('Asia/Tokyo'))  # 毎日3時30分
+    )
+    scheduler.add_job(
+        overdue_job,
+        IntervalTrigger(minutes=get_settings().overdue_check_minutes),
+        max_instances=1,
+        coalesce=True,
+    )
     scheduler.start()
@@ -1,8 +1,10 @@
 from datetime import datetime
 from typing import List, Optional
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field, computed_field
 from enum import Enum
 
+from . import images
+
 # User関連のスキーマ
 class GradeEnum(str, Enum):
     U4 = "U4"
@@ -52,12 +54,14 @@ class ResetPasswordRequest(BaseModel):
 # Category関連のスキーマ
 class CategoryBase(BaseModel):
     name: str
+    loan_period_days: Optional[int] = Field(None, ge=1)  # 貸出期間の既定値（日）
 
 class CategoryCreate(CategoryBase):
     pass
 
 class CategoryUpdate(BaseModel):
     name: Optional[str] = None
+    loan_period_days: Optional[int] = Field(None, ge=1)
 
 class Category(CategoryBase):
     id: int
@@ -67,6 +71,14 @@ class Category(CategoryBase):
     class Config:
         from_attributes = True
 
+# カテゴリごとの物品数
+class CategoryStats(BaseModel):
+    category_id: Optional[int] = None  # None は未分類
+    name: Optional[str] = None
+    total: int
+    available: int
+    on_loan: int
+
 # Item関連のスキーマ
 class ItemBase(BaseModel):
     name: str
@@ -94,6 +106,18 @@ class Item(ItemBase):
     updated_at: datetime
     category: Optional[Category]
 
+    # 一覧では縮小版を表示する（image_path がアップロードした画像でなければ null）
+    @computed_field
+    @property
+    def thumbnail_url(self) -> Optional[str]:
+        return images.url(self.image_path, "thumb")
+
+    # 詳細・拡大表示用
+    @computed_field
+    @property
+    def image_url(self) -> Optional[str]:
+        return images.url(self.image_path, "large")
+
     class Config:
         from_attributes = True
 
@@ -107,6 +131,7 @@ class ItemTransactionBase(BaseModel):
     item_condition: Optional[str] = None
     notes: Optional[str] = None
     status: Optional[str] = None
+    due_date: Optional[datetime] = None  # 貸出で省略したときは、承認したときにカテゴリの貸出期間から決める
 
 class ItemTransactionCreate(ItemTransactionBase):
     pass
@@ -128,6 +153,37 @@ class ItemTransactionWithDetails(ItemTransaction):
     item: Optional[Item]
     user: Optional[User]
 
+# 物品ごとの今の貸出
+class CurrentLoan(BaseModel):
+    item_id: int
+    item_name: Optional[str] = None
+    transaction_id: int
+    user_id: int
+    user_name: Optional[str] = None
+    status: str  # request / approved
+    borrowed_at: Optional[datetime] = None
+    due_date: Optional[datetime] = None
+
+# 申請の一括承認・却下
+class DecisionEnum(str, Enum):
+    approved = "approved"
+    rejected = "rejected"
+
+# 1 回にまとめて更新できる件数（IN 句と行ロックが大きくなりすぎないように）
+TRANSACTION_BATCH_MAX = 500
+
+class TransactionBatchUpdate(BaseModel):
+    ids: List[int] = Field(..., min_length=1, max_length=TRANSACTION_BATCH_MAX)  # 重複は crud でまとめる
+    status: DecisionEnum
+
+class TransactionBatchOutcome(BaseModel):
+    id: int
+    outcome: str  # updated / not_found / not_pending
+
+class TransactionBatchResult(BaseModel):
+    updated: int
+    results: List[TransactionBatchOutcome]
+
 # SearchLog関連のスキーマ
 class SearchLogBase(BaseModel):
     user_id: Optional[int] = None
@@ -141,4 +197,17 @@ class SearchLog(SearchLogBase):
     searched_at: datetime
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+# POST /search-logs/ の応答（受け付けただけで、まだ書き込んでいない）
+class SearchLogAccepted(BaseModel):
+    message: str
+
+# 検索候補
+class SuggestedItem(BaseModel):
+    id: int
+    name: str
+
+class Suggestions(BaseModel):
+    keywords: List[str]
+    items: List[SuggestedItem]
@@ -0,0 +1,46 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.dialects.mysql import match
+
+from . import models
+
+# 物品名の部分一致検索
+# MySQL の FULLTEXT インデックス（ngram パーサー）で引く。日本語の名前も 2 文字単位で分割されるので
+# '%name%' の全件走査にならない。インデックスは InnoDB が INSERT/UPDATE/DELETE と同じトランザクションで
+# 更新するので、create_item / update_item / delete_item の変更はコミットと同時に検索へ反映される。
+
+FULLTEXT_INDEX_NAME = "ft_item_name"
+# MySQL の ngram_token_size（既定値 2）と合わせる。これより短い語はインデックスで引けない
+NGRAM_TOKEN_SIZE = 2
+
+
+def _phrase(term: str) -> str:
+    # BOOLEAN MODE の演算子として解釈されないよう、フレーズ検索として渡す
+    return '"' + term.replace('"', " ") + '"'
+
+
+def uses_fulltext(dialect: str, term: str) -> bool:
+    return dialect == "mysql" and len(term) >= NGRAM_TOKEN_SIZE
+
+
+def relevance(term: str):
+    return match(models.Item.name, against=term)
+
+
+def name_filter(dialect: str, term: str):
+    if uses_fulltext(dialect, term):
+        return match(models.Item.name, against=_phrase(term)).in_boolean_mode()
+    # インデックスが使えない短い語や MySQL 以外では従来どおり部分一致
+    return models.Item.name.ilike(f"%{term}%")
+
+
+def ensure_fulltext_index(conn):
+    # create_all は既存テーブルにインデックスを追加しないので、無ければ作成する（マイグレーションから呼ぶ）
+    if conn.dialect.name != "mysql":
+        return
+    indexes = inspect(conn).get_indexes(models.Item.__tablename__)
+    if any(index["name"] == FULLTEXT_INDEX_NAME for index in indexes):
+        return
+    conn.execute(text(
+        f"ALTER TABLE {models.Item.__tablename__} "
+        f"ADD FULLTEXT INDEX {FULLTEXT_INDEX_NAME} (name) WITH PARSER ngram"
+    ))
@@ -0,0 +1,158 @@
+import threading
+import time
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import insert
+
+from . import models, schemas
+from .config import get_settings
+from .database import SessionLocal
+
+# 検索ログの書き込みバッファ（write-behind）
+# POST /search-logs/ はメモリ上に積むだけで返し、件数か経過時間のしきい値で
+# まとめて 1 回の複数行 INSERT として書き込む。終了時は lifespan から残りを書き出す
+# （書き出しはブロックするので、lifespan からはスレッドプールで呼ぶ）。
+
+
+class SearchLogBuffer:
+    # 引数を省略すると設定値（SEARCH_LOG_*）を使う
+    def __init__(self, batch_size: Optional[int] = None, flush_interval: Optional[float] = None, max_pending: Optional[int] = None):
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._max_pending = max_pending
+        self._pending = []
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = None
+        self._flush_lock = threading.Lock()
+
+        self.accepted = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+        self.flushes = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    @property
+    def batch_size(self) -> int:
+        return self._batch_size or get_settings().search_log_batch_size
+
+    @property
+    def flush_interval(self) -> float:
+        return self._flush_interval or get_settings().search_log_flush_interval
+
+    @property
+    def max_pending(self) -> int:
+        return self._max_pending or get_settings().search_log_max_pending
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="search-log-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        # 書き込みスレッドを止めてから、残っている分をすべて書き出す
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        while self.flush():
+            pass
+        # 書き込みに失敗して残った分は、終了すると失われるので数えて知らせる
+        with self._cond:
+            lost = len(self._pending)
+            self._pending.clear()
+            self.dropped += lost
+        if lost:
+            print(f"検索ログ {lost} 件を書き込めずに破棄しました")
+
+    def add(self, search_log: schemas.SearchLogCreate) -> bool:
+        row = {
+            "user_id": search_log.user_id,
+            "search_keyword": search_log.search_keyword,
+            "searched_at": datetime.now(),
+        }
+        with self._cond:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._pending.append(row)
+            self.accepted += 1
+            if len(self._pending) >= self.batch_size:
+                self._cond.notify()
+        return True
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopping and len(self._pending) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                if self._stopping:
+                    return
+            while self.flush() >= self.batch_size:
+                pass
+
+    def flush(self) -> int:
+        # 1 バッチ分を取り出して書き込み、書き込んだ件数を返す
+        with self._flush_lock:
+            with self._cond:
+                rows = self._pending[:self.batch_size]
+                del self._pending[:self.batch_size]
+            if not rows:
+                return 0
+
+            start = time.perf_counter()
+            db = SessionLocal()
+            try:
+                db.execute(insert(models.SearchLog), rows)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                self.failed_flushes += 1
+                self._requeue(rows)
+                print(f"検索ログの書き込みエラー: {e}")
+                return 0
+            finally:
+                db.close()
+
+            elapsed = (time.perf_counter() - start) * 1000
+            self.flushes += 1
+            self.written += len(rows)
+            self.last_flush_ms = elapsed
+            self.max_flush_ms = max(self.max_flush_ms, elapsed)
+            self.total_flush_ms += elapsed
+            return len(rows)
+
+    def _requeue(self, rows):
+        # 書き込みに失敗した分は、空きがあれば先頭に戻して次回に再試行する
+        with self._cond:
+            room = max(0, self.max_pending - len(self._pending))
+            self._pending[:0] = rows[:room]
+            self.dropped += len(rows) - min(room, len(rows))
+
+    def depth(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth(),
+            "accepted": self.accepted,
+            "written": self.written,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+            "last_flush_ms": round(self.last_flush_ms, 3),
+            "max_flush_ms": round(self.max_flush_ms, 3),
+            "avg_flush_ms": round(self.total_flush_ms / self.flushes, 3) if self.flushes else 0.0,
+        }
+
+
+search_log_buffer = SearchLogBuffer()
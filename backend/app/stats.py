@@ -0,0 +1,200 @@
+import sys
+from typing import Optional
+
+from sqlalchemy import case, delete, func, insert, literal, select, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+
+from . import models
+from .config import get_settings
+
+# カテゴリごとの物品数（総数・貸出可能数・貸出中の数）
+# category_stat テーブルを、物品や取引を更新するのと同じトランザクションで増減させておくことで、
+# /stats/categories は item テーブルを GROUP BY せずカテゴリごとの少数の行を読むだけで返せる。
+# 貸出・返却の増減は「カテゴリ × 物品 id % COUNTER_SHARDS」の行に書く（同じカテゴリの別々の物品の貸出が
+# 1 行のロックを待ち合わないように）。物品の登録・削除などは shard 0 に書き、読むときに shard を合計する。
+# 集計がずれたときは `python -m app.stats verify` で確認し、`rebuild` で作り直す。
+
+UNCATEGORIZED = 0
+
+
+def _key(category_id: Optional[int]) -> int:
+    return category_id or UNCATEGORIZED
+
+
+def shard_of(item_id: int) -> int:
+    return item_id % get_settings().counter_shards
+
+
+def apply_delta(db, category_id: Optional[int], total: int = 0, available: int = 0, shard: int = 0):
+    if not total and not available:
+        return
+    key = _key(category_id)
+    table = models.CategoryStat.__table__
+
+    if db.get_bind().dialect.name == "mysql":
+        stmt = mysql_insert(table).values(category_id=key, shard=shard, total=total, available=available)
+        stmt = stmt.on_duplicate_key_update(
+            total=table.c.total + stmt.inserted.total,
+            available=table.c.available + stmt.inserted.available,
+        )
+        db.execute(stmt)
+        return
+
+    result = db.execute(
+        update(table)
+        .where(table.c.category_id == key, table.c.shard == shard)
+        .values(total=table.c.total + total, available=table.c.available + available)
+    )
+    if result.rowcount == 0:
+        db.execute(insert(table).values(category_id=key, shard=shard, total=total, available=available))
+
+
+def item_added(db, category_id: Optional[int], is_available: bool):
+    apply_delta(db, category_id, total=1, available=1 if is_available else 0)
+
+
+def item_removed(db, category_id: Optional[int], is_available: bool):
+    apply_delta(db, category_id, total=-1, available=-1 if is_available else 0)
+
+
+def item_changed(db, old_category_id, old_available: bool, new_category_id, new_available: bool):
+    if _key(old_category_id) == _key(new_category_id):
+        apply_delta(db, new_category_id, available=int(bool(new_available)) - int(bool(old_available)))
+        return
+    item_removed(db, old_category_id, old_available)
+    item_added(db, new_category_id, new_available)
+
+
+def item_availability_changed(db, item_id: int, is_available: bool):
+    # 物品を読み込まずに、物品のカテゴリ・物品 id の shard の行を 1 文で増減させる（貸出・返却の条件付き UPDATE の直後に使う）
+    table = models.CategoryStat.__table__
+    delta = 1 if is_available else -1
+    shard = shard_of(item_id)
+    row = select(
+        func.coalesce(models.Item.category_id, UNCATEGORIZED), literal(shard), literal(0), literal(delta)
+    ).where(models.Item.id == item_id)
+    columns = ["category_id", "shard", "total", "available"]
+
+    if db.get_bind().dialect.name == "mysql":
+        stmt = mysql_insert(table).from_select(columns, row)
+        db.execute(stmt.on_duplicate_key_update(available=table.c.available + delta))
+        return
+
+    category_key = row.with_only_columns(func.coalesce(models.Item.category_id, UNCATEGORIZED)).scalar_subquery()
+    result = db.execute(
+        update(table)
+        .where(table.c.category_id == category_key, table.c.shard == shard)
+        .values(available=table.c.available + delta)
+    )
+    if result.rowcount == 0:
+        db.execute(insert(table).from_select(columns, row))
+
+
+def category_deleted(db, category_id: int):
+    # 外部キーの ON DELETE SET NULL で物品は未分類になるので、集計も未分類へ移す
+    table = models.CategoryStat.__table__
+    row = db.execute(
+        select(func.sum(table.c.total).label("total"), func.sum(table.c.available).label("available"))
+        .where(table.c.category_id == category_id)
+    ).first()
+    if row is None or row.total is None:
+        return
+    db.execute(delete(table).where(table.c.category_id == category_id))
+    apply_delta(db, UNCATEGORIZED, total=row.total, available=row.available)
+
+
+def category_stats_statement():
+    table = models.CategoryStat.__table__
+    totals = (
+        select(
+            table.c.category_id,
+            func.sum(table.c.total).label("total"),
+            func.sum(table.c.available).label("available"),
+        )
+        .group_by(table.c.category_id)
+        .subquery()
+    )
+    return (
+        select(totals.c.category_id, models.Category.name, totals.c.total, totals.c.available)
+        .outerjoin(models.Category, totals.c.category_id == models.Category.id)
+        .order_by(totals.c.category_id)
+    )
+
+
+def to_response(rows):
+    return [
+        {
+            "category_id": row.category_id or None,
+            "name": row.name,
+            "total": row.total,
+            "available": row.available,
+            "on_loan": row.total - row.available,
+        }
+        for row in rows
+    ]
+
+
+def _actual_counts(db) -> dict:
+    key = func.coalesce(models.Item.category_id, UNCATEGORIZED)
+    rows = db.execute(
+        select(
+            key.label("category_id"),
+            func.count(models.Item.id),
+            func.sum(case((models.Item.is_available == True, 1), else_=0)),  # noqa: E712
+        ).group_by(key)
+    ).all()
+    return {row[0]: (row[1], int(row[2] or 0)) for row in rows}
+
+
+def verify(db) -> list:
+    # item テーブルから数え直した値と集計テーブルの差分を返す
+    actual = _actual_counts(db)
+    stored = {
+        row.category_id: (int(row.total), int(row.available))
+        for row in db.execute(category_stats_statement())
+    }
+    drift = []
+    for category_id in sorted(set(actual) | set(stored)):
+        expected = actual.get(category_id, (0, 0))
+        current = stored.get(category_id, (0, 0))
+        if expected != current:
+            drift.append({"category_id": category_id, "expected": expected, "stored": current})
+    return drift
+
+
+def rebuild(db):
+    actual = _actual_counts(db)
+    db.execute(delete(models.CategoryStat))
+    if actual:
+        db.execute(
+            insert(models.CategoryStat),
+            [{"category_id": key, "total": total, "available": available} for key, (total, available) in actual.items()],
+        )
+    db.commit()
+
+
+def main(argv):
+    from .database import SessionLocal
+
+    command = argv[1] if len(argv) > 1 else "verify"
+    if command not in ("verify", "rebuild"):
+        print("使い方: python -m app.stats [verify|rebuild]")
+        return 2
+
+    db = SessionLocal()
+    try:
+        if command == "rebuild":
+            rebuild(db)
+            print("カテゴリ集計を作り直しました")
+            return 0
+        drift = verify(db)
+        for row in drift:
+            print(f"category_id={row['category_id']} 実際={row['expected']} 集計={row['stored']}")
+        print("ずれはありません" if not drift else f"{len(drift)} 件のカテゴリで集計がずれています")
+        return 1 if drift else 0
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,66 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+from .database import SessionLocal
+
+# 大量の行を一定のメモリで書き出すためのストリーミング出力
+# サーバーサイドカーソル（yield_per）で少しずつ読み、カラムだけを射影した行を
+# CSV / JSON Lines に変換しながら返す。ORM オブジェクトは作らない。
+
+EXPORT_CHUNK_SIZE = 1000
+
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "jsonl": "application/x-ndjson",
+}
+
+
+def normalize_format(fmt: str) -> str:
+    fmt = (fmt or "").lower()
+    if fmt in ("jsonl", "ndjson"):
+        return "jsonl"
+    if fmt == "csv":
+        return "csv"
+    raise ValueError("format は csv / jsonl (ndjson) のいずれかを指定してください")
+
+
+def _jsonable(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def encode_csv(columns, rows, header: bool = False) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(columns)
+    for row in rows:
+        writer.writerow(["" if value is None else _jsonable(value) for value in row])
+    return buffer.getvalue()
+
+
+def encode_jsonl(columns, rows) -> str:
+    return "".join(
+        json.dumps({key: _jsonable(value) for key, value in zip(columns, row)}, ensure_ascii=False) + "\n"
+        for row in rows
+    )
+
+
+def stream_rows(stmt, fmt: str, chunk_size: int = EXPORT_CHUNK_SIZE):
+    # レスポンス送信中も使うので、依存性注入のセッションではなく専用のセッションを開く
+    db = SessionLocal()
+    try:
+        result = db.execute(stmt.execution_options(yield_per=chunk_size))
+        columns = list(result.keys())
+        if fmt == "csv":
+            yield encode_csv(columns, [], header=True)
+        for rows in result.partitions():
+            if fmt == "csv":
+                yield encode_csv(columns, rows)
+            else:
+                yield encode_jsonl(columns, rows)
+    finally:
+        db.close()
@@ -0,0 +1,308 @@
+import bisect
+import heapq
+import threading
+import time
+import unicodedata
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import func, select
+
+from . import models, versioning
+from .config import get_settings
+from .database import SessionLocal
+
+# 検索候補（よく検索される語と、入力途中の補完）
+#   - 人気の検索語: search_log を id 順に前回の続きから読み、件数上限つきの heavy hitters（Space-Saving 法）で
+#     時間減衰つきの回数を数える。テーブル全体を GROUP BY することはない
+#   - 補完: 物品名（語の先頭ごと）と人気の検索語のトライから、前方一致する候補を上位から返す
+# 索引はバックグラウンドのスレッドで作り直して丸ごと差し替えるので、問い合わせはロックも DB も使わない。
+# 集計はプロセスごと（どのワーカーも同じ search_log を読むので、結果はほぼ同じになる）。
+
+MAX_LIMIT = 10
+# 前方一致する候補がこれより多い節点だけ、上位の候補を先に計算しておく
+HEAVY_NODE = 64
+# 同じ物品が複数の語で当たったときに重複を除いても足りるよう、多めに持つ
+TOP_PER_NODE = 2 * MAX_LIMIT
+# 起動時に読む search_log の期間（半減期の何倍か。これより古い分の重みは 0.1% 未満）
+WARMUP_HALF_LIVES = 10
+MAX_KEYWORD_LENGTH = 100
+
+
+def normalize(text: str) -> str:
+    # 全角・半角と大文字・小文字をそろえ、空白を 1 つにまとめる
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+def word_starts(key: str):
+    # "sony ノートpc 1149" -> "sony ノートpc 1149", "ノートpc 1149", "1149"
+    yield 0, key
+    for position, char in enumerate(key):
+        if char == " ":
+            yield position + 1, key[position + 1:]
+
+
+class DecayedHeavyHitters:
+    # Space-Saving 法: capacity 語までしか持たず、あふれたら回数が最小の語と入れ替える。
+    # 入れ替えた語は最小の回数を引き継ぐ（多めに数える側の誤差で、error に記録する）。
+    # 減衰は forward decay: 時刻 t の 1 回を 2 ** ((t - landmark) / half_life) と数え、
+    # 読み出すときに同じ係数で割り戻す（全件を定期的に減らして回る必要がない）。
+    def __init__(self, capacity: int, half_life: float):
+        self.capacity = capacity
+        self.half_life = half_life
+        self.landmark = None
+        self.counts = {}  # 語 -> [重み, 誤差]
+        self._heap = []   # (重み, 語)。古くなった組は取り出すときに読み捨てる
+
+    def add(self, keyword: str, at: float):
+        if self.landmark is None:
+            self.landmark = at
+        exponent = (at - self.landmark) / self.half_life
+        if exponent > 64:
+            # 重みが大きくなりすぎないよう、基準の時刻を進めて全体を割り戻す
+            self._rescale(at)
+            exponent = 0.0
+        weight = 2.0 ** exponent
+
+        entry = self.counts.get(keyword)
+        if entry is None:
+            floor = 0.0
+            if len(self.counts) >= self.capacity:
+                floor, victim = self._pop_min()
+                del self.counts[victim]
+            entry = self.counts[keyword] = [floor, floor]
+        entry[0] += weight
+        heapq.heappush(self._heap, (entry[0], keyword))
+        if len(self._heap) > 8 * self.capacity:
+            self._compact()
+
+    def _pop_min(self):
+        while True:
+            weight, keyword = heapq.heappop(self._heap)
+            entry = self.counts.get(keyword)
+            if entry is not None and entry[0] == weight:
+                return weight, keyword
+
+    def _compact(self):
+        self._heap = [(entry[0], keyword) for keyword, entry in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def _rescale(self, at: float):
+        factor = 2.0 ** (-(at - self.landmark) / self.half_life)
+        for entry in self.counts.values():
+            entry[0] *= factor
+            entry[1] *= factor
+        self.landmark = at
+        self._compact()
+
+    def top(self, n: int, now: float) -> list:
+        # [(語, 減衰後の回数)]（回数の多い順）
+        if self.landmark is None:
+            return []
+        factor = 2.0 ** (-(now - self.landmark) / self.half_life)
+        ranked = heapq.nlargest(n, self.counts.items(), key=lambda item: item[1][0])
+        return [(keyword, entry[0] * factor) for keyword, entry in ranked]
+
+
+class PrefixIndex:
+    # トライを配列にしたもの: キーの昇順に並べ、ある接頭辞の節点 = その接頭辞で始まるキーの範囲（二分探索で求める）。
+    # 範囲が HEAVY_NODE 件を超える節点には上位 TOP_PER_NODE 件を先に計算しておき、
+    # それ以外は範囲（HEAVY_NODE 件以下）をその場で並べる。
+    # entries: (キー, 順位, 値)。順位が小さいほど上位、値が同じものは 1 つにまとめる
+    def __init__(self, entries: list):
+        entries.sort(key=lambda entry: entry[0])
+        self.keys = [entry[0] for entry in entries]
+        self.entries = entries
+        self.top = {}
+        self._build(0, len(entries), 0)
+
+    def _build(self, lo: int, hi: int, depth: int):
+        if hi - lo <= HEAVY_NODE:
+            return
+        self.top[self.keys[lo][:depth]] = heapq.nsmallest(TOP_PER_NODE, self.entries[lo:hi], key=lambda entry: entry[1])
+        # 接頭辞そのものと同じキーは先頭に並ぶので飛ばし、次の 1 文字ごとに子の節点へ分ける
+        start = lo
+        while start < hi and len(self.keys[start]) == depth:
+            start += 1
+        while start < hi:
+            char = self.keys[start][depth]
+            end = bisect.bisect_left(self.keys, self.keys[start][:depth] + chr(ord(char) + 1), start, hi)
+            self._build(start, end, depth + 1)
+            start = end
+
+    def search(self, prefix: str, limit: int) -> list:
+        lo = bisect.bisect_left(self.keys, prefix)
+        hi = bisect.bisect_left(self.keys, prefix + "\U0010ffff", lo)
+        if hi - lo > HEAVY_NODE:
+            candidates = self.top[prefix]
+        else:
+            candidates = sorted(self.entries[lo:hi], key=lambda entry: entry[1])
+        result = []
+        seen = set()
+        for _, _, value in candidates:
+            if value in seen:
+                continue
+            seen.add(value)
+            result.append(value)
+            if len(result) >= limit:
+                break
+        return result
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class Suggester:
+    # 引数を省略すると設定値（SUGGEST_*）を使う
+    def __init__(self, capacity: Optional[int] = None, half_life_hours: Optional[float] = None, refresh_interval: Optional[float] = None, batch_size: Optional[int] = None):
+        settings = get_settings()
+        self.capacity = capacity or settings.suggest_capacity
+        self.half_life = (half_life_hours or settings.suggest_half_life_hours) * 3600
+        self.refresh_interval = refresh_interval or settings.suggest_refresh_interval
+        self.batch_size = batch_size or settings.suggest_batch_size
+
+        self._hitters = DecayedHeavyHitters(self.capacity, self.half_life)
+        self._last_id = None
+        self._item_version = None
+        # 問い合わせが読むのはこの 3 つだけ（作り直したものと丸ごと入れ替える）
+        self._trending = []
+        self._keywords = PrefixIndex([])
+        self._items = PrefixIndex([])
+
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = None
+        self._refresh_lock = threading.Lock()
+
+        self.refreshes = 0
+        self.failed_refreshes = 0
+        self.rows_read = 0
+        self.item_builds = 0
+        self.last_refresh_ms = 0.0
+        self.last_item_build_ms = 0.0
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="suggest-refresher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                self.failed_refreshes += 1
+                print(f"検索候補の更新エラー: {e}")
+            with self._cond:
+                if not self._stopping:
+                    self._cond.wait(self.refresh_interval)
+                if self._stopping:
+                    return
+
+    def refresh(self):
+        with self._refresh_lock:
+            start = time.perf_counter()
+            db = SessionLocal()
+            try:
+                self._read_search_logs(db)
+                self._refresh_items(db)
+            finally:
+                db.close()
+            now = time.time()
+            top = self._hitters.top(self.capacity, now)
+            self._keywords = PrefixIndex([
+                (key, (position, -count), keyword)
+                for keyword, count in top
+                for position, key in word_starts(keyword)
+            ])
+            self._trending = [keyword for keyword, _ in top[:MAX_LIMIT]]
+            self.refreshes += 1
+            self.last_refresh_ms = (time.perf_counter() - start) * 1000
+
+    def _read_search_logs(self, db):
+        table = models.SearchLog.__table__
+        if self._last_id is None:
+            # 初回は減衰で重みが残る期間の分だけ読む
+            since = datetime.now() - timedelta(seconds=WARMUP_HALF_LIVES * self.half_life)
+            first = db.execute(select(func.min(table.c.id)).where(table.c.searched_at >= since)).scalar()
+            self._last_id = first - 1 if first is not None else db.execute(select(func.max(table.c.id))).scalar() or 0
+        while True:
+            rows = db.execute(
+                select(table.c.id, table.c.search_keyword, table.c.searched_at)
+                .where(table.c.id > self._last_id)
+                .order_by(table.c.id)
+                .limit(self.batch_size)
+            ).all()
+            for _, keyword, searched_at in rows:
+                keyword = normalize(keyword)
+                if keyword and len(keyword) <= MAX_KEYWORD_LENGTH:
+                    self._hitters.add(keyword, searched_at.timestamp() if searched_at else time.time())
+            if rows:
+                self._last_id = rows[-1][0]
+                self.rows_read += len(rows)
+            if len(rows) < self.batch_size:
+                return
+
+    def _refresh_items(self, db):
+        # 貸出・返却で進むのは item#N の分割カウンタだけなので、基のカウンタが変わるのは物品の追加・変更・削除のとき
+        version = dict(db.execute(versioning.versions_statement(("item",))).all()).get("item", 0)
+        if version == self._item_version:
+            return
+        start = time.perf_counter()
+        entries = []
+        for item_id, name in db.execute(select(models.Item.id, models.Item.name)):
+            key = normalize(name)
+            # 語の先頭で当たったものより名前の先頭で当たったもの、長い名前より短い名前を上に
+            for position, suffix in word_starts(key):
+                entries.append((suffix, (position > 0, len(name), name), (item_id, name)))
+        self._items = PrefixIndex(entries)
+        self._item_version = version
+        self.item_builds += 1
+        self.last_item_build_ms = (time.perf_counter() - start) * 1000
+
+    def suggest(self, q: str, limit: int = MAX_LIMIT) -> dict:
+        limit = max(1, min(limit, MAX_LIMIT))
+        prefix = normalize(q)
+        if not prefix:
+            # 入力がなければ最近よく検索されている語
+            return {"keywords": self._trending[:limit], "items": []}
+        return {
+            "keywords": self._keywords.search(prefix, limit),
+            "items": [{"id": item_id, "name": name} for item_id, name in self._items.search(prefix, limit)],
+        }
+
+    def stats(self) -> dict:
+        return {
+            "keywords": len(self._hitters.counts),
+            "keyword_keys": len(self._keywords),
+            "item_keys": len(self._items),
+            "rows_read": self.rows_read,
+            "refreshes": self.refreshes,
+            "failed_refreshes": self.failed_refreshes,
+            "item_builds": self.item_builds,
+            "last_refresh_ms": round(self.last_refresh_ms, 3),
+            "last_item_build_ms": round(self.last_item_build_ms, 3),
+        }
+
+
+# 設定を読むのは最初に使うとき（import しただけでは作らない）
+_suggester = None
+_suggester_lock = threading.Lock()
+
+
+def get_suggester() -> Suggester:
+    global _suggester
+    with _suggester_lock:
+        if _suggester is None:
+            _suggester = Suggester()
+        return _suggester
@@ -1,69 +1,83 @@
+import hmac
 from fastapi import Depends, HTTPException, Request
 from jose import JWTError, jwt
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from .database import get_db
-from . import models
-import bcrypt
+from .database import get_db, get_async_db
+from . import models, hashing
+from .cache import user_cache
+from .mailer import mailer
+from .config import get_settings
 from datetime import datetime, timedelta
-import os
-import smtplib
+from functools import lru_cache
 from email.mime.text import MIMEText
 from itsdangerous import URLSafeTimedSerializer, SignatureExpired, BadSignature
-from dotenv import load_dotenv
 
-# 環境変数を読み込む
-load_dotenv()
-
-FRONTEND_URL = os.getenv("FRONTEND_URL")
-
-# データベース接続情報
-MYSQL_USER = os.getenv("MYSQL_USER")
-MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD")
-MYSQL_HOST = os.getenv("MYSQL_HOST", "database")
-MYSQL_DATABASE = os.getenv("MYSQL_DATABASE", "inventory_management")
-
-# トークン設定
-SECRET_KEY = os.getenv("SECRET_KEY")
-ALGORITHM = os.getenv("ALGORITHM")
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES"))
-serializer = URLSafeTimedSerializer(SECRET_KEY)
-
-# メール設定
-SMTP_SERVER = os.getenv("SMTP_SERVER")
-SMTP_PORT = int(os.getenv("SMTP_PORT"))
-SMTP_USER = os.getenv("SMTP_USER")
-SMTP_PASSWORD=os.getenv("SMTP_PASSWORD")
-
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+# パスワードリセット用トークンの署名
+@lru_cache
+def get_serializer() -> URLSafeTimedSerializer:
+    return URLSafeTimedSerializer(get_settings().secret_key)
 
+# bcrypt はハッシュ専用のプロセスプールで実行する（hashing.py）
+# ハッシュの作成は、イベントループを止めないよう async_crud から hashing.hash_password_async で行う
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return bcrypt.checkpw(plain_password.encode("utf-8"), hashed_password.encode("utf-8"))
+    return hashing.verify_password(plain_password, hashed_password)
 
 
 def create_access_token(data: dict, expires_delta: timedelta = None):
+    settings = get_settings()
     to_encode = data.copy()
-    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
+    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=settings.access_token_expire_minutes))
     to_encode.update({"exp": expire})
-    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return jwt.encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
 
-def get_current_user(request: Request, db: Session = Depends(get_db)) -> models.User:
+def get_user_id_from_token(request: Request) -> int:
     token = request.cookies.get("access_token")
     if token is None:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        settings = get_settings()
+        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
         user_id: str = payload.get("sub")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid token")
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-    user = db.query(models.User).filter(models.User.id == int(user_id)).first()
+    return int(user_id)
+
+# 返すユーザーはキャッシュから作り直したセッション外のオブジェクトの場合がある。
+# 変更して保存したいときは、セッションで読み直すこと。
+def get_current_user(request: Request, db: Session = Depends(get_db)) -> models.User:
+    user_id = get_user_id_from_token(request)
+
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+
+    user = db.query(models.User).filter(models.User.id == user_id).first()
+    if user is None:
+        raise HTTPException(status_code=401, detail="User not found")
+
+    user_cache.put(user)
+    return user
+
+# 非同期エンドポイント用
+async def get_current_user_async(request: Request, db: AsyncSession = Depends(get_async_db)) -> models.User:
+    user_id = get_user_id_from_token(request)
+
+    user = user_cache.get(user_id)
+    if user is not None:
+        return user
+
+    result = await db.execute(select(models.User).filter(models.User.id == user_id))
+    user = result.scalars().first()
     if user is None:
         raise HTTPException(status_code=401, detail="User not found")
 
+    user_cache.put(user)
     return user
 
 def get_current_admin_user(
@@ -73,43 +87,21 @@ def get_current_admin_user(
         raise HTTPException(status_code=403, detail="Admin privileges required")
     return current_user
 
-# SMTPリレー方式
-# def send_reset_email(user_email: str):
-#     # パスワードリセットトークンを生成
-#     token = serializer.dumps(user_email, salt="password-reset-salt")
-#     reset_url = f"http://localhost:5173/reset-password?token={token}"
-
-#     # メール本文をプレーンテキストで作成
-#     text = f"""\
-# パスワードリセットのリクエストがありました。
-
-# 以下のリンクから新しいパスワードを設定してください（有効期限: 30分）:
-
-# {reset_url}
-
-# このメールに心当たりがない場合は、無視してください。
-# """
-
-#     message = MIMEText(text, "plain", "utf-8")
-#     message["Subject"] = "パスワードリセット"
-#     message["From"] = SMTP_USER
-#     message["To"] = user_email
-
-#     try:
-#         with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-#             server.ehlo()
-#             server.starttls()
-#             server.ehlo()
-#             server.sendmail(SMTP_USER, user_email, message.as_string())
-#         print("パスワードリセットメールを送信しました。")
-#     except Exception as e:
-#         print(f"メール送信エラー: {e}")
-
-# 認証付きSMTP
-def send_reset_email(user_email: str):
+# /metrics 用。METRICS_TOKEN の Bearer トークンか、管理者のログイン（cookie）で読める
+def require_metrics_access(request: Request, db: Session = Depends(get_db)):
+    token = get_settings().metrics_token
+    scheme, _, credentials = request.headers.get("authorization", "").partition(" ")
+    if token and scheme.lower() == "bearer" and hmac.compare_digest(credentials.encode(), token.encode()):
+        return
+    get_current_admin_user(get_current_user(request, db))
+
+# パスワードリセットメールを送信キューに積む（送信は mailer のスレッドが行う）
+# キューがいっぱいで受け付けられなければ False
+def send_reset_email(user_email: str) -> bool:
+    settings = get_settings()
     # パスワードリセットトークンを生成
-    token = serializer.dumps(user_email, salt="password-reset-salt")
-    reset_url = f"{FRONTEND_URL}/reset-password?token={token}"
+    token = get_serializer().dumps(user_email, salt="password-reset-salt")
+    reset_url = f"{settings.frontend_url}/reset-password?token={token}"
 
     # メール本文をプレーンテキストで作成
     text = f"""\
@@ -124,23 +116,33 @@ def send_reset_email(user_email: str):
 
     message = MIMEText(text, "plain", "utf-8")
     message["Subject"] = "パスワードリセット"
-    message["From"] = SMTP_USER
+    message["From"] = settings.smtp_user
     message["To"] = user_email
+    return mailer.send(message)
 
-    try:
-        with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-            server.ehlo()                      # Gmailでは必要なことがある
-            server.starttls()
-            server.ehlo()                      # TLSのあと再度挨拶
-            server.login(SMTP_USER, SMTP_PASSWORD)  # ここでアプリパスワードを使う
-            server.sendmail(SMTP_USER, user_email, message.as_string())
-        print("パスワードリセットメールを送信しました。")
-    except Exception as e:
-        print(f"メール送信エラー: {e}")
+# 延滞のお知らせ（同じ利用者の分を 1 通にまとめる）。loans は item_name・due_date を持つ行
+def send_overdue_email(user_email: str, user_name: str, loans) -> bool:
+    settings = get_settings()
+    lines = "\n".join(f"- {loan.item_name}（返却期限: {loan.due_date:%Y-%m-%d %H:%M}）" for loan in loans)
+    text = f"""\
+{user_name} さん
+
+次の物品の返却期限が過ぎています。返却をお願いします。
+
+{lines}
+
+{settings.frontend_url}
+"""
+
+    message = MIMEText(text, "plain", "utf-8")
+    message["Subject"] = "返却期限が過ぎています"
+    message["From"] = settings.smtp_user
+    message["To"] = user_email
+    return mailer.send(message)
 
 def verify_reset_token(token: str, max_age: int = 1800) -> str:
     try:
-        email = serializer.loads(token, salt="password-reset-salt", max_age=max_age)
+        email = get_serializer().loads(token, salt="password-reset-salt", max_age=max_age)
         return email
     except SignatureExpired:
         raise HTTPException(status_code=400, detail="トークンの有効期限が切れています。")
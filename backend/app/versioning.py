@@ -0,0 +1,86 @@
+import hashlib
+
+from fastapi import Request
+from sqlalchemy import insert, select, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+
+from . import models
+from .config import get_settings
+
+# テーブルの更新カウンタと ETag
+# 書き込み処理は同じトランザクションの中で対象テーブルのカウンタを 1 進める。
+# 一覧 API はカウンタ（主キーで読むだけ）から ETag を作り、If-None-Match が一致すれば
+# 一覧のクエリもシリアライズもせずに 304 を返す。カウンタは DB にあるので複数ワーカーでも正しく動く。
+#
+# 貸出・返却のように 1 行ずつ頻繁に変わる更新は、テーブル全体のカウンタ（1 行）ではなく
+# 行の id で分けたカウンタ（"item#<id % COUNTER_SHARDS>"）を進める（bump_rows）。
+# 別々の物品の貸出が同じ行のロックを待ち合わないようにするため。ETag はすべての分割カウンタから作る。
+
+# 行ごとのカウンタを持つテーブル
+SHARDED = ("item",)
+
+
+def _bump_name(db, table, name: str):
+    if db.get_bind().dialect.name == "mysql":
+        stmt = mysql_insert(table).values(name=name, version=1)
+        db.execute(stmt.on_duplicate_key_update(version=table.c.version + 1))
+        return
+    result = db.execute(update(table).where(table.c.name == name).values(version=table.c.version + 1))
+    if result.rowcount == 0:
+        db.execute(insert(table).values(name=name, version=1))
+
+
+def bump(db, *tables: str):
+    table = models.TableVersion.__table__
+    for name in tables:
+        _bump_name(db, table, name)
+
+
+def shard_name(table_name: str, row_id: int) -> str:
+    return f"{table_name}#{row_id % get_settings().counter_shards}"
+
+
+def bump_rows(db, table_name: str, row_ids):
+    # 行の id ごとの分割カウンタを進める。同時に複数件を更新する処理どうしがデッドロックしないよう、名前順にロックする
+    table = models.TableVersion.__table__
+    for name in sorted({shard_name(table_name, row_id) for row_id in row_ids}):
+        _bump_name(db, table, name)
+
+
+def counter_names(tables) -> list:
+    # ETag に使うカウンタの名前（分割したテーブルは全体のカウンタとすべての分割カウンタ）
+    names = []
+    for name in tables:
+        names.append(name)
+        if name in SHARDED:
+            names += [f"{name}#{shard}" for shard in range(get_settings().counter_shards)]
+    return names
+
+
+def versions_statement(tables):
+    return select(models.TableVersion.name, models.TableVersion.version).where(models.TableVersion.name.in_(tables))
+
+
+def make_etag(request: Request, tables, rows) -> str:
+    # 同じ URL・同じカウンタなら同じ値になる強い ETag
+    versions = dict(rows)
+    source = "|".join(f"{name}={versions.get(name, 0)}" for name in sorted(tables))
+    source += "|" + request.url.path + "?" + "&".join(sorted(str(request.query_params).split("&")))
+    return '"' + hashlib.sha1(source.encode("utf-8")).hexdigest() + '"'
+
+
+async def etag_for(db, request: Request, tables) -> str:
+    names = counter_names(tables)
+    result = await db.execute(versions_statement(names))
+    return make_etag(request, names, result.all())
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # If-None-Match は弱い比較なので W/ 付きも一致とみなす
+    candidates = [value.strip().removeprefix("W/") for value in header.split(",")]
+    return etag in candidates
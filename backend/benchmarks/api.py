@@ -0,0 +1,193 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import time
+
+from . import common
+
+os.environ.setdefault("METRICS_SERVER_TIMING", "1")  # クエリ数を Server-Timing ヘッダから読む
+
+import httpx
+from sqlalchemy import func, select
+
+from .query_budget import query_count
+from .seed import ADMIN_EMAIL, PASSWORD
+
+# API のベンチマーク
+# benchmarks.seed で投入したデータベースに対して、アプリを同じプロセスで動かし（httpx の ASGI トランスポート）、
+# よく使われるエンドポイントごとにスループット・p50/p95/p99・1 リクエストあたりのクエリ数を測る。
+# 結果を JSON に保存しておき、変更後の結果と比べられる。
+# 使い方（backend ディレクトリで）:
+#   python -m benchmarks.api --save benchmarks/results/before.json
+#   python -m benchmarks.api --compare benchmarks/results/before.json
+# 比較では p95 が --threshold（既定 10%）以上悪化したか、クエリ数が増えたエンドポイントを表示し、終了コード 1 で終わる。
+
+# (名前, パス)。{item_id} などは実行のたびにデータベースにある値から選ぶ
+SCENARIOS = [
+    ("items", "/items/?limit=100"),
+    ("items cursor", "/items/?limit=100&cursor="),
+    ("items sorted", "/items/?limit=100&sort_by=name&sort_order=desc"),
+    ("items by category", "/items/?limit=100&category_id={category_id}"),
+    ("items available", "/items/?limit=100&is_available=true&location=A-101"),
+    ("items search", "/items/?limit=50&name={keyword}"),
+    ("items fields", "/items/?limit=100&fields=id,name,is_available,location"),
+    ("item detail", "/items/{item_id}"),
+    ("categories", "/categories/?limit=200"),
+    ("category stats", "/stats/categories"),
+    ("transactions", "/transactions/?limit=100"),
+    ("transactions cursor", "/transactions/?limit=100&cursor="),
+    ("transactions by user", "/transactions/?limit=100&user_id={user_id}"),
+    ("transactions by item", "/transactions/?limit=100&item_id={item_id}"),
+    ("transactions pending", "/transactions/?limit=100&status=request"),
+    ("me", "/me"),
+]
+
+SEARCH_TERMS = ["ノートPC", "ケーブル", "laptop", "camera", "Sony", "モニター"]
+
+
+def dataset_params():
+    from app import models
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        counts = {
+            model.__tablename__: db.execute(select(func.count()).select_from(model)).scalar()
+            for model in (models.Item, models.Category, models.User, models.ItemTransaction)
+        }
+        max_ids = {
+            "item_id": db.execute(select(func.max(models.Item.id))).scalar() or 1,
+            "category_id": db.execute(select(func.max(models.Category.id))).scalar() or 1,
+            "user_id": db.execute(select(func.max(models.User.id))).scalar() or 1,
+        }
+    finally:
+        db.close()
+    return counts, max_ids
+
+
+async def run_scenario(client, path: str, max_ids: dict, requests: int, concurrency: int, rng: random.Random):
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = []
+    queries = []
+    errors = 0
+
+    async def one():
+        nonlocal errors
+        url = path.format(
+            item_id=rng.randint(1, max_ids["item_id"]),
+            category_id=rng.randint(1, max_ids["category_id"]),
+            user_id=rng.randint(1, max_ids["user_id"]),
+            keyword=rng.choice(SEARCH_TERMS),
+        )
+        async with semaphore:
+            start = time.perf_counter()
+            res = await client.get(url)
+            samples.append((time.perf_counter() - start) * 1000)
+        if res.status_code >= 400 and res.status_code != 404:
+            errors += 1
+            return
+        queries.append(query_count(res))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": requests,
+        "errors": errors,
+        "rps": round(requests / elapsed, 1),
+        "p50_ms": round(common.percentile(samples, 50), 2),
+        "p95_ms": round(common.percentile(samples, 95), 2),
+        "p99_ms": round(common.percentile(samples, 99), 2),
+        "queries": statistics.median(queries) if queries else None,
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def compare(baseline: dict, results: dict, threshold: float) -> int:
+    regressions = 0
+    print(f"\n{'':<22} {'p95 before':>11} {'p95 after':>10} {'change':>8} {'queries':>10}")
+    for name, after in results["scenarios"].items():
+        before = baseline["scenarios"].get(name)
+        if before is None:
+            print(f"{name:<22} (新規)")
+            continue
+        change = (after["p95_ms"] - before["p95_ms"]) / before["p95_ms"] if before["p95_ms"] else 0.0
+        more_queries = (after["queries"] or 0) > (before["queries"] or 0)
+        worse = change > threshold or more_queries
+        regressions += worse
+        print(
+            f"{name:<22} {before['p95_ms']:>9.2f}ms {after['p95_ms']:>8.2f}ms {change:>+7.0%} "
+            f"{before['queries']!s:>4} -> {after['queries']!s:<3}{'  悪化' if worse else ''}"
+        )
+    if baseline.get("dataset") != results.get("dataset"):
+        print(f"注意: データ件数が基準と違います（基準 {baseline.get('dataset')} / 今回 {results.get('dataset')}）")
+    return regressions
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=200, help="エンドポイントごとのリクエスト数")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--only", help="名前に含まれる文字列でシナリオを絞り込む")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="結果を保存する JSON ファイル")
+    parser.add_argument("--compare", help="比べる基準の JSON ファイル")
+    parser.add_argument("--threshold", type=float, default=0.10)
+    args = parser.parse_args()
+
+    from app.main import app
+
+    counts, max_ids = dataset_params()
+    if not counts["user"]:
+        raise SystemExit("データがありません。先に python -m benchmarks.seed を実行してください。")
+    print(f"dataset {counts}")
+
+    rng = random.Random(args.seed)
+    results = {"revision": git_revision(), "dataset": counts, "concurrency": args.concurrency, "scenarios": {}}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            res = await client.post("/login", json={"email": ADMIN_EMAIL, "password": PASSWORD})
+            if res.status_code != 200:
+                raise SystemExit(f"ログインできませんでした: {res.status_code} {res.text}")
+
+            for name, path in SCENARIOS:
+                if args.only and args.only not in name:
+                    continue
+                await run_scenario(client, path, max_ids, args.warmup, args.concurrency, rng)
+                result = await run_scenario(client, path, max_ids, args.requests, args.concurrency, rng)
+                results["scenarios"][name] = result
+                print(
+                    f"{name:<22} {result['rps']:>8.1f} req/s  p50={result['p50_ms']:>7.2f}ms  "
+                    f"p95={result['p95_ms']:>7.2f}ms  p99={result['p99_ms']:>7.2f}ms  "
+                    f"queries={result['queries']}  errors={result['errors']}"
+                )
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"保存しました: {args.save}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, results, args.threshold)
+        if regressions:
+            print(f"{regressions} 件のエンドポイントが悪化しました")
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+import argparse
+import random
+import statistics
+from datetime import datetime, timedelta
+
+from . import common
+
+from sqlalchemy import func, select, text
+
+from app import archive, crud, migrations, models
+from app.database import SessionLocal, get_engine
+
+# 取引のアーカイブの前後比較
+# benchmarks.seed で投入したデータベースで、取引テーブルの件数・サイズと、よく使う取引一覧の取得時間を測り、
+# アーカイブを実行してからもう一度測る。
+# 使い方（backend ディレクトリで、使い捨てのデータベースに向けて実行すること。取引が実際に移る）:
+#   python -m benchmarks.archive [--after-days 365] [--repeat 20]
+
+
+def table_sizes(db) -> dict:
+    sizes = {
+        "hot_rows": db.execute(select(func.count()).select_from(archive.hot)).scalar(),
+        "archive_rows": db.execute(select(func.count()).select_from(archive.cold)).scalar(),
+    }
+    if db.bind.dialect.name == "mysql":
+        # データとインデックスの合計（統計情報の値なので概算）
+        rows = db.execute(text(
+            "SELECT table_name, data_length + index_length FROM information_schema.tables "
+            "WHERE table_schema = DATABASE() AND table_name IN ('item_transaction', 'item_transaction_archive')"
+        )).all()
+        for name, size in rows:
+            sizes[f"{name}_mib"] = round(size / 1024 / 1024, 1)
+    return sizes
+
+
+def scenarios(db, rng, max_user_id: int, max_item_id: int):
+    now = datetime.now()
+    return [
+        ("pending", lambda: crud.get_transactions(db, limit=100, status="request")),
+        ("user last 30 days", lambda: crud.get_transactions(db, limit=100, user_id=rng.randint(1, max_user_id), date_from=now - timedelta(days=30))),
+        ("item last 90 days", lambda: crud.get_transactions(db, limit=100, item_id=rng.randint(1, max_item_id), date_from=now - timedelta(days=90))),
+        ("recent cursor page", lambda: crud.get_transactions(db, limit=100, cursor="", date_from=now - timedelta(days=30))),
+        ("user recent", lambda: crud.get_transactions(db, limit=100, user_id=rng.randint(1, max_user_id))),
+        ("user full history", lambda: crud.get_transactions(db, limit=100, user_id=rng.randint(1, max_user_id), include_archive=True)),
+        ("item full history", lambda: crud.get_transactions(db, limit=100, item_id=rng.randint(1, max_item_id), include_archive=True)),
+    ]
+
+
+def measure_all(db, args) -> dict:
+    max_user_id = db.execute(select(func.max(models.User.id))).scalar() or 1
+    max_item_id = db.execute(select(func.max(models.Item.id))).scalar() or 1
+    results = {}
+    for name, fn in scenarios(db, random.Random(args.seed), max_user_id, max_item_id):
+        fn()  # 1 回目はキャッシュを温める
+        results[name] = common.measure(lambda: (fn(), db.expunge_all()), args.repeat)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--after-days", type=int, help="省略時は ARCHIVE_AFTER_DAYS")
+    parser.add_argument("--batch-size", type=int)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    migrations.upgrade(get_engine())
+    db = SessionLocal()
+    try:
+        before_sizes = table_sizes(db)
+        if not before_sizes["hot_rows"]:
+            raise SystemExit("取引がありません。先に python -m benchmarks.seed を実行してください。")
+        before = measure_all(db, args)
+
+        result = archive.run(db, after_days=args.after_days, batch_size=args.batch_size, max_batches=10 ** 9, pause=0, log=lambda message: None)
+        print(f"archive {result}")
+
+        after_sizes = table_sizes(db)
+        after = measure_all(db, args)
+    finally:
+        db.close()
+
+    print(f"before {before_sizes}")
+    print(f"after  {after_sizes}")
+    print(f"\n{'':<20} {'median before':>14} {'median after':>13} {'p95 before':>11} {'p95 after':>10}")
+    for name in before:
+        b, a = before[name], after[name]
+        print(
+            f"{name:<20} {statistics.median(b):>12.2f}ms {statistics.median(a):>11.2f}ms "
+            f"{common.percentile(b, 95):>9.2f}ms {common.percentile(a, 95):>8.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
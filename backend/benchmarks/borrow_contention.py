@@ -0,0 +1,145 @@
+import argparse
+import random
+import threading
+import time
+
+from . import common  # noqa: F401
+
+from sqlalchemy import func, select
+
+# 貸出が集中したときの確認
+# 複数スレッドが物品を「借りる → 少し持つ → 返す」を繰り返し、
+#   - 同時に 2 人が借りている瞬間がないこと（二重貸出がないこと）
+#   - 最後に物品の状態・取引・カテゴリ集計が食い違っていないこと
+# を確かめ、1 秒あたりの貸出・返却の件数を表示する。
+# --items 1（既定）は 1 つの物品の取り合い、--items 200 などは同じカテゴリの多くの物品に貸出が散らばる場合
+# （物品の行は別々でも、カテゴリ集計・バージョンの行を共有していると待ち合う）。
+# 使い方: python -m benchmarks.borrow_contention --threads 16 --seconds 10 [--items 200]
+# （DATABASE_URL の向き先に検証用のユーザー・物品を作るので、本番のデータベースには使わないこと）
+
+
+def setup(db, items: int):
+    from app import crud, models, schemas
+
+    user = db.execute(select(models.User).where(models.User.email == "contention@example.com")).scalars().first()
+    if user is None:
+        user = models.User(name="contention", email="contention@example.com", grade="M1", password="-")
+        db.add(user)
+        db.commit()
+    # 物品はすべて同じカテゴリに入れる（カテゴリ集計の行が一番集中する形）
+    suffix = time.time_ns()
+    category = crud.create_category(db, schemas.CategoryCreate(name=f"contention-{suffix}"))
+    item_ids = [
+        crud.create_item(db, schemas.ItemCreate(name=f"contention-{suffix}-{i}", category_id=category.id)).id
+        for i in range(items)
+    ]
+    return user.id, item_ids
+
+
+def worker(user_id: int, item_ids: list, deadline: float, hold: float, state: dict, lock: threading.Lock):
+    from app import crud, database, schemas
+
+    while time.perf_counter() < deadline:
+        item_id = random.choice(item_ids)
+        db = database.SessionLocal()
+        try:
+            try:
+                tx = crud.create_transaction(db, schemas.ItemTransactionCreate(item_id=item_id, user_id=user_id, type="borrow"))
+            except crud.ItemUnavailableError:
+                with lock:
+                    state["conflicts"] += 1
+                continue
+
+            with lock:
+                if item_id in state["holders"]:
+                    state["double_loans"] += 1
+                state["holders"].add(item_id)
+                state["borrows"] += 1
+            time.sleep(hold)
+            with lock:
+                state["holders"].discard(item_id)
+            crud.return_transaction(db, tx.id)
+            with lock:
+                state["returns"] += 1
+        except Exception as e:
+            db.rollback()
+            with lock:
+                state["errors"] += 1
+                state["last_error"] = str(e).splitlines()[0]
+        finally:
+            db.close()
+
+
+def check(db, item_ids: list) -> list:
+    from app import models, stats
+
+    problems = []
+    active_by_item = dict(
+        db.execute(
+            select(models.ItemTransaction.item_id, func.count())
+            .where(
+                models.ItemTransaction.item_id.in_(item_ids),
+                models.ItemTransaction.status.in_(("request", "approved")),
+            )
+            .group_by(models.ItemTransaction.item_id)
+        ).all()
+    )
+    for item in db.execute(select(models.Item).where(models.Item.id.in_(item_ids))).scalars():
+        active = active_by_item.get(item.id, 0)
+        if active > 1:
+            problems.append(f"物品 {item.id} の貸出中の取引が {active} 件あります")
+        if bool(item.is_available) != (active == 0):
+            problems.append(f"物品 {item.id} の状態（is_available={item.is_available}）と貸出中の取引数（{active}）が合いません")
+    problems += [f"カテゴリ集計のずれ: {diff}" for diff in stats.verify(db)]
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--hold", type=float, default=0.001, help="借りてから返すまでの時間（秒）")
+    parser.add_argument("--items", type=int, default=1, help="貸出を散らばらせる物品の数（すべて同じカテゴリ）")
+    args = parser.parse_args()
+
+    from app import database
+
+    db = database.SessionLocal()
+    user_id, item_ids = setup(db, args.items)
+    db.close()
+
+    state = {"borrows": 0, "returns": 0, "conflicts": 0, "double_loans": 0, "holders": set(), "errors": 0, "last_error": None}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.seconds
+    threads = [
+        threading.Thread(target=worker, args=(user_id, item_ids, deadline, args.hold, state, lock))
+        for _ in range(args.threads)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"threads={args.threads} items={args.items} {elapsed:.1f}s  borrows={state['borrows']} ({state['borrows'] / elapsed:.1f}/s)  "
+        f"returns={state['returns']}  conflicts={state['conflicts']}  errors={state['errors']}"
+    )
+    if state["last_error"]:
+        print(f"last error: {state['last_error']}")
+
+    db = database.SessionLocal()
+    problems = check(db, item_ids)
+    db.close()
+    if state["double_loans"]:
+        problems.append(f"二重貸出が {state['double_loans']} 回ありました")
+    for problem in problems:
+        print(f"NG {problem}")
+    if problems:
+        raise SystemExit(1)
+    print("OK 二重貸出なし")
+
+
+if __name__ == "__main__":
+    main()
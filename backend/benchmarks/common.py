@@ -0,0 +1,35 @@
+import os
+import statistics
+import time
+
+# ベンチマーク用の共通処理
+# トークンの発行に必要な設定が無い環境でも動くよう、仮の値を入れておく
+os.environ.setdefault("SECRET_KEY", "benchmark-secret")
+os.environ.setdefault("ALGORITHM", "HS256")
+os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "120")
+
+
+def percentile(samples, p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(fn, repeat: int = 20):
+    # fn を repeat 回実行し、各回の所要時間（ミリ秒）を返す
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def summarize(samples) -> str:
+    return (
+        f"median={statistics.median(samples):.2f}ms "
+        f"p95={percentile(samples, 95):.2f}ms "
+        f"max={max(samples):.2f}ms"
+    )
@@ -0,0 +1,60 @@
+import argparse
+import asyncio
+import time
+
+from . import common
+
+from starlette.concurrency import run_in_threadpool
+
+from app import async_crud, crud
+from app.database import AsyncSessionLocal, SessionLocal
+
+# 同期パス（スレッドプール + SessionLocal）と非同期パス（AsyncSessionLocal）の同時実行性能の比較
+# 使い方: python -m benchmarks.concurrency --requests 2000 --concurrency 200
+
+
+def sync_call(limit: int):
+    db = SessionLocal()
+    try:
+        return crud.get_items(db, limit=limit)
+    finally:
+        db.close()
+
+
+async def async_call(limit: int):
+    async with AsyncSessionLocal() as db:
+        return await async_crud.get_items(db, limit=limit)
+
+
+async def run(label: str, call, requests: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = []
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await call()
+            samples.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    print(
+        f"{label:<6} {requests / elapsed:8.1f} req/s  "
+        f"p50={common.percentile(samples, 50):.1f}ms p99={common.percentile(samples, 99):.1f}ms"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    await run("sync", lambda: run_in_threadpool(sync_call, args.limit), args.requests, args.concurrency)
+    await run("async", lambda: async_call(args.limit), args.requests, args.concurrency)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+import argparse
+import random
+
+from . import common
+
+from sqlalchemy import exists, func, select
+
+from app import loans, migrations, models
+from app.database import SessionLocal, get_engine
+
+# 「今誰が借りているか」の取得の比較
+# benchmarks.seed で投入したデータベースで、
+#   - 履歴（item_transaction）から、返却されていない最後の貸出を探す（以前の方法）
+#   - item_current_loan を主キー・利用者 id で引く
+# の時間を比べ、最後に item_current_loan が履歴と一致しているかを確かめる。
+# 使い方: python -m benchmarks.current_loan [--repeat 200]
+
+tx = models.ItemTransaction.__table__
+
+
+def item_loan_from_history(db, item_id: int):
+    child = tx.alias("child")
+    return db.execute(
+        select(tx.c.id, tx.c.user_id, tx.c.status, tx.c.transaction_date)
+        .where(
+            tx.c.item_id == item_id,
+            tx.c.type == "borrow",
+            tx.c.status.in_(loans.OPEN_STATUSES),
+            ~exists().where(child.c.related_transaction_id == tx.c.id, child.c.type == "return"),
+        )
+        .order_by(tx.c.id.desc())
+        .limit(1)
+    ).first()
+
+
+def user_loans_from_history(db, user_id: int):
+    child = tx.alias("child")
+    return db.execute(
+        select(tx.c.item_id, tx.c.id, tx.c.status, tx.c.transaction_date)
+        .where(
+            tx.c.user_id == user_id,
+            tx.c.type == "borrow",
+            tx.c.status.in_(loans.OPEN_STATUSES),
+            ~exists().where(child.c.related_transaction_id == tx.c.id, child.c.type == "return"),
+        )
+    ).all()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    migrations.upgrade(get_engine())
+    db = SessionLocal()
+    try:
+        max_item_id = db.execute(select(func.max(models.Item.id))).scalar()
+        max_user_id = db.execute(select(func.max(models.User.id))).scalar()
+        if not max_item_id:
+            raise SystemExit("データがありません。先に python -m benchmarks.seed を実行してください。")
+        rng = random.Random(args.seed)
+        cases = [
+            ("item: history", lambda: item_loan_from_history(db, rng.randint(1, max_item_id))),
+            ("item: current_loan", lambda: db.execute(loans.item_loan_statement(rng.randint(1, max_item_id))).first()),
+            ("user: history", lambda: user_loans_from_history(db, rng.randint(1, max_user_id))),
+            ("user: current_loan", lambda: db.execute(loans.user_loans_statement(rng.randint(1, max_user_id))).all()),
+        ]
+        for name, fn in cases:
+            fn()
+            print(f"{name:<20} {common.summarize(common.measure(fn, args.repeat))}")
+
+        drift = loans.verify(db)
+        print("履歴と一致しています" if not drift else f"{len(drift)} 件の物品で記録がずれています: {drift[:5]}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import argparse
+import asyncio
+import time
+
+from . import common
+
+import httpx
+
+# 条件付き GET（ETag / If-None-Match）の効果測定
+# 同じ一覧を繰り返し取得するポーリングを、ETag を送らない場合と送る場合で比べ、
+# 1 秒あたりのリクエスト数と転送量を表示する。
+# 使い方: python -m benchmarks.etag_polling --url http://localhost:8000 --path "/items/?limit=100"
+
+
+async def poll(client, path: str, requests: int, concurrency: int, conditional: bool):
+    etag = None
+    if conditional:
+        etag = (await client.get(path)).headers.get("etag")
+
+    semaphore = asyncio.Semaphore(concurrency)
+    received = 0
+    not_modified = 0
+    samples = []
+
+    async def one():
+        nonlocal received, not_modified
+        headers = {"If-None-Match": etag} if etag else {}
+        async with semaphore:
+            start = time.perf_counter()
+            res = await client.get(path, headers=headers)
+            samples.append((time.perf_counter() - start) * 1000)
+        received += len(res.content)
+        not_modified += res.status_code == 304
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    return requests / elapsed, received, not_modified, samples
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--path", default="/items/?limit=100")
+    parser.add_argument("--cookie", help="認証が必要な一覧用の access_token")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    cookies = {"access_token": args.cookie} if args.cookie else None
+    async with httpx.AsyncClient(base_url=args.url, cookies=cookies, timeout=60) as client:
+        for label, conditional in (("full", False), ("etag", True)):
+            rps, received, not_modified, samples = await poll(client, args.path, args.requests, args.concurrency, conditional)
+            print(
+                f"{label:<5} {rps:8.1f} req/s  body={received / 1024:.1f}KiB  304={not_modified}  "
+                f"p50={common.percentile(samples, 50):.1f}ms p99={common.percentile(samples, 99):.1f}ms"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
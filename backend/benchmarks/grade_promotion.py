@@ -0,0 +1,114 @@
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from . import common  # noqa: F401
+
+from sqlalchemy import create_engine, func, insert, select
+from sqlalchemy.orm import Session
+
+# 年度替わりの学年更新の比較
+# 検証用のデータベースに利用者を N 人作り、以前の実装（全件読み込み + Python のループ + 一括コミット）と
+# 主キー範囲ごとの CASE UPDATE とで、所要時間・Python 側のメモリ使用量・結果が同じかを比べる。
+# 使い方: python -m benchmarks.grade_promotion --users 100000 [--url mysql+pymysql://.../bench]
+# （--url を省略すると一時ファイルの SQLite を使う。指定したデータベースの user テーブルは作り直す）
+
+GRADES = ["U4", "M1", "M2", "OB_OG"]
+
+
+def seed(engine, users: int):
+    from app import models
+
+    table = models.User.__table__
+    table.drop(engine, checkfirst=True)
+    table.create(engine)
+    with engine.begin() as conn:
+        for start in range(0, users, 10000):
+            conn.execute(insert(table), [
+                {
+                    "name": f"user{i}",
+                    "email": f"user{i}@example.com",
+                    "grade": GRADES[i % 4],
+                    "password": "-",
+                    "is_admin": False,
+                    "is_active": i % 8 != 3,
+                }
+                for i in range(start, min(start + 10000, users))
+            ])
+
+
+def legacy(db):
+    # 変更前の promote_all_users_grades + deactivate_old_users
+    from app import models
+
+    for user in db.query(models.User).all():
+        if user.grade == models.GradeEnum.U4:
+            user.grade = models.GradeEnum.M1
+        elif user.grade == models.GradeEnum.M1:
+            user.grade = models.GradeEnum.M2
+        elif user.grade == models.GradeEnum.M2:
+            user.grade = models.GradeEnum.OB_OG
+    db.commit()
+    db.query(models.User).filter(
+        models.User.grade == models.GradeEnum.OB_OG, models.User.is_active == True
+    ).update({models.User.is_active: False}, synchronize_session=False)
+    db.commit()
+
+
+def chunked(db, chunk_size: int):
+    from app import crud
+
+    crud.promote_all_users_grades(db, chunk_size=chunk_size)
+
+
+def snapshot(engine):
+    from app import models
+
+    with engine.connect() as conn:
+        return conn.execute(
+            select(models.User.grade, models.User.is_active, func.count())
+            .group_by(models.User.grade, models.User.is_active)
+            .order_by(models.User.grade, models.User.is_active)
+        ).all()
+
+
+def run(engine, users: int, fn):
+    seed(engine, users)
+    with Session(engine) as db:
+        tracemalloc.start()
+        start = time.perf_counter()
+        fn(db)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return elapsed, peak, snapshot(engine)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--url", help="検証用データベースの URL（省略時は一時ファイルの SQLite）")
+    args = parser.parse_args()
+
+    path = None
+    if args.url is None:
+        path = os.path.join(tempfile.mkdtemp(), "grade_promotion.db")
+    engine = create_engine(args.url or f"sqlite:///{path}")
+
+    results = {}
+    for label, fn in (("legacy", legacy), ("chunked", lambda db: chunked(db, args.chunk_size))):
+        elapsed, peak, result = run(engine, args.users, fn)
+        results[label] = result
+        print(f"{label:<8} users={args.users} {elapsed:.2f}s  peak={peak / 1024 / 1024:.1f}MiB")
+
+    print("結果は一致しています" if results["legacy"] == results["chunked"] else f"結果が一致しません: {results}")
+    engine.dispose()
+    if path:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
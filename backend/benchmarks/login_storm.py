@@ -0,0 +1,66 @@
+import argparse
+import asyncio
+import time
+
+from . import common
+
+import httpx
+
+# ログイン集中時の負荷試験
+# 起動中の API に対してログインを同時に大量発行し、その間のログインと他のリクエスト（GET /）の遅延を測る。
+# 使い方: python -m benchmarks.login_storm --url http://localhost:8000 --email a@example.com --password pass
+
+
+async def storm(client, args, samples, failures):
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            res = await client.post("/login", json={"email": args.email, "password": args.password})
+            samples.append((time.perf_counter() - start) * 1000)
+            if res.status_code != 200:
+                failures[res.status_code] = failures.get(res.status_code, 0) + 1
+
+    await asyncio.gather(*(one() for _ in range(args.logins)))
+
+
+async def probe(client, samples, done):
+    # ログインの裏で軽いリクエストがどれだけ待たされるか
+    while not done.is_set():
+        start = time.perf_counter()
+        await client.get("/")
+        samples.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0.05)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--logins", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100)
+    args = parser.parse_args()
+
+    login_samples, probe_samples, failures = [], [], {}
+    done = asyncio.Event()
+    limits = httpx.Limits(max_connections=args.concurrency + 1)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=60) as client:
+        probe_task = asyncio.create_task(probe(client, probe_samples, done))
+        start = time.perf_counter()
+        await storm(client, args, login_samples, failures)
+        elapsed = time.perf_counter() - start
+        done.set()
+        await probe_task
+
+    print(f"logins: {args.logins / elapsed:.1f}/s failures={failures}")
+    for label, samples in (("login", login_samples), ("GET /", probe_samples)):
+        print(
+            f"{label:<6} p50={common.percentile(samples, 50):.1f}ms "
+            f"p95={common.percentile(samples, 95):.1f}ms p99={common.percentile(samples, 99):.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,118 @@
+import argparse
+import os
+import smtplib
+import threading
+import time
+from email.mime.text import MIMEText
+
+from . import common
+
+# メール送信キューの確認
+# ローカルに aiosmtpd の SMTP サーバーを立て、
+#   - 1 通ごとに接続して送る以前の方式（リクエストの中で送っていた処理）
+#   - app.mailer のキュー（接続を使い回してまとめて送る）
+# とで、呼び出し側の待ち時間と、全件届くまでの時間を比べる。
+# --fail-first N を付けると、サーバーが最初の N 通を一時エラー（451）で断り、再送を確認できる。
+# 使い方: python -m benchmarks.mailer --messages 200 [--latency 0.01] [--fail-first 3]
+# （aiosmtpd が必要: pip install -r benchmarks/requirements.txt）
+
+
+class Handler:
+    def __init__(self, latency: float, fail_first: int):
+        self.latency = latency
+        self.fail_first = fail_first
+        self.received = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    async def handle_DATA(self, server, session, envelope):
+        import asyncio
+
+        await asyncio.sleep(self.latency)
+        with self.lock:
+            if self.rejected < self.fail_first:
+                self.rejected += 1
+                return "451 Try again later"
+            self.received += 1
+        return "250 OK"
+
+
+def make_message(i: int):
+    message = MIMEText(f"benchmark message {i}", "plain", "utf-8")
+    message["Subject"] = f"benchmark {i}"
+    message["From"] = "noreply@example.com"
+    message["To"] = f"user{i}@example.com"
+    return message
+
+
+def send_inline(host: str, port: int, messages: int):
+    # 以前の send_reset_email と同じく、1 通ごとに接続して送る
+    samples = []
+    for i in range(messages):
+        start = time.perf_counter()
+        with smtplib.SMTP(host, port) as server:
+            server.ehlo()
+            server.send_message(make_message(i))
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def wait_until(predicate, timeout: float):
+    deadline = time.perf_counter() + timeout
+    while not predicate() and time.perf_counter() < deadline:
+        time.sleep(0.005)
+    return predicate()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0, help="サーバーが 1 通の受信にかける秒数")
+    parser.add_argument("--fail-first", type=int, default=0)
+    parser.add_argument("--port", type=int, default=8025)
+    args = parser.parse_args()
+
+    from aiosmtpd.controller import Controller
+
+    os.environ.update(
+        SMTP_SERVER="127.0.0.1",
+        SMTP_PORT=str(args.port),
+        SMTP_STARTTLS="false",
+        MAIL_RETRY_BACKOFF="0.05",
+        MAIL_QUEUE_MAX=str(max(args.messages, 1000)),
+    )
+    from app.mailer import Mailer
+
+    handler = Handler(args.latency, 0)
+    controller = Controller(handler, hostname="127.0.0.1", port=args.port)
+    controller.start()
+    try:
+        start = time.perf_counter()
+        samples = send_inline("127.0.0.1", args.port, args.messages)
+        total = time.perf_counter() - start
+        print(f"inline  caller {common.summarize(samples)}  all delivered in {total:.2f}s")
+
+        handler.received = 0
+        handler.fail_first = args.fail_first
+        mailer = Mailer()
+        mailer.start()
+        samples = []
+        start = time.perf_counter()
+        for i in range(args.messages):
+            t = time.perf_counter()
+            mailer.send(make_message(i))
+            samples.append((time.perf_counter() - t) * 1000)
+        delivered = wait_until(lambda: handler.received >= args.messages, 60)
+        total = time.perf_counter() - start
+        mailer.stop()
+        print(f"queued  caller {common.summarize(samples)}  all delivered in {total:.2f}s")
+        print(f"mailer  {mailer.stats()}")
+        if not delivered:
+            raise SystemExit(f"届いたのは {handler.received}/{args.messages} 通でした")
+        print(f"OK {handler.received} 通すべて届きました（一時エラー {handler.rejected} 回）")
+    finally:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    main()
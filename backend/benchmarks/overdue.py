@@ -0,0 +1,84 @@
+import argparse
+from datetime import datetime, timedelta
+
+from . import common
+
+from sqlalchemy import exists, func, select
+
+from app import migrations, models, overdue
+from app.database import SessionLocal, get_engine
+
+# 延滞検出の比較
+# benchmarks.seed で投入したデータベース（既定で 500 万件の取引）で、
+#   - 履歴（item_transaction）から、返却されていない承認済みの貸出のうち返却期限を過ぎたものを探す（処理位置を持たない方法）
+#   - app.overdue.run の初回（既に延滞しているものすべて）と、その後の実行（前回から今までの分だけ）
+#   - /overdue の問い合わせ
+# の時間を比べる。通知は数えるだけで、メールは送らない。
+# 処理位置（job_watermark）を書き換えるので、実行後は初回の状態に戻す。
+# 使い方: python -m benchmarks.overdue [--repeat 20] [--step-minutes 15]
+
+tx = models.ItemTransaction.__table__
+
+
+def overdue_from_history(db, now: datetime):
+    child = tx.alias("child")
+    return db.execute(
+        select(tx.c.item_id, tx.c.id, tx.c.user_id, tx.c.due_date)
+        .where(
+            tx.c.type == "borrow",
+            tx.c.status == "approved",
+            tx.c.due_date < now,
+            ~exists().where(child.c.related_transaction_id == tx.c.id, child.c.type == "return"),
+        )
+    ).all()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--step-minutes", type=int, default=15, help="2 回目以降の実行の間隔（OVERDUE_CHECK_MINUTES 相当）")
+    args = parser.parse_args()
+
+    migrations.upgrade(get_engine())
+    db = SessionLocal()
+    try:
+        transactions = db.execute(select(func.count()).select_from(tx)).scalar()
+        if not transactions:
+            raise SystemExit("データがありません。先に python -m benchmarks.seed を実行してください。")
+        now = datetime.now().replace(microsecond=0)
+        print(f"item_transaction {transactions} 件、今の貸出 {db.execute(select(func.count()).select_from(overdue.loan)).scalar()} 件")
+
+        samples = common.measure(lambda: overdue_from_history(db, now), args.repeat)
+        print(f"{'history scan':<18} {common.summarize(samples)}  延滞 {len(overdue_from_history(db, now))} 件")
+
+        notified = []
+
+        def count(rows):
+            notified.append(len(rows))
+            return True
+
+        db.execute(overdue.watermark.delete().where(overdue.watermark.c.name == overdue.WATERMARK))
+        db.commit()
+        first = overdue.run(db, now=now, notify=count)
+        print(f"{'run: first':<18} {first['elapsed_ms']}ms  延滞 {first['overdue']} 件 / 利用者 {first['users']} 人")
+
+        # 定期実行を模して、時刻を進めながら繰り返す（前回から今までに期限が来た分だけを読む）
+        samples = []
+        found = 0
+        for i in range(1, args.repeat + 1):
+            result = overdue.run(db, now=now + timedelta(minutes=args.step_minutes * i), notify=count)
+            samples.append(result["elapsed_ms"])
+            found += result["overdue"]
+        print(f"{'run: incremental':<18} {common.summarize(samples)}  新たな延滞 {found} 件")
+        print(f"通知 {len(notified)} 通（{sum(notified)} 件の貸出）")
+
+        samples = common.measure(lambda: db.execute(overdue.overdue_statement(now, limit=100)).all(), args.repeat)
+        print(f"{'/overdue (100 件)':<18} {common.summarize(samples)}")
+    finally:
+        db.execute(overdue.watermark.delete().where(overdue.watermark.c.name == overdue.WATERMARK))
+        db.commit()
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import argparse
+
+from . import common  # noqa: F401  環境変数の既定値を先に設定する
+
+from sqlalchemy import func, insert
+
+from app import crud, models, pagination
+from app.database import SessionLocal, get_engine
+
+# OFFSET ページングとカーソルページングの比較
+# 使い方（backend ディレクトリで、使い捨てのデータベースに向けて実行すること）:
+#   python -m benchmarks.pagination --seed --pages 10000 --limit 100
+
+
+def seed(db, rows: int, batch: int = 10000):
+    if db.query(models.User).first() is None:
+        db.add(models.User(name="bench", email="bench@example.com", grade=models.GradeEnum.M1, password="x"))
+    if db.query(models.Item).first() is None:
+        db.add(models.Item(name="bench-item"))
+    db.commit()
+    user_id = db.query(models.User.id).scalar()
+    item_id = db.query(models.Item.id).scalar()
+
+    existing = db.query(func.count(models.ItemTransaction.id)).scalar()
+    for start in range(existing, rows, batch):
+        size = min(batch, rows - start)
+        db.execute(
+            insert(models.ItemTransaction),
+            [{"item_id": item_id, "user_id": user_id, "type": "borrow", "status": "returned"} for _ in range(size)],
+        )
+        db.commit()
+        print(f"seeded {start + size}/{rows}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seed", action="store_true", help="足りない分の取引履歴を投入する")
+    parser.add_argument("--pages", type=int, default=10000)
+    parser.add_argument("--limit", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    models.Base.metadata.create_all(bind=get_engine())
+    db = SessionLocal()
+    try:
+        if args.seed:
+            seed(db, args.pages * args.limit)
+
+        # 最終ページ直前の行の id を求めてカーソルを作る（計測には含めない）
+        deep_skip = (args.pages - 1) * args.limit
+        anchor = db.query(models.ItemTransaction.id).order_by(models.ItemTransaction.id).offset(deep_skip - 1).limit(1).scalar()
+        if anchor is None:
+            raise SystemExit("データが足りません。--seed を付けて実行してください。")
+        deep_cursor = pagination.encode_cursor("id", "asc", anchor, anchor)
+
+        cases = [
+            ("offset page 1", lambda: crud.get_transactions(db, skip=0, limit=args.limit)),
+            (f"offset page {args.pages}", lambda: crud.get_transactions(db, skip=deep_skip, limit=args.limit)),
+            ("cursor page 1", lambda: crud.get_transactions(db, limit=args.limit, cursor="")),
+            (f"cursor page {args.pages}", lambda: crud.get_transactions(db, limit=args.limit, cursor=deep_cursor)),
+        ]
+        for label, fn in cases:
+            fn()  # ウォームアップ
+            samples = common.measure(lambda: (fn(), db.expunge_all()), args.repeat)
+            print(f"{label:<24} {common.summarize(samples)}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+import argparse
+
+from . import common
+
+import httpx
+
+# 部分取得（fields / expand）の効果測定
+# 同じページを全項目で取得した場合と、一覧表示に必要な項目だけに絞った場合とで、
+# レスポンスの大きさとレイテンシを比べる。
+# 使い方: python -m benchmarks.payload --url http://localhost:8000 --cookie <access_token> --limit 1000
+
+CASES = [
+    ("items full", "/items/", {}),
+    ("items fields", "/items/", {"fields": "id,name,is_available,location"}),
+    ("items fields+category", "/items/", {"fields": "id,name,is_available,location", "expand": "category"}),
+    ("transactions full", "/transactions/", {}),
+    ("transactions fields", "/transactions/", {"fields": "id,status,type,transaction_date"}),
+    ("transactions fields+item,user", "/transactions/", {"fields": "id,status,type,transaction_date", "expand": "item,user"}),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--cookie", help="認証が必要な一覧用の access_token")
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    cookies = {"access_token": args.cookie} if args.cookie else None
+    with httpx.Client(base_url=args.url, cookies=cookies, timeout=60) as client:
+        for label, path, params in CASES:
+            params = {**params, "limit": args.limit}
+            res = client.get(path, params=params)
+            if res.status_code != 200:
+                print(f"{label:<30} SKIP ({res.status_code})")
+                continue
+            samples = common.measure(lambda: client.get(path, params=params), args.repeat)
+            print(
+                f"{label:<30} rows={len(res.json()):<5} body={len(res.content) / 1024:8.1f}KiB  "
+                f"{common.summarize(samples)}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import argparse
+import sys
+
+from . import common  # noqa: F401
+
+import httpx
+
+from app import metrics
+from tests.query_budgets import BUDGETS
+
+# エンドポイントごとの SQL 実行回数の上限チェック
+# サーバーの Server-Timing ヘッダ（METRICS_SERVER_TIMING=1 で起動）から 1 リクエストの
+# クエリ数を読み、上限を超えたものがあれば終了コード 1 で終わる。
+# 一覧の件数を増やしてもクエリ数が増えないこと（N+1 が無いこと）を CI などで確認する。
+# 使い方: python -m benchmarks.query_budget --url http://localhost:8000 --cookie <access_token>
+
+# 上限の表は tests/query_budgets.py（tests/test_query_budget.py と同じ表で確かめる）
+
+
+def query_count(response) -> int:
+    count = metrics.query_count_from_header(response.headers.get("server-timing"))
+    if count is None:
+        raise SystemExit("Server-Timing ヘッダがありません。METRICS_SERVER_TIMING=1 でサーバーを起動してください")
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--cookie", help="認証が必要なエンドポイント用の access_token")
+    args = parser.parse_args()
+
+    cookies = {"access_token": args.cookie} if args.cookie else None
+    failed = 0
+    with httpx.Client(base_url=args.url, cookies=cookies, timeout=60) as client:
+        items = client.get("/items/?limit=1").json()
+        item_id = items[0]["id"] if items else 1
+        for path, budget in BUDGETS:
+            path = path.format(item_id=item_id)
+            res = client.get(path)
+            if res.status_code >= 400:
+                print(f"SKIP {path} ({res.status_code})")
+                continue
+            count = query_count(res)
+            ok = count <= budget
+            failed += not ok
+            rows = len(res.json()) if isinstance(res.json(), list) else 1
+            print(f"{'OK  ' if ok else 'OVER'} {path:<36} queries={count:<3} budget={budget:<3} rows={rows}")
+
+    if failed:
+        print(f"{failed} 件のエンドポイントが上限を超えました")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
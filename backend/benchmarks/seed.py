@@ -0,0 +1,193 @@
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from . import common  # noqa: F401  環境変数の既定値を先に設定する
+
+from sqlalchemy import delete, func, insert, select
+
+from app import hashing, loans, migrations, models, stats, versioning
+from app.database import SessionLocal, get_engine
+
+# ベンチマーク用のデータ投入
+# DATABASE_URL のデータベースに、実運用に近い件数のデータをまとめて INSERT する。
+# 同じ --seed なら同じデータになるので、変更の前後で同じ条件の計測ができる。
+# 使い方（backend ディレクトリで、使い捨てのデータベースに向けて実行すること）:
+#   python -m benchmarks.seed --reset --items 50000 --categories 200 --users 5000 --transactions 5000000
+# 管理者 bench-admin@example.com / 利用者 user{n}@bench.example のパスワードはどちらも "benchmark"。
+# --reset は対象データベースの全テーブルの行を消す。
+
+PASSWORD = "benchmark"
+ADMIN_EMAIL = "bench-admin@example.com"
+
+WORDS = [
+    "ノートPC", "モニター", "プロジェクター", "HDMIケーブル", "USBハブ", "キーボード", "マウス", "タブレット",
+    "デジタルカメラ", "三脚", "マイク", "スピーカー", "延長コード", "ホワイトボード", "ルーター",
+    "laptop", "monitor", "camera", "oscilloscope", "multimeter", "soldering iron", "raspberry pi", "arduino",
+]
+MAKERS = ["Canon", "Sony", "Dell", "Lenovo", "Apple", "Logicool", "Panasonic", "Fluke", "Keysight", "ELECOM"]
+LOCATIONS = [f"{building}-{room}" for building in ("A", "B", "C", "D") for room in (101, 102, 201, 202, 301)]
+GRADES = ["U4", "M1", "M2", "OB_OG"]
+KEYWORDS = WORDS + MAKERS + ["ケーブル", "カメラ", "PC", "hdmi", "usb", "電源", "充電器"]
+
+# 取引の時期（直近 3 年に散らす）
+PERIOD = timedelta(days=3 * 365)
+# 貸出の返却期限（カテゴリの貸出期間は設定しないので、既定の期間と同じ）
+LOAN_PERIOD = timedelta(days=14)
+
+
+def insert_rows(conn, table, rows, batch: int, label: str):
+    start = time.perf_counter()
+    buffer = []
+    count = 0
+    for row in rows:
+        buffer.append(row)
+        if len(buffer) >= batch:
+            conn.execute(insert(table), buffer)
+            count += len(buffer)
+            buffer = []
+            if count % (batch * 50) == 0:
+                print(f"  {label}: {count} 件 ({count / (time.perf_counter() - start):.0f} 件/秒)")
+    if buffer:
+        conn.execute(insert(table), buffer)
+        count += len(buffer)
+    elapsed = time.perf_counter() - start
+    print(f"{label}: {count} 件 {elapsed:.1f}s ({count / elapsed if elapsed else 0:.0f} 件/秒)")
+
+
+def reset(engine):
+    with engine.begin() as conn:
+        for model in (models.SearchLog, models.ItemCurrentLoan, models.ItemTransactionArchive, models.ItemTransaction, models.Item, models.Category, models.User,
+                      models.CategoryStat, models.TableVersion, models.JobWatermark, models.OverdueNotificationRetry):
+            conn.execute(delete(model.__table__))
+
+
+def seed(engine, args):
+    rng = random.Random(args.seed)
+    now = datetime.now().replace(microsecond=0)
+    origin = now - PERIOD
+    # bcrypt は 1 件ごとに計算すると遅いので、全員同じハッシュにする
+    hashed = hashing.hash_password(PASSWORD)
+
+    with engine.begin() as conn:
+        insert_rows(conn, models.Category.__table__, (
+            {"id": i, "name": f"category-{i:03d}"} for i in range(1, args.categories + 1)
+        ), args.batch, "category")
+
+        insert_rows(conn, models.User.__table__, (
+            {
+                "id": i,
+                "name": "bench-admin" if i == 1 else f"user{i}",
+                "email": ADMIN_EMAIL if i == 1 else f"user{i}@bench.example",
+                "grade": GRADES[i % len(GRADES)],
+                "password": hashed,
+                "is_admin": i == 1,
+                "is_active": i == 1 or i % 10 != 0,
+            }
+            for i in range(1, args.users + 1)
+        ), args.batch, "user")
+
+        # 一部の物品は最後の取引が貸出中（承認済み・申請中）
+        on_loan = set(rng.sample(range(1, args.items + 1), args.items // 10)) if args.items else set()
+
+        def items():
+            for i in range(1, args.items + 1):
+                word = rng.choice(WORDS)
+                yield {
+                    "id": i,
+                    "name": f"{rng.choice(MAKERS)} {word} {i}",
+                    "category_id": rng.randint(1, args.categories) if args.categories and rng.random() > 0.05 else None,
+                    "is_available": i not in on_loan,
+                    "location": rng.choice(LOCATIONS),
+                    "notes": f"{word} の備品です。" * rng.randint(1, 8) if rng.random() < 0.5 else None,
+                    "registration_date": origin + timedelta(seconds=rng.randrange(int(PERIOD.total_seconds()))),
+                }
+
+        insert_rows(conn, models.Item.__table__, items(), args.batch, "item")
+
+        def transactions():
+            # 過去の取引（返却済み・却下）を古い順に並べ、最後に貸出中の分を付け足す
+            step = PERIOD.total_seconds() / max(args.transactions, 1)
+            for i in range(args.transactions):
+                transaction_date = origin + timedelta(seconds=int(i * step))
+                status = "rejected" if rng.random() < 0.03 else "returned"
+                # 却下はその日のうちに、返却は貸出期間の中のどこかで
+                closed_at = transaction_date + (timedelta(hours=1) if status == "rejected" else LOAN_PERIOD * rng.random())
+                yield {
+                    "item_id": rng.randint(1, args.items),
+                    "user_id": rng.randint(1, args.users),
+                    "type": "borrow",
+                    "status": status,
+                    "transaction_date": transaction_date,
+                    "due_date": transaction_date + LOAN_PERIOD,
+                    "closed_at": min(closed_at, now),
+                    "reason": "研究で使用" if rng.random() < 0.3 else None,
+                }
+            for item_id in sorted(on_loan):
+                transaction_date = now - timedelta(days=rng.randint(0, 30))
+                status = "request" if rng.random() < 0.2 else "approved"
+                yield {
+                    "item_id": item_id,
+                    "user_id": rng.randint(1, args.users),
+                    "type": "borrow",
+                    "status": status,
+                    "transaction_date": transaction_date,
+                    # 返却期限は承認したときに決まる（申請中は NULL）
+                    "due_date": transaction_date + LOAN_PERIOD if status == "approved" else None,
+                    "closed_at": None,
+                    "reason": None,
+                }
+
+        if args.items and args.users:
+            insert_rows(conn, models.ItemTransaction.__table__, transactions(), args.batch, "item_transaction")
+
+        def search_logs():
+            step = PERIOD.total_seconds() / max(args.search_logs, 1)
+            for i in range(args.search_logs):
+                yield {
+                    "user_id": rng.randint(1, args.users) if args.users else None,
+                    # よく検索される語に偏らせる
+                    "search_keyword": KEYWORDS[min(int(rng.paretovariate(1.2)) - 1, len(KEYWORDS) - 1)],
+                    "searched_at": origin + timedelta(seconds=int(i * step)),
+                }
+
+        insert_rows(conn, models.SearchLog.__table__, search_logs(), args.batch, "search_log")
+
+    db = SessionLocal()
+    try:
+        stats.rebuild(db)
+        loans.rebuild(db)
+        versioning.bump(db, "item", "category")
+        db.commit()
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=50000)
+    parser.add_argument("--categories", type=int, default=200)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--transactions", type=int, default=5000000)
+    parser.add_argument("--search-logs", type=int, default=100000)
+    parser.add_argument("--batch", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reset", action="store_true", help="投入前に全テーブルの行を消す")
+    args = parser.parse_args()
+
+    engine = get_engine()
+    migrations.upgrade(engine)
+    if args.reset:
+        reset(engine)
+    with engine.connect() as conn:
+        if conn.execute(select(func.count()).select_from(models.User.__table__)).scalar():
+            raise SystemExit("データが既にあります。作り直すときは --reset を付けてください。")
+
+    start = time.perf_counter()
+    seed(engine, args)
+    print(f"完了 ({time.perf_counter() - start:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from . import common
+
+import httpx
+
+# 起動時間の計測
+# 1. `import app.main` にかかる時間（新しいプロセスで毎回計測）
+# 2. uvicorn を起動してから最初のリクエストに応答するまでの時間
+# 使い方: python -m benchmarks.startup --repeat 5
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import app.main; print(time.perf_counter() - t)"
+
+
+def measure_import() -> float:
+    out = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET], cwd=BACKEND_DIR, env=os.environ.copy(),
+        capture_output=True, text=True, check=True,
+    )
+    return float(out.stdout.strip().splitlines()[-1]) * 1000
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def measure_first_request(timeout: float = 60) -> float:
+    port = _free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=os.environ.copy(),
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/", timeout=0.5).status_code == 200:
+                    return (time.perf_counter() - start) * 1000
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.01)
+        raise SystemExit("サーバーが起動しませんでした")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    imports = [measure_import() for _ in range(args.repeat)]
+    first_requests = [measure_first_request() for _ in range(args.repeat)]
+    print(f"import app.main      {common.summarize(imports)}")
+    print(f"time to first request {common.summarize(first_requests)}")
+
+
+if __name__ == "__main__":
+    main()
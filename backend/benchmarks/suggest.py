@@ -0,0 +1,127 @@
+import argparse
+import asyncio
+import os
+import random
+import time
+import tracemalloc
+from collections import defaultdict
+
+from . import common
+from .seed import ADMIN_EMAIL, PASSWORD
+
+os.environ.setdefault("METRICS_SERVER_TIMING", "1")  # サーバー側の処理時間を Server-Timing ヘッダから読む
+
+import httpx
+from sqlalchemy import func, select
+
+from app import models, suggest
+from app.database import SessionLocal
+
+# 検索候補の確認
+# benchmarks.seed で投入したデータベースで、
+#   - 人気の検索語を search_log の GROUP BY で求める場合の時間（以前ならこうするしかなかった）
+#   - app.suggest の索引を作る時間・メモリ、1 回の問い合わせの時間（関数の直接呼び出しと /suggest の Server-Timing）
+#   - heavy hitters の上位 10 語が、全件から正確に数えた減衰つき回数の上位 10 語とどれだけ一致するか
+# を表示する。
+# 使い方: python -m benchmarks.suggest [--queries 2000] [--capacity 1000]
+
+PREFIXES = ["", "s", "so", "son", "sony", "ノ", "ノート", "ノートpc", "c", "ca", "cam", "ケーブル", "usb", "hd", "x", "raspberry p", "1", "12"]
+
+
+def popular_by_group_by(db, limit: int = 10):
+    table = models.SearchLog.__table__
+    return db.execute(
+        select(table.c.search_keyword, func.count().label("n"))
+        .group_by(table.c.search_keyword)
+        .order_by(func.count().desc())
+        .limit(limit)
+    ).all()
+
+
+def exact_top(db, half_life: float, now: float, limit: int = 10):
+    # 全件を読んで、減衰つきの回数を正確に数える（答え合わせ用）
+    counts = defaultdict(float)
+    table = models.SearchLog.__table__
+    for keyword, searched_at in db.execute(select(table.c.search_keyword, table.c.searched_at)):
+        counts[suggest.normalize(keyword)] += 2.0 ** (-(now - searched_at.timestamp()) / half_life)
+    return [keyword for keyword, _ in sorted(counts.items(), key=lambda item: -item[1])[:limit]]
+
+
+async def http_server_times(queries: int, rng: random.Random):
+    from app.main import app
+
+    samples = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        res = await client.post("/login", json={"email": ADMIN_EMAIL, "password": PASSWORD})
+        if res.status_code != 200:
+            raise SystemExit(f"ログインできませんでした: {res.status_code} {res.text}")
+        for _ in range(queries):
+            res = await client.get("/suggest", params={"q": rng.choice(PREFIXES), "limit": 10})
+            res.raise_for_status()
+            timing = res.headers.get("server-timing", "")
+            samples.append(float(timing.split("app;dur=")[1].split(",")[0]))
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--capacity", type=int)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        logs = db.execute(select(func.count()).select_from(models.SearchLog)).scalar()
+        if not logs:
+            raise SystemExit("検索ログがありません。先に python -m benchmarks.seed を実行してください。")
+        samples = common.measure(lambda: popular_by_group_by(db), 5)
+        print(f"search_log {logs} 件")
+        print(f"GROUP BY   {common.summarize(samples)}")
+    finally:
+        db.close()
+
+    tracemalloc.start()
+    suggester = suggest.Suggester(capacity=args.capacity)
+    # /suggest が使うのも、このインスタンスにする
+    suggest._suggester = suggester
+    start = time.perf_counter()
+    suggester.refresh()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"build      {elapsed * 1000:.1f}ms  peak={peak / 1024 / 1024:.1f}MiB  {suggester.stats()}")
+
+    start = time.perf_counter()
+    suggester.refresh()
+    print(f"refresh    {(time.perf_counter() - start) * 1000:.1f}ms（新しいログなし）")
+
+    rng = random.Random(args.seed)
+    samples = []
+    for _ in range(args.queries):
+        prefix = rng.choice(PREFIXES)
+        t = time.perf_counter()
+        suggester.suggest(prefix, 10)
+        samples.append((time.perf_counter() - t) * 1000)
+    print(f"suggest()  {common.summarize(samples)}")
+
+    samples = asyncio.run(http_server_times(args.queries, rng))
+    print(f"/suggest   server {common.summarize(samples)}")
+
+    for prefix in ("", "son", "ノート"):
+        print(f"  {prefix!r:<10} {suggester.suggest(prefix, 5)}")
+
+    db = SessionLocal()
+    try:
+        expected = exact_top(db, suggester.half_life, time.time())
+    finally:
+        db.close()
+    got = suggester.suggest("", 10)["keywords"]
+    print(f"上位 10 語の一致 {len(set(expected) & set(got))}/10")
+    print(f"  正確な値 {expected}")
+    print(f"  推定     {got}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import os
+import tempfile
+import uuid
+
+# テストは一時ディレクトリの SQLite で動かす（app を import する前に設定しておく）
+_tmp = tempfile.mkdtemp(prefix="inventorize-test-")
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{_tmp}/test.db",
+    ASYNC_DATABASE_URL=f"sqlite+aiosqlite:///{_tmp}/test.db",
+    SECRET_KEY="test-secret",
+    ALGORITHM="HS256",
+    ACCESS_TOKEN_EXPIRE_MINUTES="60",
+    BCRYPT_ROUNDS="4",
+    FRONTEND_URL="http://frontend.test",
+    IMAGE_DIR=os.path.join(_tmp, "images"),
+    METRICS_SERVER_TIMING="1",
+)
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app import migrations  # noqa: E402
+from app.database import SessionLocal, get_engine  # noqa: E402
+
+ADMIN = {"name": "admin", "email": "admin@example.com", "grade": "M1", "password": "admin-pw", "is_admin": True}
+
+
+def unique(prefix: str) -> str:
+    return f"{prefix}-{uuid.uuid4().hex[:8]}"
+
+
+@pytest.fixture(scope="session")
+def client():
+    # データベースとアプリはテスト全体で 1 つ。テストごとに名前の違うデータを作って使う
+    migrations.upgrade(get_engine())
+    from app.main import app
+
+    with TestClient(app) as client:
+        assert client.post("/users/", json=ADMIN).status_code == 200
+        assert client.post("/login", json={"email": ADMIN["email"], "password": ADMIN["password"]}).status_code == 200
+        yield client
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def me(client):
+    return client.get("/me").json()
+
+
+@pytest.fixture
+def category(client):
+    return client.post("/categories/", json={"name": unique("category")}).json()
+
+
+@pytest.fixture
+def make_item(client, category):
+    def make(**fields):
+        body = {"name": unique("item"), "category_id": category["id"], **fields}
+        res = client.post("/items/", json=body)
+        assert res.status_code == 200, res.text
+        return res.json()
+    return make
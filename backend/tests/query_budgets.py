@@ -0,0 +1,16 @@
+# エンドポイントごとの SQL 実行回数の上限（tests/test_query_budget.py と benchmarks/query_budget.py が使う）
+# (パス, 上限)。認証の確認（ユーザーキャッシュに無いとき 1 回）と ETag の確認を含む
+# 取引の一覧は既定では item_transaction だけを読む。include_archive=true のときはアーカイブの範囲の確認が 1 回と、
+# 取引・アーカイブの 2 文
+BUDGETS = [
+    ("/items/?limit=100", 2),
+    ("/items/?limit=100&cursor=", 2),
+    ("/items/?limit=100&name=pc", 2),
+    ("/items/{item_id}", 3),
+    ("/categories/?limit=100", 3),
+    ("/transactions/?limit=100", 2),
+    ("/transactions/?limit=100&cursor=", 2),
+    ("/transactions/?limit=100&include_archive=true", 4),
+    ("/transactions/?limit=100&status=request", 2),
+    ("/stats/categories", 3),
+]
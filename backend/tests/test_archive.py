@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, update
+
+from app import archive, crud, lease, models, pagination
+
+from .conftest import unique
+
+
+def borrow(client, me, item):
+    return client.post("/transactions/", json={"item_id": item["id"], "user_id": me["id"], "type": "borrow"})
+
+
+def test_history_merges_archive_in_id_order(client, db, me, make_item):
+    # 古い取引（アーカイブに移る）と新しい取引を交互に作り、移したあとも id 順に 1 本の履歴として読めること
+    item = make_item()
+    old = datetime(2000, 1, 1)
+    now = datetime.now()
+    ids = []
+    for i in range(8):
+        date = old + timedelta(days=i) if i % 2 == 0 else now
+        result = db.execute(insert(models.ItemTransaction).values(
+            item_id=item["id"], user_id=me["id"], type="borrow", status="returned", transaction_date=date, closed_at=date,
+        ))
+        ids.append(result.inserted_primary_key[0])
+    db.commit()
+
+    below_id = None
+    while True:
+        below_id, _ = archive.archive_batch(db, before=datetime(2001, 1, 1), batch_size=3, below_id=below_id)
+        if below_id is None:
+            break
+    archived = set(db.query(models.ItemTransactionArchive.id).filter(models.ItemTransactionArchive.item_id == item["id"]).all())
+    assert {row[0] for row in archived} == set(ids[0::2])
+
+    history = crud.get_transactions(db, item_id=item["id"], limit=100, include_archive=True)
+    assert [tx.id for tx in history] == ids
+    # 既定では item_transaction だけを読む
+    assert [tx.id for tx in crud.get_transactions(db, item_id=item["id"], limit=100)] == ids[1::2]
+
+    # ページングしても順序と件数が崩れない
+    assert [tx.id for tx in crud.get_transactions(db, item_id=item["id"], skip=2, limit=3, include_archive=True)] == ids[2:5]
+    pages, cursor = [], ""
+    while True:
+        page = crud.get_transactions(db, item_id=item["id"], limit=3, cursor=cursor, include_archive=True)
+        pages += [tx.id for tx in page]
+        if len(page) < 3:
+            break
+        cursor = pagination.next_cursor(page, "id", "asc", 3)
+    assert pages == ids
+
+
+def test_archive_by_completion_time(client, db, me, make_item):
+    # 借りたのは昔でも、返したのが最近なら移さない
+    item = make_item()
+    long_loan = borrow(client, me, item).json()
+    db.execute(update(models.ItemTransaction).where(models.ItemTransaction.id == long_loan["id"]).values(transaction_date=datetime(2000, 1, 1)))
+    db.commit()
+    assert client.patch(f"/transactions/{long_loan['id']}", params={"status": "approved"}).status_code == 200
+    assert client.post(f"/return/{long_loan['id']}").status_code == 200
+
+    archive.run(db, after_days=30, pause=0, log=lambda message: None)
+    assert db.get(models.ItemTransaction, long_loan["id"]).closed_at is not None
+    assert db.get(models.ItemTransactionArchive, long_loan["id"]) is None
+
+    # 完了してから日数がたてば移す
+    db.execute(update(models.ItemTransaction).where(models.ItemTransaction.id == long_loan["id"]).values(closed_at=datetime.now() - timedelta(days=31)))
+    db.commit()
+    archive.run(db, after_days=30, pause=0, log=lambda message: None)
+    assert db.get(models.ItemTransactionArchive, long_loan["id"]) is not None
+
+
+def test_backfill_closed_at(client, db, me, make_item):
+    # 返却の取引があればその日時、なければ今の日時を完了した日時にする
+    item = make_item()
+    returned_at = datetime(2001, 2, 3)
+    rows = [
+        {"status": "returned", "transaction_date": datetime(2001, 1, 1)},
+        {"status": "rejected", "transaction_date": datetime(2001, 1, 1)},
+        {"status": "approved", "transaction_date": datetime(2001, 1, 1)},
+    ]
+    ids = [db.execute(insert(models.ItemTransaction).values(item_id=item["id"], user_id=me["id"], type="borrow", **row)).inserted_primary_key[0] for row in rows]
+    db.execute(insert(models.ItemTransaction).values(
+        item_id=item["id"], user_id=me["id"], type="return", related_transaction_id=ids[0], transaction_date=returned_at,
+    ))
+    db.commit()
+
+    now = datetime(2030, 1, 1)
+    archive.backfill_closed_at(db, now=now)
+    assert [db.get(models.ItemTransaction, tx_id).closed_at for tx_id in ids] == [returned_at, now, None]
+
+
+def test_job_lease(db):
+    job = unique("job")
+    now = datetime(2030, 1, 1, 12, 0, 0)
+    expires = lease.acquire(db, job, 60, now=now)
+    assert expires == now + timedelta(seconds=60)
+    # 期限までは他のワーカーは取れない
+    assert lease.acquire(db, job, 60, now=now + timedelta(seconds=30)) is None
+    # 期限が過ぎれば取り直せ、取り直されたあとの release は何もしない
+    again = lease.acquire(db, job, 60, now=now + timedelta(seconds=61))
+    assert again is not None
+    lease.release(db, job, expires)
+    assert lease.acquire(db, job, 60, now=now + timedelta(seconds=90)) is None
+    lease.release(db, job, again)
+    assert lease.acquire(db, job, 60) is not None
@@ -0,0 +1,50 @@
+from .conftest import unique
+
+
+def etag_of(client, path):
+    res = client.get(path)
+    assert res.status_code == 200, res.text
+    return res.headers["etag"]
+
+
+def assert_not_modified(client, path, etag, if_none_match=None):
+    res = client.get(path, headers={"If-None-Match": if_none_match or etag})
+    assert res.status_code == 304
+    assert res.headers["etag"] == etag
+    assert res.content == b""
+
+
+def test_if_none_match_and_fresh_etag_after_writes(client, me, make_item):
+    item = make_item()
+    path = "/items/?limit=5"
+    etag = etag_of(client, path)
+    assert_not_modified(client, path, etag)
+    # 弱い比較・複数指定
+    assert_not_modified(client, path, etag, f'"other", W/{etag}')
+    assert client.get(path, headers={"If-None-Match": '"other"'}).status_code == 200
+
+    # 貸出（物品 id で分けたカウンタが進む）
+    tx = client.post("/transactions/", json={"item_id": item["id"], "user_id": me["id"], "type": "borrow"}).json()
+    after_borrow = etag_of(client, path)
+    assert after_borrow != etag
+    assert client.get(path, headers={"If-None-Match": etag}).status_code == 200
+
+    # 返却（分割したカウンタ）と管理者の変更（テーブル全体のカウンタ）
+    assert client.post(f"/return/{tx['id']}").status_code == 200
+    after_return = etag_of(client, path)
+    assert after_return not in (etag, after_borrow)
+    assert client.put(f"/items/{item['id']}", json={"location": unique("shelf")}).status_code == 200
+    after_edit = etag_of(client, path)
+    assert after_edit not in (etag, after_borrow, after_return)
+    assert_not_modified(client, path, after_edit)
+
+    # URL（クエリ）が違えば ETag も違う
+    assert etag_of(client, "/items/?limit=6") != after_edit
+
+
+def test_category_list_etag(client):
+    path = "/categories/?limit=100"
+    etag = etag_of(client, path)
+    assert_not_modified(client, path, etag)
+    client.post("/categories/", json={"name": unique("category")})
+    assert client.get(path, headers={"If-None-Match": etag}).status_code == 200
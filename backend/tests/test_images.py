@@ -0,0 +1,83 @@
+import glob
+import hashlib
+import io
+import os
+import time
+
+from PIL import Image
+
+from app import images
+from app.config import get_settings
+
+
+def png(width=64, height=48, color=(200, 30, 30)) -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", (width, height), color).save(out, "PNG")
+    return out.getvalue()
+
+
+def upload(client, item, data, name="photo.png"):
+    return client.post(f"/items/{item['id']}/image", files={"file": (name, data, "application/octet-stream")})
+
+
+def test_upload_dedup_and_variant_urls(client, make_item):
+    data = png(color=(10, 20, 30))
+    digest = hashlib.sha256(data).hexdigest()
+    first, second = make_item(), make_item()
+
+    res = upload(client, first, data)
+    assert res.status_code == 200, res.text
+    body = res.json()
+    assert body["image_path"] == digest
+    base = get_settings().backend_url.rstrip("/")
+    assert body["thumbnail_url"] == f"{base}/images/{digest}/thumb"
+    assert body["image_url"] == f"{base}/images/{digest}/large"
+
+    # 同じ内容の画像は保存済みのものを使う（ファイルは 1 つ）
+    deduplicated = images.stats()["deduplicated"]
+    res = upload(client, second, data, name="copy.png")
+    assert res.json()["image_path"] == digest
+    assert images.stats()["deduplicated"] == deduplicated + 1
+    assert os.path.exists(images.variant_path(digest, "original"))
+    assert glob.glob(os.path.join(get_settings().image_dir, ".upload-*")) == []
+
+
+def test_variants_are_served_once_rendered(client, make_item):
+    data = png(width=2000, height=1000, color=(0, 90, 200))
+    digest = upload(client, make_item(), data).json()["image_path"]
+
+    deadline = time.monotonic() + 60
+    while not all(os.path.exists(images.variant_path(digest, variant)) for variant in images.VARIANTS):
+        assert time.monotonic() < deadline, images.stats()
+        time.sleep(0.05)
+
+    res = client.get(f"/images/{digest}/thumb")
+    assert res.status_code == 200
+    assert res.headers["content-type"] == "image/webp"
+    assert "immutable" in res.headers["cache-control"]
+    with Image.open(io.BytesIO(res.content)) as thumb:
+        assert max(thumb.size) == get_settings().image_thumb_size
+    assert client.get(f"/images/{digest}/thumb", headers={"If-None-Match": res.headers["etag"]}).status_code == 304
+
+    res = client.get(f"/images/{digest}/original")
+    assert res.headers["content-type"] == "image/png"
+    assert res.content == data
+
+    assert client.get(f"/images/{digest}/huge").status_code == 404
+    assert client.get("/images/not-a-digest/thumb").status_code == 404
+
+
+def test_upload_rejects_large_and_non_images(client, make_item, monkeypatch):
+    item = make_item()
+    # 拡張子ではなく中身で判定する
+    res = upload(client, item, b"%PDF-1.4 not an image", name="fake.png")
+    assert res.status_code == 415
+    assert upload(client, item, b"", name="empty.png").status_code == 415
+
+    data = png()
+    monkeypatch.setattr(get_settings(), "image_max_bytes", len(data) - 1)
+    assert upload(client, item, data).status_code == 413
+    monkeypatch.undo()
+
+    assert client.get(f"/items/{item['id']}").json()["image_path"] is None
+    assert glob.glob(os.path.join(get_settings().image_dir, ".upload-*")) == []
@@ -0,0 +1,59 @@
+import csv
+
+from .conftest import unique
+
+
+def test_cursor_pagination_round_trip(client, make_item):
+    prefix = unique("page")
+    created = [make_item(name=f"{prefix}-{i}", location=None if i % 2 else "shelf")["id"] for i in range(7)]
+
+    for sort_by, order in (("id", "asc"), ("location", "desc"), ("name", "desc")):
+        seen = []
+        cursor = ""
+        while cursor is not None:
+            res = client.get("/items/", params={"name": prefix, "limit": 3, "cursor": cursor, "sort_by": sort_by, "sort_order": order})
+            assert res.status_code == 200, res.text
+            seen += [item["id"] for item in res.json()]
+            cursor = res.headers.get("x-next-cursor")
+        # 重複も抜けもなく、すべての物品を 1 回ずつ返す
+        assert sorted(seen) == sorted(created), (sort_by, order)
+        assert len(seen) == len(created)
+
+
+def test_invalid_cursor(client):
+    assert client.get("/items/", params={"cursor": "not-a-cursor"}).status_code == 400
+
+
+def test_import_csv_errors(client, category):
+    existing = client.post("/items/", json={"name": unique("existing")}).json()
+    fresh = unique("fresh")
+    csv_data = (
+        "name,category,is_available,location\n"
+        f"{fresh},{category['name']},,A\n"       # 2: 登録（空の is_available は既定値）
+        f"{unique('x')},no-such-category,true,\n"  # 3: カテゴリがない
+        ",,true,\n"                                 # 4: 名前がない
+        f"{fresh},,true,\n"                         # 5: ファイル内で重複
+        f"{existing['name']},,true,\n"              # 6: 登録済み
+        f"{unique('x')},,maybe,\n"                  # 7: 真偽値でない
+    )
+    res = client.post("/items/import", files={"file": ("items.csv", csv_data, "text/csv")})
+    assert res.status_code == 200, res.text
+    body = res.json()
+    assert body["inserted"] == 1
+    errors = {error["row"]: error["errors"][0]["field"] for error in body["errors"]}
+    assert errors == {3: "category", 4: "name", 5: "name", 6: "name", 7: "is_available"}
+
+    items = client.get("/items/", params={"name": fresh}).json()
+    assert [(item["name"], item["is_available"], item["category_id"]) for item in items] == [(fresh, True, category["id"])]
+
+
+def test_import_csv_malformed_row(client):
+    # 読み取れない行（セルが csv.field_size_limit を超える）はその行だけエラーにし、前後の行は登録する
+    first, last = unique("first"), unique("last")
+    csv_data = f"name,location\n{first},A\n{'x' * (csv.field_size_limit() + 1)},B\n{last},C\n"
+    res = client.post("/items/import", files={"file": ("items.csv", csv_data, "text/csv")})
+    assert res.status_code == 200, res.text
+    body = res.json()
+    assert body["inserted"] == 2
+    assert [error["row"] for error in body["errors"]] == [3]
+    assert "CSV" in body["errors"][0]["errors"][0]["message"]
@@ -0,0 +1,58 @@
+from app import loans
+
+
+def borrow(client, me, item):
+    return client.post("/transactions/", json={"item_id": item["id"], "user_id": me["id"], "type": "borrow"})
+
+
+def current_loan(client, item):
+    res = client.get(f"/items/{item['id']}/current-loan")
+    assert res.status_code == 200, res.text
+    return res.json()
+
+
+def drift(db, *items):
+    ids = {item["id"] for item in items}
+    return [row for row in loans.verify(db) if row["item_id"] in ids]
+
+
+def test_current_loan_follows_request_approval_and_return(client, db, me, make_item):
+    item = make_item()
+    assert current_loan(client, item) is None
+
+    # 申請
+    tx = borrow(client, me, item).json()
+    loan = current_loan(client, item)
+    assert (loan["transaction_id"], loan["user_id"], loan["status"], loan["due_date"]) == (tx["id"], me["id"], "request", None)
+    assert tx["id"] in [row["transaction_id"] for row in client.get(f"/users/{me['id']}/loans").json()]
+    assert drift(db, item) == []
+
+    # 承認（返却期限も写す）
+    approved = client.patch(f"/transactions/{tx['id']}", params={"status": "approved"}).json()
+    loan = current_loan(client, item)
+    assert (loan["transaction_id"], loan["status"]) == (tx["id"], "approved")
+    assert loan["due_date"] == approved["due_date"]
+    assert drift(db, item) == []
+
+    # 返却
+    assert client.post(f"/return/{tx['id']}").status_code == 200
+    assert current_loan(client, item) is None
+    assert tx["id"] not in [row["transaction_id"] for row in client.get(f"/users/{me['id']}/loans").json()]
+    assert drift(db, item) == []
+
+
+def test_current_loan_cleared_by_reject_and_cancel(client, db, me, make_item):
+    rejected_item, cancelled_item = make_item(), make_item()
+    rejected = borrow(client, me, rejected_item).json()
+    cancelled = borrow(client, me, cancelled_item).json()
+
+    assert client.patch("/transactions/batch", json={"ids": [rejected["id"]], "status": "rejected"}).status_code == 200
+    assert client.post(f"/cancel/{cancelled['id']}").status_code == 200
+    assert current_loan(client, rejected_item) is None
+    assert current_loan(client, cancelled_item) is None
+    assert drift(db, rejected_item, cancelled_item) == []
+
+    # 空いた物品はまた借りられ、新しい申請が今の貸出になる
+    again = borrow(client, me, rejected_item).json()
+    assert current_loan(client, rejected_item)["transaction_id"] == again["id"]
+    assert drift(db, rejected_item) == []
@@ -0,0 +1,17 @@
+from fastapi.testclient import TestClient
+
+from app.config import get_settings
+from app.main import app
+
+
+def test_metrics_requires_admin_or_token(client, monkeypatch):
+    assert client.get("/metrics").status_code == 200
+
+    anonymous = TestClient(app)
+    assert anonymous.get("/metrics").status_code == 401
+
+    monkeypatch.setattr(get_settings(), "metrics_token", "scrape-token")
+    assert anonymous.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    res = anonymous.get("/metrics", headers={"Authorization": "Bearer scrape-token"})
+    assert res.status_code == 200
+    assert "http_request_duration_seconds_bucket" in res.text
@@ -0,0 +1,35 @@
+import pytest
+
+from app import metrics
+
+from .conftest import unique
+from .query_budgets import BUDGETS
+
+# エンドポイントごとの SQL 実行回数の上限（benchmarks/query_budget.py と同じ表）
+# 一覧が複数行を返す状態で測り、行数に比例してクエリが増えない（N+1 がない）ことを確かめる
+
+
+@pytest.fixture(scope="module")
+def item_id(client):
+    categories = [client.post("/categories/", json={"name": unique("budget")}).json() for _ in range(2)]
+    me = client.get("/me").json()
+    ids = []
+    for i in range(5):
+        category_id = categories[i % 2]["id"]
+        item = client.post("/items/", json={"name": unique(f"budget-pc{i}"), "category_id": category_id}).json()
+        ids.append(item["id"])
+    for item_id in ids[:3]:
+        res = client.post("/transactions/", json={"item_id": item_id, "user_id": me["id"], "type": "borrow"})
+        assert res.status_code == 200, res.text
+    return ids[0]
+
+
+@pytest.mark.parametrize("path,budget", BUDGETS)
+def test_query_budget(client, item_id, path, budget):
+    res = client.get(path.format(item_id=item_id))
+    assert res.status_code == 200, res.text
+    if isinstance(res.json(), list):
+        assert len(res.json()) > 1
+    count = metrics.query_count_from_header(res.headers["server-timing"])
+    assert count is not None, res.headers["server-timing"]
+    assert count <= budget
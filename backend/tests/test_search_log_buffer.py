@@ -0,0 +1,94 @@
+import time
+
+from sqlalchemy import func, select
+
+from app import models, schemas
+from app import search_log_buffer as buffer_module
+from app.search_log_buffer import SearchLogBuffer
+
+from .conftest import unique
+
+
+def add(buffer, me, keyword, n):
+    for _ in range(n):
+        assert buffer.add(schemas.SearchLogCreate(user_id=me["id"], search_keyword=keyword))
+
+
+def stored(db, keyword) -> int:
+    return db.execute(select(func.count()).select_from(models.SearchLog).where(models.SearchLog.search_keyword == keyword)).scalar()
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+class FailingSession:
+    def execute(self, *args, **kwargs):
+        raise RuntimeError("database is down")
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_flush_by_size(client, db, me):
+    # 件数がたまったら、間隔を待たずに書き出す
+    buffer = SearchLogBuffer(batch_size=3, flush_interval=60, max_pending=100)
+    keyword = unique("size")
+    buffer.start()
+    try:
+        add(buffer, me, keyword, 3)
+        wait_for(lambda: buffer.written == 3)
+    finally:
+        buffer.stop()
+    assert stored(db, keyword) == 3
+    assert buffer.flushes == 1
+
+
+def test_flush_by_interval(client, db, me):
+    # 件数に届かなくても、間隔がたてば書き出す
+    buffer = SearchLogBuffer(batch_size=100, flush_interval=0.05, max_pending=100)
+    keyword = unique("interval")
+    buffer.start()
+    try:
+        add(buffer, me, keyword, 2)
+        wait_for(lambda: buffer.written == 2)
+        assert buffer.depth() == 0
+    finally:
+        buffer.stop()
+    assert stored(db, keyword) == 2
+
+
+def test_requeue_on_failure(client, db, me, monkeypatch):
+    buffer = SearchLogBuffer(batch_size=10, flush_interval=60, max_pending=100)
+    first, second = unique("first"), unique("second")
+    add(buffer, me, first, 2)
+
+    # 書き込みに失敗した分は先頭に戻し、後から積んだ分より先に書く
+    monkeypatch.setattr(buffer_module, "SessionLocal", FailingSession)
+    assert buffer.flush() == 0
+    assert buffer.failed_flushes == 1
+    add(buffer, me, second, 1)
+    assert buffer.depth() == 3
+
+    monkeypatch.undo()
+    assert buffer.flush() == 3
+    assert (stored(db, first), stored(db, second)) == (2, 1)
+    first_ids = db.execute(select(models.SearchLog.id).where(models.SearchLog.search_keyword == first)).scalars().all()
+    second_id = db.execute(select(models.SearchLog.id).where(models.SearchLog.search_keyword == second)).scalar()
+    assert max(first_ids) < second_id
+    assert buffer.dropped == 0
+
+
+def test_stop_counts_rows_it_could_not_write(client, me, monkeypatch):
+    buffer = SearchLogBuffer(batch_size=10, flush_interval=60, max_pending=100)
+    add(buffer, me, unique("lost"), 4)
+    monkeypatch.setattr(buffer_module, "SessionLocal", FailingSession)
+    buffer.stop()
+    assert buffer.depth() == 0
+    assert buffer.dropped == 4
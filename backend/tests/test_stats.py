@@ -0,0 +1,40 @@
+from app import crud, stats
+
+from .conftest import unique
+
+
+def category_counts(client, category_id):
+    rows = {row["category_id"]: row for row in client.get("/stats/categories").json()}
+    row = rows[category_id]
+    return row["total"], row["available"], row["on_loan"]
+
+
+def test_counters_follow_every_write(client, db, me, category, make_item):
+    # 貸出・返却・一括登録・カテゴリの変更・削除のどの後でも、集計が item テーブルから数え直した値と一致する
+    items = [make_item() for _ in range(3)]
+    assert category_counts(client, category["id"]) == (3, 3, 0)
+
+    tx = client.post("/transactions/", json={"item_id": items[0]["id"], "user_id": me["id"], "type": "borrow"}).json()
+    assert client.patch(f"/transactions/{tx['id']}", params={"status": "approved"}).status_code == 200
+    assert category_counts(client, category["id"]) == (3, 2, 1)
+    assert stats.verify(db) == []
+
+    assert client.post(f"/return/{tx['id']}").status_code == 200
+    assert category_counts(client, category["id"]) == (3, 3, 0)
+    assert stats.verify(db) == []
+
+    csv_data = f"name,category,is_available\n{unique('bulk')},{category['name']},true\n{unique('bulk')},{category['name']},false\n"
+    res = client.post("/items/import", files={"file": ("items.csv", csv_data, "text/csv")})
+    assert res.json()["inserted"] == 2
+    assert category_counts(client, category["id"]) == (5, 4, 1)
+    assert stats.verify(db) == []
+
+    other = client.post("/categories/", json={"name": unique("category")}).json()
+    assert client.put(f"/items/{items[1]['id']}", json={"category_id": other["id"]}).status_code == 200
+    assert category_counts(client, category["id"]) == (4, 3, 1)
+    assert category_counts(client, other["id"]) == (1, 1, 0)
+    assert stats.verify(db) == []
+
+    assert crud.delete_item(db, items[2]["id"])
+    assert category_counts(client, category["id"]) == (3, 2, 1)
+    assert stats.verify(db) == []
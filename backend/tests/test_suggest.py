@@ -0,0 +1,77 @@
+from fastapi.testclient import TestClient
+
+from app import suggest
+from app.main import app
+
+from .conftest import unique
+
+
+def borrow(client, me, item):
+    return client.post("/transactions/", json={"item_id": item["id"], "user_id": me["id"], "type": "borrow"})
+
+
+def test_heavy_hitters_decay():
+    # 半減期 2 回分たつと、古い 4 回は 1 回分の重みになる
+    hitters = suggest.DecayedHeavyHitters(capacity=10, half_life=100.0)
+    for _ in range(4):
+        hitters.add("old", at=0.0)
+    for _ in range(2):
+        hitters.add("new", at=200.0)
+
+    top = hitters.top(10, now=200.0)
+    assert [keyword for keyword, _ in top] == ["new", "old"]
+    assert abs(top[0][1] - 2.0) < 1e-9
+    assert abs(top[1][1] - 1.0) < 1e-9
+
+
+def test_heavy_hitters_eviction():
+    # あふれたら回数が最小の語と入れ替え、新しい語はその回数を引き継ぐ
+    hitters = suggest.DecayedHeavyHitters(capacity=2, half_life=100.0)
+    for keyword, times in (("a", 3), ("b", 2), ("c", 1)):
+        for _ in range(times):
+            hitters.add(keyword, at=0.0)
+
+    assert set(hitters.counts) == {"a", "c"}
+    assert hitters.counts["c"] == [3.0, 2.0]
+    assert len(hitters.top(10, now=0.0)) == 2
+
+
+def test_prefix_index_search():
+    # 先に上位を計算しておく節点（HEAVY_NODE 件超）と、その場で並べる節点の両方
+    entries = [(f"cable {i:03d}", (i,), f"cable {i:03d}") for i in range(suggest.HEAVY_NODE * 2)]
+    entries += [("camera", (-1,), "camera"), ("usb cable", (5,), "cable 005"), ("mouse", (0,), "mouse")]
+    index = suggest.PrefixIndex(entries)
+
+    assert index.search("ca", 3) == ["camera", "cable 000", "cable 001"]
+    assert index.search("cable 01", 2) == ["cable 010", "cable 011"]
+    assert index.search("", 4) == ["camera", "cable 000", "mouse", "cable 001"]
+    # 同じ値は 1 つにまとめる（"cable 005" と "usb cable" は同じ値）
+    assert index.search("", 10) == ["camera", "cable 000", "mouse"] + [f"cable {i:03d}" for i in range(1, 8)]
+    assert index.search("usb", 5) == ["cable 005"]
+    assert index.search("zzz", 5) == []
+
+
+def test_item_index_follows_item_changes(client, me, make_item):
+    suggester = suggest.Suggester(capacity=10)
+    name = unique("Suggest Camera")
+    item = make_item(name=name)
+    suggester.refresh()
+    assert {"id": item["id"], "name": name} in suggester.suggest(name[:12], 10)["items"]
+    builds = suggester.item_builds
+
+    # 貸出では作り直さない
+    assert borrow(client, me, item).status_code == 200
+    suggester.refresh()
+    assert suggester.item_builds == builds
+
+    # 物品の名前を変えたら、次の更新ですぐに作り直す
+    renamed = unique("Suggest Lens")
+    assert client.put(f"/items/{item['id']}", json={"name": renamed}).status_code == 200
+    suggester.refresh()
+    assert suggester.item_builds == builds + 1
+    assert suggester.suggest(renamed[:12], 10)["items"] == [{"id": item["id"], "name": renamed}]
+
+
+def test_suggest_requires_login(client):
+    assert TestClient(app).get("/suggest", params={"q": "a"}).status_code == 401
+    assert client.get("/suggest", params={"q": "a"}).status_code == 200
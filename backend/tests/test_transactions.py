@@ -0,0 +1,115 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from app import crud, models, schemas, stats
+
+from .conftest import unique
+
+
+def borrow(client, me, item):
+    return client.post("/transactions/", json={"item_id": item["id"], "user_id": me["id"], "type": "borrow"})
+
+
+def test_borrow_conflict(client, me, make_item):
+    item = make_item()
+    assert borrow(client, me, item).status_code == 200
+
+    res = borrow(client, me, item)
+    assert res.status_code == 409
+    assert client.get(f"/items/{item['id']}").json()["is_available"] is False
+
+
+def test_batch_status_outcomes(client, me, make_item):
+    first = borrow(client, me, make_item()).json()
+    second = borrow(client, me, make_item()).json()
+    approved = borrow(client, me, make_item()).json()
+    assert client.patch(f"/transactions/{approved['id']}", params={"status": "approved"}).status_code == 200
+
+    missing = max(first["id"], second["id"], approved["id"]) + 100000
+    res = client.patch("/transactions/batch", json={
+        "ids": [second["id"], missing, approved["id"], first["id"], second["id"]],
+        "status": "rejected",
+    })
+    assert res.status_code == 200, res.text
+    body = res.json()
+    # 重複した id は 1 つにまとめ、指定した順で結果を返す
+    assert body["updated"] == 2
+    assert body["results"] == [
+        {"id": second["id"], "outcome": "updated"},
+        {"id": missing, "outcome": "not_found"},
+        {"id": approved["id"], "outcome": "not_pending"},
+        {"id": first["id"], "outcome": "updated"},
+    ]
+    # 却下した申請の物品は貸出可能に戻る
+    assert client.get(f"/items/{first['item_id']}").json()["is_available"] is True
+
+
+def test_overdue_selection(client, db, me, make_item):
+    # 承認済みで返却期限を過ぎたものだけが延滞（申請中・期限前のものは含めない）
+    overdue, upcoming, requested = (borrow(client, me, make_item()).json() for _ in range(3))
+    for tx in (overdue, upcoming):
+        assert client.patch(f"/transactions/{tx['id']}", params={"status": "approved"}).status_code == 200
+
+    now = datetime.now()
+    due_dates = {overdue["id"]: now - timedelta(days=1), upcoming["id"]: now + timedelta(days=1), requested["id"]: now - timedelta(days=1)}
+    for transaction_id, due_date in due_dates.items():
+        db.execute(update(models.ItemCurrentLoan).where(models.ItemCurrentLoan.transaction_id == transaction_id).values(due_date=due_date))
+        db.execute(update(models.ItemTransaction).where(models.ItemTransaction.id == transaction_id).values(due_date=due_date))
+    db.commit()
+
+    res = client.get("/overdue", params={"limit": 1000})
+    assert res.status_code == 200, res.text
+    found = {row["transaction_id"] for row in res.json()}
+    assert overdue["id"] in found
+    assert upcoming["id"] not in found
+    assert requested["id"] not in found
+
+
+def test_approval_sets_due_date(client, me, category, make_item):
+    tx = borrow(client, me, make_item()).json()
+    assert tx["due_date"] is None
+
+    res = client.patch(f"/transactions/{tx['id']}", params={"status": "approved"})
+    assert res.status_code == 200, res.text
+    assert res.json()["due_date"] is not None
+
+
+def test_update_item_availability(client, db, me, make_item, monkeypatch):
+    item = make_item()
+    assert borrow(client, me, item).status_code == 200
+
+    # 手で貸出可能に戻すと、集計も今の貸出も合わせて変わる
+    res = client.put(f"/items/{item['id']}", json={"is_available": True})
+    assert res.status_code == 200, res.text
+    assert res.json()["is_available"] is True
+    assert db.get(models.ItemCurrentLoan, item["id"]) is None
+    assert stats.verify(db) == []
+    # 同じ状態を指定しても競合にはしない
+    assert client.put(f"/items/{item['id']}", json={"is_available": True}).status_code == 200
+
+    # 読んでから書くまでに他の人が借りたら 409（名前の変更も書き込まない）
+    real = crud.set_item_available
+
+    def racing(db, item_id, is_available):
+        db.execute(update(models.Item).where(models.Item.id == item_id).values(is_available=is_available))
+        return real(db, item_id, is_available)
+
+    monkeypatch.setattr(crud, "set_item_available", racing)
+    res = client.put(f"/items/{item['id']}", json={"name": unique("renamed"), "is_available": False})
+    assert res.status_code == 409, res.text
+    monkeypatch.undo()
+    assert client.get(f"/items/{item['id']}").json()["name"] == item["name"]
+
+
+def test_update_status_rejects_other_transitions(client, db, me, make_item):
+    tx = borrow(client, me, make_item()).json()
+    for status in ("returned", "request", "anything"):
+        assert client.patch(f"/transactions/{tx['id']}", params={"status": status}).status_code == 400
+    assert db.get(models.ItemTransaction, tx["id"]).status == "request"
+
+
+def test_batch_size_limits(client):
+    assert client.patch("/transactions/batch", json={"ids": [], "status": "approved"}).status_code == 422
+    ids = list(range(1, schemas.TRANSACTION_BATCH_MAX + 2))
+    assert client.patch("/transactions/batch", json={"ids": ids, "status": "approved"}).status_code == 422
@@ -0,0 +1,77 @@
+from datetime import date
+
+from fastapi.testclient import TestClient
+
+from app import crud, models
+from app.cache import user_cache
+from app.main import app
+
+from .conftest import unique
+
+
+def test_update_user_rehashes_password(client):
+    email = f"{unique('user')}@example.com"
+    user = client.post("/users/", json={"name": "u", "email": email, "grade": "M1", "password": "old-pw"}).json()
+
+    res = client.put(f"/users/{user['id']}", json={"grade": "M2", "password": "new-pw"})
+    assert res.status_code == 200, res.text
+    assert res.json()["grade"] == "M2"
+
+    other = TestClient(app)
+    assert other.post("/login", json={"email": email, "password": "old-pw"}).status_code == 400
+    assert other.post("/login", json={"email": email, "password": "new-pw"}).status_code == 200
+
+
+def test_school_year_starts_in_april():
+    assert crud.school_year(date(2026, 3, 31)) == 2025
+    assert crud.school_year(date(2026, 4, 1)) == 2026
+
+
+def test_grade_promotion_dry_run_and_rerun(client, db):
+    users = {
+        grade: client.post("/users/", json={"name": "u", "email": f"{unique('grade')}@example.com", "grade": grade, "password": "pw"}).json()["id"]
+        for grade in ("U4", "M2")
+    }
+
+    def state(user_id):
+        db.expire_all()
+        user = db.get(models.User, user_id)
+        return user.grade.value, user.is_active, user.promoted_year
+
+    # 既定は dry_run（数えるだけで書き込まない）
+    res = client.post("/admin/promote-grades", params={"year": 2100})
+    assert res.status_code == 200, res.text
+    assert res.json()["dry_run"] is True
+    assert res.json()["updated"] >= 2
+    assert [state(users["U4"]), state(users["M2"])] == [("U4", True, None), ("M2", True, None)]
+
+    res = client.post("/admin/promote-grades", params={"year": 2100, "dry_run": False})
+    assert res.status_code == 200, res.text
+    assert [state(users["U4"]), state(users["M2"])] == [("M1", True, 2100), ("OB_OG", False, 2100)]
+
+    # 同じ年度にもう一度実行しても、誰も変わらない
+    res = client.post("/admin/promote-grades", params={"year": 2100, "dry_run": False})
+    assert res.json()["updated"] == 0
+    assert [state(users["U4"]), state(users["M2"])] == [("M1", True, 2100), ("OB_OG", False, 2100)]
+
+
+def test_user_cache_invalidated_on_update_and_password_change(client):
+    email = f"{unique('cached')}@example.com"
+    user = client.post("/users/", json={"name": "u", "email": email, "grade": "M1", "password": "pw-1"}).json()
+    own = TestClient(app)
+    assert own.post("/login", json={"email": email, "password": "pw-1"}).status_code == 200
+    assert own.get("/me").json()["grade"] == "M1"
+    assert user_cache.get(user["id"]) is not None
+
+    # 管理者の変更はキャッシュを捨て、次のリクエストから新しい値になる
+    assert client.put(f"/users/{user['id']}", json={"grade": "M2"}).status_code == 200
+    assert user_cache.get(user["id"]) is None
+    assert own.get("/me").json()["grade"] == "M2"
+
+    # パスワードの変更でもキャッシュを捨てる
+    assert user_cache.get(user["id"]) is not None
+    res = own.post("/change-password", json={"current_password": "pw-1", "new_password": "pw-2"})
+    assert res.status_code == 200, res.text
+    assert user_cache.get(user["id"]) is None
+    assert TestClient(app).post("/login", json={"email": email, "password": "pw-1"}).status_code == 400
+    assert own.post("/login", json={"email": email, "password": "pw-2"}).status_code == 200
@@ -23,6 +23,8 @@ type Item = {
   category_id: number | null;
   category?: { name: string };
   image_path: string;
+  thumbnail_url: string | null; // アップロードした画像の縮小版（API の絶対 URL）
+  image_url: string | null;     // アップロードした画像の詳細表示用
   is_available: boolean;
   location: string | null;
   notes: string | null;
@@ -36,6 +38,9 @@ type Category = {
 
 const API_URL = import.meta.env.VITE_API_URL;
 
+// アップロードした画像は API が返す URL を使い、それ以外（以前の手入力のファイル名）は public/images から表示する
+const imageSrc = (item: Item, url: string | null) => url || `/images/${item.image_path || "noImage.jpg"}`;
+
 const ItemDetailPage = () => {
   const { id } = useParams<{ id: string }>();
   const navigate = useNavigate();
@@ -122,7 +127,7 @@ const ItemDetailPage = () => {
     const borrowedItem = {
       id: item!.id,
       name: item!.name,
-      image_path: `/images/${item!.image_path}`,
+      image_path: imageSrc(item!, item!.thumbnail_url),
       requestDate: requestData,
       status: "承認待ち",
     };
@@ -176,7 +181,7 @@ const ItemDetailPage = () => {
       <Box display="flex" gap={8} alignItems="flex-start">
         {/* 画像 */}
         <Image
-          src={`/images/${item.image_path || "noImage.jpg"}`}
+          src={imageSrc(item, item.thumbnail_url)}
           alt={item.name}
           boxSize="300px"
           objectFit="cover"
@@ -255,7 +260,7 @@ const ItemDetailPage = () => {
           onClick={() => setIsZoomed(false)}
         >
           <Image
-            src={`/images/${item.image_path || "noImage.jpg"}`}
+            src={imageSrc(item, item.image_url)}
             alt={item.name}
             maxW="90%"
             maxH="90%"
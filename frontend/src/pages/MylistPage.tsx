@@ -90,7 +90,8 @@ const MylistPage = () => {
       );
 
       const historyRes = await axios.get(`${API_URL}/transactions/`, {
-        params: { user_id: userId, status: "returned" },
+        // 古い返却済みの取引はアーカイブに移っているので、履歴はアーカイブも含めて取得する
+        params: { user_id: userId, status: "returned", include_archive: true },
         withCredentials: true,
       });
       setHistory(